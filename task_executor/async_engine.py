@@ -0,0 +1,136 @@
+import asyncio
+import datetime
+import logging
+import time
+import traceback
+from typing import Callable, List, Set
+from .callable_runner import CallableRunner, describe, is_callable_task
+from .model.orm import Task
+from .output_capture import OutputPolicy
+from .process_runner import TimeoutPolicy, run_process_async
+from .result_cache import ResultCache
+from .result_writer import Completion
+from .throttle import AimdController, RateLimiter
+
+
+class AsyncEngine:
+    """
+    Run shell command tasks with asyncio subprocesses instead of one OS thread per command.
+
+    Up to concurrency commands are in flight at once, bounded by a semaphore. Their pipes are
+    read without blocking by the event loop, so hundreds to thousands of I/O bound commands
+    can run from one process. Batches are claimed on a helper thread while commands run and
+    every finished task is handed to complete (e.g. ResultWriter.submit) as a Completion,
+    with the same status and task log message as the thread engine. Output is captured
+    as it is produced, bounded by output_policy, and commands running longer than their
+    timeout_policy timeout are killed with their process group. With a ResultCache, cached
+    results are reused and identical commands in flight wait for the first one outside of
+    the concurrency slots. With metrics (a metrics.Metrics) busy slots are counted. A rate_limiter
+    spaces out the command starts of each tag and a concurrency_controller (AimdController) keeps
+    fewer than concurrency commands in flight while the backend is throttling. Python callable
+    tasks are awaited on the pool of callables (a CallableRunner) without blocking the loop.
+
+    Each running command holds three file descriptors, raise `ulimit -n` accordingly.
+    """
+
+    def __init__(self, claim: Callable[[int], List[Task]], complete: Callable[[Completion], None],
+                 batch_size: int, concurrency: int, progress=None, output_policy: OutputPolicy = None,
+                 timeout_policy: TimeoutPolicy = None, idle: Callable[[], bool] = None, cache: ResultCache = None,
+                 metrics=None, rate_limiter: RateLimiter = None, concurrency_controller: AimdController = None,
+                 callables: CallableRunner = None):
+        self.claim = claim
+        self.complete = complete
+        self.batch_size = int(batch_size)
+        self.concurrency = int(concurrency)
+        self.progress = progress
+        self.output_policy = output_policy or OutputPolicy()
+        self.timeout_policy = timeout_policy or TimeoutPolicy()
+        self.idle = idle
+        self.cache = cache
+        self.metrics = metrics
+        self.rate_limiter = rate_limiter
+        self.concurrency_controller = concurrency_controller
+        # A runner of its own when none is given, closed at the end of run
+        self.own_callables = callables is None
+        self.callables = callables or CallableRunner()
+        self.finished = 0
+        self.logger = logging.getLogger(__class__.__name__)
+
+    def run(self) -> int:
+        try:
+            asyncio.run(self.__main())
+        finally:
+            if self.own_callables:
+                self.callables.close()
+        self.logger.info(f"Async engine finished {self.finished} tasks")
+        return self.finished
+
+    async def __main(self) -> None:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        in_flight: Set[asyncio.Task] = set()
+        exhausted = False
+
+        while True:
+            # Keep at most one batch waiting on the semaphore on top of the running commands
+            while not exhausted and len(in_flight) < self.concurrency + self.batch_size:
+                batch = await asyncio.to_thread(self.claim, self.batch_size)
+                if not batch:
+                    exhausted = True
+                    break
+                for task in batch:
+                    in_flight.add(asyncio.create_task(self.__run_task(semaphore, task)))
+            if not in_flight:
+                # Same contract as StreamingScheduler idle
+                if self.idle is not None and await asyncio.to_thread(self.idle):
+                    exhausted = False
+                    continue
+                break
+            done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    self.logger.error(future.exception())
+
+    async def __run_task(self, semaphore: asyncio.Semaphore, task: Task) -> None:
+        created_at = datetime.datetime.now()
+        execute = lambda: self.__execute(semaphore, task, created_at)
+        completion = await (self.cache.run_async(task, created_at, execute) if self.cache is not None else execute())
+
+        self.complete(completion.track(task))
+        self.finished += 1
+        if self.progress is not None:
+            self.progress.update(1)
+        self.logger.info(f"Status: {completion.status}, TaskId: {task.id} finished.")
+
+    async def __execute(self, semaphore: asyncio.Semaphore, task: Task, created_at) -> Completion:
+        if self.concurrency_controller is None:
+            return await self.__run_command(semaphore, task, created_at)
+        slot = await self.concurrency_controller.acquire_async()
+        completion = None
+        try:
+            completion = await self.__run_command(semaphore, task, created_at)
+            return completion
+        finally:
+            self.concurrency_controller.release(slot, completion)
+
+    async def __run_command(self, semaphore: asyncio.Semaphore, task: Task, created_at) -> Completion:
+        async with semaphore:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.wait_async(task.tag)
+            self.logger.info(f"TaskId: {task.id} started")
+            if self.metrics is not None:
+                self.metrics.command_started()
+            started = time.monotonic()
+            try:
+                if is_callable_task(task.content):
+                    return await self.callables.run_async(task, created_at, self.output_policy, self.timeout_policy.timeout_for(task))
+                result = await run_process_async(task.content["command"], self.output_policy, task_id=task.id,
+                                                 timeout=self.timeout_policy.timeout_for(task),
+                                                 kill_grace=self.timeout_policy.kill_grace)
+                return Completion.from_result(task.id, result, created_at=created_at, attempts=task.attempts)
+            except Exception as e:
+                completion = Completion.from_exception(task.id, e, created_at=created_at, attempts=task.attempts)
+                self.logger.debug(f'{describe(task.content)}\nmessage: {completion.message}\nUnexpected Error: {traceback.format_exc()}')
+                return completion
+            finally:
+                if self.metrics is not None:
+                    self.metrics.command_finished(time.monotonic() - started)
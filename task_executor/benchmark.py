@@ -0,0 +1,234 @@
+"""
+Throughput benchmark of the queue and execution paths.
+
+Every layer is measured on a fresh database per queue size, the results are printed and
+written as JSON so runs of different versions can be compared:
+
+$ python -m task_executor.benchmark run --sizes=1000,10000,100000 --workers=1,8,32 --output=bench.json
+$ python -m task_executor.benchmark run --sizes=1000000 --layers=enqueue,claim --storage_profile=throughput
+
+Layers:
+    enqueue   -- add_task (one transaction per task, capped at single_max tasks), add_multi_task
+    claim     -- get_next_batch until the queue is drained
+    complete  -- update_task + add_task_log per task (capped at single_max), complete_tasks group commits
+    run       -- ShellExecutor.run_command of no-op commands, streaming scheduler (capped at run_max tasks),
+                 per worker count; latencies from claim to committed completion
+
+The report records the package version and the git commit (git describe) of the checkout.
+"""
+
+import datetime
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import tempfile
+import time
+from typing import Callable, Dict, List
+import fire
+from .executor import Executor
+from .model.orm import Status
+from .result_writer import Completion
+from .shell_executor import ShellExecutor
+from .stats import percentile
+
+CONTENT = { "command": ["true"] }
+
+
+class Measurement:
+    def __init__(self, layer: str, operation: str, size: int, workers: int = None):
+        self.layer = layer
+        self.operation = operation
+        self.size = size
+        self.workers = workers
+        self.tasks = 0
+        self.latencies: List[float] = []
+        self.started = None
+        self.seconds = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self.started
+
+    def timed(self, call: Callable, tasks: int = 1):
+        """Run call, record its latency and count it as tasks tasks."""
+        started = time.perf_counter()
+        result = call()
+        self.latencies.append(time.perf_counter() - started)
+        self.tasks += tasks
+        return result
+
+    def to_dict(self) -> Dict:
+        to_ms = lambda value: None if value is None else round(value * 1000, 4)
+        return {
+            "layer": self.layer,
+            "operation": self.operation,
+            "size": self.size,
+            "workers": self.workers,
+            "tasks": self.tasks,
+            "seconds": round(self.seconds, 6),
+            "tasks_per_sec": round(self.tasks / self.seconds, 2) if self.seconds else None,
+            "calls": len(self.latencies),
+            "p50_ms": to_ms(percentile(self.latencies, 50)),
+            "p95_ms": to_ms(percentile(self.latencies, 95)),
+            "p99_ms": to_ms(percentile(self.latencies, 99)),
+        }
+
+
+class Benchmark:
+    def __init__(self, storage_profile="balanced", batch_size=100, single_max=2000, run_max=2000):
+        self.storage_profile = storage_profile
+        self.batch_size = int(batch_size)
+        self.single_max = int(single_max)
+        self.run_max = int(run_max)
+        self.results: List[Dict] = []
+
+    def run(self, sizes="1000,10000,100000", workers="1,8,32", layers="enqueue,claim,complete,run", output=None):
+        """
+        sizes   -- queue sizes, comma separated
+        workers -- worker counts of the run layer, comma separated
+        layers  -- any of enqueue, claim, complete, run
+        output  -- JSON result file, defaults to bench-<timestamp>.json
+        """
+        sizes, workers, layers = self.__list(sizes, int), self.__list(workers, int), self.__list(layers, str)
+        with tempfile.TemporaryDirectory(prefix="task-executor-bench-") as work_dir:
+            for size in sizes:
+                if "enqueue" in layers:
+                    self.bench_enqueue(work_dir, size)
+                if "claim" in layers:
+                    self.bench_claim(work_dir, size)
+                if "complete" in layers:
+                    self.bench_complete(work_dir, size)
+                if "run" in layers:
+                    for worker_count in workers:
+                        self.bench_run(work_dir, size, worker_count)
+
+        report = {
+            "version": self.__version(),
+            "commit": self.__git("rev-parse", "HEAD"),
+            "describe": self.__git("describe", "--always", "--tags", "--dirty"),
+            "created_at": str(datetime.datetime.now()),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "storage_profile": self.storage_profile,
+            "batch_size": self.batch_size,
+            "results": self.results,
+        }
+        output = output or f"bench-{datetime.datetime.now():%Y%m%d-%H%M%S}.json"
+        with open(output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to {output}")
+
+    def bench_enqueue(self, work_dir, size):
+        executor = self.__executor(work_dir, "enqueue", size)
+        single = min(size, self.single_max)
+        with Measurement("enqueue", "add_task", single) as measurement:
+            for _ in range(single):
+                measurement.timed(lambda: executor.add_task(tag="bench-single", content=str(CONTENT)))
+        self.__record(measurement)
+
+        content_list = [ json.dumps(CONTENT) ] * min(size, 10000)
+        with Measurement("enqueue", "add_multi_task", size) as measurement:
+            for start in range(0, size, len(content_list)):
+                chunk = content_list[:size - start]
+                measurement.timed(lambda: executor.add_multi_task(tag="bench", content_list=chunk), tasks=len(chunk))
+        self.__record(measurement)
+
+    def bench_claim(self, work_dir, size):
+        executor = self.__filled_executor(work_dir, "claim", size)
+        with Measurement("claim", f"get_next_batch[{self.batch_size}]", size) as measurement:
+            while True:
+                tasks = measurement.timed(lambda: executor.get_next_batch("bench", Status.NEW, batch_size=self.batch_size), tasks=0)
+                if not tasks:
+                    break
+                measurement.tasks += len(tasks)
+        self.__record(measurement)
+
+    def bench_complete(self, work_dir, size):
+        message = { "stdout": "", "stderr": "", "returnCode": 0 }
+
+        single = min(size, self.single_max)
+        executor = self.__filled_executor(work_dir, "complete-single", single)
+        with Measurement("complete", "update_task+add_task_log", single) as measurement:
+            for task in executor.get_next_batch("bench", Status.NEW, batch_size=single):
+                def complete():
+                    executor.update_task(task, status=Status.COMPLETED_OK)
+                    executor.add_task_log(task=task, message=message, status=Status.COMPLETED_OK,
+                                          created_at=datetime.datetime.now(), updated_at=datetime.datetime.now())
+                measurement.timed(complete)
+        self.__record(measurement)
+
+        executor = self.__filled_executor(work_dir, "complete-group", size)
+        # Only claimed tasks are completed
+        executor.get_next_batch("bench", Status.NEW, batch_size=size)
+        with Measurement("complete", "complete_tasks[500]", size) as measurement:
+            for start in range(1, size + 1, 500):
+                batch = [ Completion(id, Status.COMPLETED_OK, message) for id in range(start, min(start + 500, size + 1)) ]
+                measurement.timed(lambda: executor.complete_tasks(batch), tasks=len(batch))
+        self.__record(measurement)
+
+    def bench_run(self, work_dir, size, worker_count):
+        tasks = min(size, self.run_max)
+        executor = self.__filled_executor(work_dir, f"run-{worker_count}", tasks)
+        shell = ShellExecutor(storage_profile=self.storage_profile)
+        shell.db_name = self.__db_file(work_dir, f"run-{worker_count}", tasks)
+        with Measurement("run", "run_command[stream]", tasks, worker_count) as measurement:
+            shell.run_command("bench", self.batch_size, worker_count, scheduler="stream")
+        phases = executor.get_task_phases(tag="bench")
+        measurement.tasks = len(phases)
+        measurement.latencies = [ row["total"] - row["queue_wait"] for row in phases
+                                  if row["total"] is not None and row["queue_wait"] is not None ]
+        self.__record(measurement)
+
+    def __record(self, measurement: Measurement) -> None:
+        result = measurement.to_dict()
+        self.results.append(result)
+        print(f"{result['layer']:>8} {result['operation']:<28} size={result['size']:<8} workers={result['workers'] or '-':<4} "
+              f"{result['tasks_per_sec']:>12} tasks/s  p50={result['p50_ms']}ms p95={result['p95_ms']}ms p99={result['p99_ms']}ms")
+
+    @staticmethod
+    def __db_file(work_dir, name, size) -> str:
+        return os.path.join(work_dir, f"{name}-{size}.sqlite")
+
+    def __executor(self, work_dir, name, size) -> Executor:
+        executor = Executor(db_file_full_path=self.__db_file(work_dir, name, size), storage_profile=self.storage_profile)
+        executor.create_db()
+        return executor
+
+    def __filled_executor(self, work_dir, name, size) -> Executor:
+        executor = self.__executor(work_dir, name, size)
+        for start in range(0, size, 10000):
+            executor.insert_tasks(tag="bench", contents=[ CONTENT ] * min(10000, size - start))
+        return executor
+
+    @staticmethod
+    def __list(value, cast) -> List:
+        if isinstance(value, (list, tuple)):
+            return [ cast(item) for item in value ]
+        return [ cast(item) for item in str(value).split(",") if item ]
+
+    @staticmethod
+    def __version() -> str:
+        try:
+            from importlib.metadata import version
+            return version("task_executor")
+        except Exception:
+            return "unknown"
+
+    @staticmethod
+    def __git(*args) -> str:
+        """Output of a git command run in the checkout of the package, None outside a git work tree."""
+        try:
+            return subprocess.run(["git", *args], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True,
+                                  text=True, timeout=10, check=True).stdout.strip()
+        except Exception:
+            return None
+
+
+if __name__ == "__main__":
+    fire.Fire(Benchmark)
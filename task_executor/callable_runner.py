@@ -0,0 +1,231 @@
+import asyncio
+import importlib
+import io
+import json
+import logging
+import multiprocessing
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import Executor as PoolExecutor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import Callable, Optional
+from .model.orm import Status
+from .output_capture import OutputPolicy, StreamCapture
+from .result_writer import Completion
+
+POOLS = ("process", "thread")
+
+
+def is_callable_task(content) -> bool:
+    return isinstance(content, dict) and "callable" in content
+
+
+def describe(content) -> str:
+    """What a task runs, for the logs."""
+    if is_callable_task(content):
+        return f"callable {content['callable']}"
+    return f"command {content.get('command') if isinstance(content, dict) else content}"
+
+
+@lru_cache(maxsize=1024)
+def resolve(reference: str) -> Callable:
+    """The callable of a 'package.module:function' (or 'package.module:Class.method') reference."""
+    module_name, _, name = str(reference).partition(":")
+    if not module_name or not name:
+        raise ValueError(f"callable reference must look like package.module:function: {reference}")
+    target = importlib.import_module(module_name)
+    for attribute in name.split("."):
+        target = getattr(target, attribute)
+    if not callable(target):
+        raise TypeError(f"{reference} is not callable")
+    return target
+
+
+class CaptureStream(io.TextIOBase):
+    """sys.stdout or sys.stderr replacement sending the writes of a thread running a call to its capture."""
+
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def write(self, text: str) -> int:
+        capture: StreamCapture = getattr(self.local, "capture", None)
+        if capture is None:
+            return self.default.write(text)
+        capture.feed(text.encode(errors="replace"))
+        return len(text)
+
+    def flush(self) -> None:
+        if getattr(self.local, "capture", None) is None:
+            self.default.flush()
+
+
+def capture_streams() -> tuple:
+    """Install the CaptureStreams once per process."""
+    if not isinstance(sys.stdout, CaptureStream):
+        sys.stdout = CaptureStream(sys.stdout)
+    if not isinstance(sys.stderr, CaptureStream):
+        sys.stderr = CaptureStream(sys.stderr)
+    return sys.stdout, sys.stderr
+
+
+def call(reference: str, args, kwargs, policy: OutputPolicy, task_id) -> dict:
+    """
+    Run one callable task, in a pool process or thread, and return its outcome as plain data.
+    What it prints goes to its stdout and stderr, bounded by policy, its return value must be
+    JSON serializable, otherwise its repr() is kept. An exception ends it with return code 1.
+    """
+    out, err = capture_streams()
+    stdout, stderr = policy.capture(task_id, "stdout"), policy.capture(task_id, "stderr")
+    out.local.capture, err.local.capture = stdout, stderr
+    started = time.monotonic()
+    outcome = { "returnCode": 0 }
+    try:
+        result = resolve(reference)(*(args or ()), **(kwargs or {}))
+        try:
+            json.dumps(result)
+            outcome["result"] = result
+        except (TypeError, ValueError):
+            outcome["result"] = repr(result)
+    except SystemExit as e:
+        return_code = e.code if isinstance(e.code, int) else 0 if e.code is None else 1
+        outcome = { "returnCode": return_code, "error": f"SystemExit: {e.code}" } if return_code else outcome
+    except Exception as e:
+        outcome = { "returnCode": 1, "error": f"{type(e).__name__}: {e}", "traceback": traceback.format_exc() }
+    finally:
+        out.local.capture = err.local.capture = None
+        stdout.close()
+        stderr.close()
+    return dict(outcome, duration=time.monotonic() - started, stdout=stdout.text(), stderr=stderr.text(),
+                stdout_bytes=stdout.total_bytes, stderr_bytes=stderr.total_bytes,
+                stdout_path=stdout.spilled_to, stderr_path=stderr.spilled_to)
+
+
+class CallableRunner:
+    """
+    Run {"callable": "package.module:function", "args": [...], "kwargs": {...}} tasks on a warm pool.
+
+    pool -- 'process' (default) for CPU bound work, a ProcessPoolExecutor of spawned interpreters
+            that import the modules once and then run call after call, or 'thread' for I/O bound
+            work, run in this process
+    max_workers -- size of the pool, the number of CPUs by default for processes
+
+    The outcome goes through the usual Completion path: COMPLETED_OK with {"result", "stdout",
+    "stderr", "returnCode": 0} in the task log, COMPLETED_ERROR with the error and its traceback
+    when the callable raises. After its timeout a task ends as TIMED_OUT but the call cannot be
+    interrupted, it keeps its pool worker until it returns. A call killing its pool process
+    (os._exit, crash, OOM kill) ends as COMPLETED_ERROR and the next call starts a new pool.
+
+    runner = CallableRunner(pool='process', max_workers=8)
+    completion = runner.run(task, created_at, policy, timeout=60)
+    runner.close()
+    """
+
+    def __init__(self, pool: str = "process", max_workers: int = None):
+        if pool not in POOLS:
+            raise ValueError(f"unknown callable pool: {pool}, use either process or thread")
+        self.pool = pool
+        self.max_workers = int(max_workers) if max_workers else None
+        self.executor: Optional[PoolExecutor] = None
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__class__.__name__)
+
+    def submit(self, task, policy: OutputPolicy) -> Future:
+        return self.__submit(task, policy)[1]
+
+    def run(self, task, created_at, policy: OutputPolicy = None, timeout: float = None) -> Completion:
+        pool, future = self.__submit(task, policy or OutputPolicy())
+        try:
+            outcome = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            return self.timed_out(task, created_at, timeout)
+        except BrokenProcessPool as e:
+            self.__discard(pool)
+            return self.crashed(task, created_at, e)
+        return self.completion(task, created_at, outcome)
+
+    async def run_async(self, task, created_at, policy: OutputPolicy = None, timeout: float = None) -> Completion:
+        pool, future = self.__submit(task, policy or OutputPolicy())
+        try:
+            outcome = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+        except asyncio.TimeoutError:
+            return self.timed_out(task, created_at, timeout)
+        except BrokenProcessPool as e:
+            self.__discard(pool)
+            return self.crashed(task, created_at, e)
+        return self.completion(task, created_at, outcome)
+
+    @staticmethod
+    def completion(task, created_at, outcome: dict) -> Completion:
+        return_code = outcome["returnCode"]
+        message = { name: outcome[name] for name in ("result", "error", "traceback", "stdout", "stderr", "returnCode")
+                    if name in outcome }
+        return Completion(task.id, Status.COMPLETED_OK if return_code == 0 else Status.COMPLETED_ERROR, message,
+                          created_at=created_at, return_code=return_code, stdout_bytes=outcome["stdout_bytes"],
+                          stderr_bytes=outcome["stderr_bytes"], duration=outcome["duration"],
+                          stdout_path=outcome["stdout_path"], stderr_path=outcome["stderr_path"],
+                          attempts=task.attempts, spawn_duration=0.0)
+
+    @staticmethod
+    def timed_out(task, created_at, timeout: float) -> Completion:
+        message = { "error": f"timed out after {timeout} seconds", "returnCode": -1, "timedOut": True }
+        return Completion(task.id, Status.TIMED_OUT, message, created_at=created_at, return_code=-1,
+                          duration=float(timeout), attempts=task.attempts)
+
+    @staticmethod
+    def crashed(task, created_at, error: Exception) -> Completion:
+        message = { "error": f"{type(error).__name__}: {error}", "returnCode": 1 }
+        return Completion(task.id, Status.COMPLETED_ERROR, message, created_at=created_at, return_code=1,
+                          attempts=task.attempts)
+
+    def close(self) -> None:
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            self.__shutdown(executor)
+
+    @staticmethod
+    def __shutdown(executor: PoolExecutor) -> None:
+        """Stop executor without waiting: a timed out call may never return, its pool process is terminated."""
+        processes = list((getattr(executor, "_processes", None) or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    def __discard(self, pool: PoolExecutor) -> None:
+        """Forget a broken pool, unless another call already replaced it, the next call starts a new one."""
+        with self.lock:
+            if self.executor is not pool:
+                return
+            self.executor = None
+        self.logger.warning(f"The {self.pool} pool of callable tasks broke, starting a new one")
+        self.__shutdown(pool)
+
+    def __submit(self, task, policy: OutputPolicy) -> tuple:
+        content = task.content
+        arguments = (call, content["callable"], content.get("args"), content.get("kwargs"), policy, task.id)
+        pool = self.__pool()
+        try:
+            return pool, pool.submit(*arguments)
+        except BrokenProcessPool:
+            # Broken by a call of another thread, this task did not run yet
+            self.__discard(pool)
+            pool = self.__pool()
+            return pool, pool.submit(*arguments)
+
+    def __pool(self) -> PoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                if self.pool == "process":
+                    # spawn: the parent runs threads and holds database connections, not safe to fork
+                    self.executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                        mp_context=multiprocessing.get_context("spawn"))
+                else:
+                    self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="callable")
+                self.logger.info(f"Started a {self.pool} pool for callable tasks")
+            return self.executor
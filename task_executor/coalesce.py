@@ -0,0 +1,214 @@
+import logging
+import os
+import queue
+import selectors
+import shlex
+import shutil
+import signal
+import subprocess
+import tempfile
+import time
+from typing import List, Optional
+from .output_capture import OutputPolicy, StreamCapture
+from .process_runner import KILL_GRACE, READ_SIZE, ProcessResult
+
+# Prefix of the lines the shell writes back on its stdout, the commands write to files
+MARKER = "__task_executor__"
+# Longest wait for the shell to report the pid of a command it forked
+SPAWN_TIMEOUT = 30
+
+
+class ShellError(Exception):
+    """The shell co-process died or stopped answering, it is not reused."""
+
+
+class ShellSession:
+    """
+    A long lived bash co-process running commands one after the other.
+
+    Each command is written to the shell as one line: it runs as a background job of its own
+    (job control is on, so every job gets its own process group and can be killed alone),
+    with stdout and stderr redirected to files of work_dir and stdin from /dev/null, then the
+    shell echoes the job pid and, once the job is over, its return code. The output files are
+    read back through the OutputPolicy as run_process would capture the pipes, then removed.
+
+    A command forks the shell, no new interpreter is started and Python spawns nothing, which
+    halves the overhead of millisecond commands. Commands run in a subshell, so one cannot
+    change the directory or the environment of the next ones. Unlike run_process, a missing
+    command ends with return code 127 and "command not found" in its stderr.
+    """
+
+    def __init__(self, work_dir: Optional[str] = None, shell: str = "bash"):
+        self.work_dir = tempfile.mkdtemp(prefix="task-executor-shell-", dir=work_dir)
+        self.process = subprocess.Popen([shell, "--noprofile", "--norc"], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, start_new_session=True)
+        self.buffer = bytearray()
+        self.count = 0
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.process.stdout, selectors.EVENT_READ)
+        self.send("set -m")
+        self.logger = logging.getLogger(__class__.__name__)
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def send(self, line: str) -> None:
+        try:
+            self.process.stdin.write(line.encode() + b"\n")
+            self.process.stdin.flush()
+        except (BrokenPipeError, ValueError) as e:
+            raise ShellError(f"shell is gone: {e}")
+
+    def read_line(self, timeout: Optional[float]) -> Optional[str]:
+        """Next marker line of the shell, None when timeout seconds pass first."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while b"\n" not in self.buffer:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+            if not self.selector.select(remaining):
+                continue
+            chunk = os.read(self.process.stdout.fileno(), READ_SIZE)
+            if not chunk:
+                raise ShellError("shell exited")
+            self.buffer += chunk
+        line, _, rest = bytes(self.buffer).partition(b"\n")
+        self.buffer = bytearray(rest)
+        return line.decode(errors="replace")
+
+    def expect(self, kind: str, token: str, timeout: Optional[float]) -> Optional[str]:
+        line = self.read_line(timeout)
+        if line is None:
+            return None
+        parts = line.split()
+        if parts[:3] != [MARKER, kind, token] or len(parts) != 4:
+            raise ShellError(f"unexpected shell output: {line[:200]}")
+        return parts[3]
+
+    def run(self, command: List[str], policy: Optional[OutputPolicy] = None, task_id=None,
+            timeout: Optional[float] = None, kill_grace: float = KILL_GRACE) -> ProcessResult:
+        policy = policy or OutputPolicy()
+        self.count += 1
+        token = str(self.count)
+        stdout_file = os.path.join(self.work_dir, f"{token}.stdout")
+        stderr_file = os.path.join(self.work_dir, f"{token}.stderr")
+        script = " ".join(shlex.quote(str(arg)) for arg in command)
+        started = time.monotonic()
+        self.send(f"( {script} ) >{shlex.quote(stdout_file)} 2>{shlex.quote(stderr_file)} </dev/null & "
+                  f"echo \"{MARKER} pid {token} $!\"; wait $!; echo \"{MARKER} rc {token} $?\"")
+        pid = self.expect("pid", token, SPAWN_TIMEOUT)
+        if pid is None:
+            raise ShellError("shell did not start the command")
+        pid = int(pid)
+        spawn_duration = time.monotonic() - started
+
+        timed_out = False
+        deadline = started + float(timeout) if timeout else None
+        return_code = self.expect("rc", token, None if deadline is None else max(0, deadline - time.monotonic()))
+        if return_code is None:
+            timed_out = True
+            self.__signal(pid, signal.SIGTERM)
+            return_code = self.expect("rc", token, kill_grace)
+            if return_code is None:
+                self.__signal(pid, signal.SIGKILL)
+                return_code = self.expect("rc", token, None)
+        return_code = int(return_code)
+        if timed_out and return_code > 128:
+            # As subprocess reports a command killed by a signal
+            return_code = 128 - return_code
+        duration = time.monotonic() - started
+
+        stdout, stderr = policy.capture(task_id, "stdout"), policy.capture(task_id, "stderr")
+        try:
+            for path, capture in ((stdout_file, stdout), (stderr_file, stderr)):
+                self.__collect(path, capture)
+        finally:
+            stdout.close()
+            stderr.close()
+        return ProcessResult(return_code, stdout, stderr, duration, timed_out, spawn_duration)
+
+    def close(self) -> None:
+        try:
+            if self.alive:
+                self.process.stdin.close()
+                try:
+                    self.process.wait(timeout=KILL_GRACE)
+                except subprocess.TimeoutExpired:
+                    os.killpg(self.process.pid, signal.SIGKILL)
+                    self.process.wait()
+        except (OSError, ValueError) as e:
+            self.logger.debug(e)
+        finally:
+            self.selector.close()
+            self.process.stdout.close()
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    @staticmethod
+    def __collect(path: str, capture: StreamCapture) -> None:
+        try:
+            with open(path, "rb") as file:
+                while True:
+                    chunk = file.read(READ_SIZE)
+                    if not chunk:
+                        break
+                    capture.feed(chunk)
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def __signal(pid: int, sig) -> None:
+        try:
+            os.killpg(pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+class ShellPool:
+    """
+    ShellSessions shared by the worker threads, at most one command per session at a time.
+
+    Sessions are started on demand, so there are as many as commands running at once, and a
+    session is replaced after max_commands commands or when its shell dies.
+
+    pool = ShellPool()
+    result = pool.run(task.content["command"], policy, task_id=task.id, timeout=30)
+    pool.close()
+    """
+
+    def __init__(self, work_dir: Optional[str] = None, max_commands: int = 10000, shell: str = "bash"):
+        self.work_dir = work_dir
+        self.max_commands = int(max_commands)
+        self.shell = shell
+        self.idle: "queue.LifoQueue[ShellSession]" = queue.LifoQueue()
+        self.started = 0
+        self.logger = logging.getLogger(__class__.__name__)
+
+    def run(self, command: List[str], policy: Optional[OutputPolicy] = None, task_id=None,
+            timeout: Optional[float] = None, kill_grace: float = KILL_GRACE) -> ProcessResult:
+        session = self.__take()
+        try:
+            result = session.run(command, policy, task_id=task_id, timeout=timeout, kill_grace=kill_grace)
+        except Exception:
+            session.close()
+            raise
+        if session.alive and session.count < self.max_commands:
+            self.idle.put(session)
+        else:
+            session.close()
+        return result
+
+    def close(self) -> None:
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def __take(self) -> ShellSession:
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            self.started += 1
+            return ShellSession(self.work_dir, self.shell)
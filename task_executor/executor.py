@@ -1,33 +1,65 @@
 import logging
 import traceback
-from typing import List
-from .model.orm import Status, Task
+from typing import Dict, Iterator, List, Optional
+from .model.orm import CachedResult, Status, TagSetting, Task, Worker
+from .model.backend import BACKENDS, FINISHED, StorageBackend
 from .model.executor_action_db import ExecutorActionDB
+from .model.memory_backend import MemoryBackend
+from .model.sharded_backend import ShardedBackend
+from .stats import TaskStats, WINDOWS
 
 
 class Executor:
-    def __init__(self, db_file_full_path='./task_executor.sqlite', verbose=False):
+    def __init__(self, db_file_full_path='./task_executor.sqlite', verbose=False, storage_profile=None, codec=None,
+                 backend=None, shards=4):
+        """
+        storage_profile -- name of a model.storage_profile profile (durable, balanced, throughput, legacy)
+                           or a StorageProfile, defaults to balanced
+        codec           -- encoding of new task contents and messages, json (default), zlib or msgpack,
+                           see model/codec.py
+        backend         -- storage of the tasks, see model/backend.py: sqlite (default, one file), memory
+                           (this process only) or sharded (tags spread over shards SQLite files), or a StorageBackend
+        shards          -- number of SQLite files of the sharded backend
+        """
         self.db_file_full_path = db_file_full_path
-        self.engine = self.init_db_engine(verbose=verbose)
         self.logger = logging.getLogger(__class__.__name__)
+        self.engine = self.init_db_engine(verbose=verbose, storage_profile=storage_profile, codec=codec,
+                                          backend=backend, shards=shards)
 
-    def add_task(self, tag, content) -> None:
-        self.engine.add_task(tag=tag, content=content)
+    def add_task(self, tag, content) -> int:
+        task_id = self.engine.add_task(tag=tag, content=content)
         self.logger.debug(f"New Task added for tag: {tag}")
+        return task_id
 
     def add_multi_task(self, tag, content_list: List[str]) -> None:
         self.engine.add_multi_task(tag=tag, content_list=content_list)
         self.logger.debug(f"New Task content_list added for tag: {tag}")
 
+    def insert_tasks(self, tag, contents: List[dict]) -> int:
+        return self.engine.insert_tasks(tag=tag, contents=contents)
+
     def update_task(self, task: Task, **kwargs) -> None:
         self.engine.update_task(task=task, **kwargs)
     
     def remove_task(self, task: Task) -> None:
         self.engine.remove_task(task=task)
 
+    def get_expired_tasks(self, updated_before, statuses=FINISHED, tag=None, limit: int = 1000) -> List[Task]:
+        """Finished tasks last updated before updated_before, each with every task log in task.logs, see retention.Retention."""
+        return self.engine.get_expired_tasks(updated_before=updated_before, statuses=statuses, tag=tag, limit=limit)
+
+    def delete_tasks(self, task_ids) -> int:
+        return self.engine.delete_tasks(task_ids=task_ids)
+
+    def compact(self, pages: int = 1000) -> int:
+        return self.engine.compact(pages=pages)
+
     def add_task_log(self, task: Task, message: str, status: Status, created_at, updated_at) -> None:
         self.engine.add_task_log(task=task, message=message, status=status, created_at=created_at, updated_at=updated_at)
 
+    def complete_tasks(self, completions) -> None:
+        self.engine.complete_tasks(completions=completions)
+
     def get_task_by_tag(self, tag: str) -> List[Task]:
         task_list = self.engine.get_task(tag=tag)
         return task_list
@@ -40,22 +72,98 @@ class Executor:
         task = self.engine.get_task(id=id)
         return task
 
+    def iter_tasks(self, tag=None, status=None, batch_size: int = 1000) -> Iterator[Task]:
+        """Stream the tasks of tag and status by id, each with its latest task log in task.latest_log."""
+        return self.engine.iter_tasks(tag=tag, status=status, batch_size=batch_size)
+
     def create_db(self):
         self.engine.create_db()
 
-    def init_db_engine(self, verbose=False):
+    def migrate_db(self, vacuum: bool = False) -> List[int]:
+        return self.engine.migrate_db(vacuum=vacuum)
+
+    def init_db_engine(self, verbose=False, storage_profile=None, codec=None, backend=None, shards=4) -> StorageBackend:
         try:
-            return ExecutorActionDB(self.db_file_full_path, echo=verbose)
+            if isinstance(backend, StorageBackend):
+                return backend
+            if backend in (None, "sqlite"):
+                return ExecutorActionDB(self.db_file_full_path, echo=verbose, storage_profile=storage_profile, codec=codec)
+            if backend == "memory":
+                return MemoryBackend()
+            if backend == "sharded":
+                return ShardedBackend(self.db_file_full_path, shards=shards, echo=verbose, storage_profile=storage_profile,
+                                      codec=codec)
+            raise ValueError(f"unknown storage backend: {backend}, use one of {', '.join(BACKENDS)}")
         except Exception as e:
             self.logger.error(e)
             raise e
 
-    def get_next_batch(self, tag, status, batch_size: int = 1) -> List[Task]:
-        tasks: List[Task] = self.get_task_by_tag_and_status(tag, status)
-        count = len(tasks) if len(tasks) < batch_size else batch_size
-        task_list : List[Task] = list()
-        for id in range(count):
-            self.update_task(tasks[id], status=Status.IN_PROGRESS)
-            tasks[id].status = Status.IN_PROGRESS
-            task_list.append(tasks[id])
+    def get_next_batch(self, tag, status, batch_size: int = 1, worker_id: str = None, lease_seconds: float = None) -> List[Task]:
+        task_list: List[Task] = self.engine.claim_tasks(tag=tag, status=status, batch_size=int(batch_size),
+                                                        worker_id=worker_id, lease_seconds=lease_seconds)
+        self.logger.debug(f"Claimed {len(task_list)} tasks for tag: {tag}")
         return task_list
+
+    def count_tasks_by_tag(self, status: Status) -> Dict[str, int]:
+        return self.engine.count_tasks_by_tag(status=status)
+
+    def count_tasks_by_tag_and_status(self, tag=None) -> List[tuple]:
+        return self.engine.count_tasks_by_tag_and_status(tag=tag)
+
+    def count_completions_by_tag(self, windows: List[float], tag=None) -> Dict[str, List[int]]:
+        return self.engine.count_completions_by_tag(windows=windows, tag=tag)
+
+    def stats(self, tag=None, windows=WINDOWS) -> Dict[str, dict]:
+        """Per tag counts by status, throughput of the last windows seconds and ETA, see stats.TaskStats."""
+        return TaskStats.collect(self, tag=tag, windows=windows).summary()
+
+    def get_task_phases(self, tag=None) -> List[dict]:
+        return self.engine.get_task_phases(tag=tag)
+
+    def get_claimable_tags(self, status) -> List[str]:
+        return self.engine.get_claimable_tags(status=status)
+
+    def next_retry_at(self, tag) -> Optional[float]:
+        return self.engine.next_retry_at(tag=tag)
+
+    def count_pending_parents(self, tags=None) -> int:
+        return self.engine.count_pending_parents(tags=tags)
+
+    def register_worker(self, worker_id: str, hostname: str, pid: int) -> None:
+        self.engine.register_worker(worker_id=worker_id, hostname=hostname, pid=pid)
+
+    def deregister_worker(self, worker_id: str) -> None:
+        self.engine.deregister_worker(worker_id=worker_id)
+
+    def renew_leases(self, worker_id: str, lease_seconds: float) -> int:
+        return self.engine.renew_leases(worker_id=worker_id, lease_seconds=lease_seconds)
+
+    def reclaim_expired_leases(self, status: Status = Status.RE_PROCESS, worker_timeout: float = None) -> int:
+        return self.engine.reclaim_expired_leases(status=status, worker_timeout=worker_timeout)
+
+    def get_workers(self) -> List[Worker]:
+        return self.engine.get_workers()
+
+    def get_tag_setting(self, tag) -> TagSetting:
+        return self.engine.get_tag_setting(tag=tag)
+
+    def get_tag_settings(self) -> List[TagSetting]:
+        return self.engine.get_tag_settings()
+
+    def set_tag_setting(self, tag, **kwargs) -> TagSetting:
+        return self.engine.set_tag_setting(tag=tag, **kwargs)
+
+    def get_cached_result(self, key: str, min_created_at: float = None) -> CachedResult:
+        return self.engine.get_cached_result(key=key, min_created_at=min_created_at)
+
+    def put_cached_result(self, key: str, task_id: int, message, **kwargs) -> None:
+        self.engine.put_cached_result(key=key, task_id=task_id, message=message, **kwargs)
+
+    def record_cache_hits(self, hits: Dict[str, int]) -> None:
+        self.engine.record_cache_hits(hits=hits)
+
+    def evict_cached_results(self, max_age: float = None, max_bytes: int = None) -> int:
+        return self.engine.evict_cached_results(max_age=max_age, max_bytes=max_bytes)
+
+    def cache_summary(self) -> Dict[str, int]:
+        return self.engine.cache_summary()
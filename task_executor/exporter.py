@@ -0,0 +1,96 @@
+import csv
+import json
+import logging
+import sys
+from typing import Iterator
+
+FORMATS = ("jsonl", "csv")
+# Columns of an exported task, the last ones come from its latest task log
+COLUMNS = [ "id", "tag", "status", "priority", "attempts", "created_at", "updated_at", "content",
+            "log_status", "return_code", "duration", "stdout_bytes", "stderr_bytes", "stdout_path", "stderr_path",
+            "worker_id", "hostname", "message" ]
+
+
+class TaskExporter:
+    """
+    Stream tasks and their results out of the database with constant memory.
+
+    Tasks are read page by page with Executor.iter_tasks, every task with its latest task log,
+    and written one line at a time:
+        jsonl  -- one JSON object per task, content and JSON messages kept as objects
+        csv    -- one row per task, content and JSON messages as JSON text
+
+    exporter = TaskExporter(executor, tag='sandpit')
+    exporter.export_file('results.jsonl')
+    """
+
+    def __init__(self, executor, tag=None, status=None, batch_size: int = 1000, progress=None):
+        self.executor = executor
+        self.tag = tag
+        self.status = status
+        self.batch_size = int(batch_size)
+        self.progress = progress
+        self.logger = logging.getLogger(__class__.__name__)
+
+    @staticmethod
+    def format_of(output: str, format: str = None) -> str:
+        """The format asked for, or the one of the output file extension, jsonl by default."""
+        format = format or ("csv" if str(output).lower().endswith(".csv") else "jsonl")
+        if format not in FORMATS:
+            raise ValueError(f"unknown export format: {format}, use one of {', '.join(FORMATS)}")
+        return format
+
+    @staticmethod
+    def row(task) -> dict:
+        log = getattr(task, "latest_log", None)
+        message = log.message if log is not None else None
+        if isinstance(message, str):
+            try:
+                message = json.loads(message)
+            except ValueError:
+                pass
+        return {
+            "id": task.id, "tag": task.tag, "status": task.status.name, "priority": task.priority,
+            "attempts": task.attempts, "created_at": str(task.created_at), "updated_at": str(task.updated_at),
+            "content": task.content,
+            "log_status": log.status.name if log is not None else None,
+            "return_code": log.return_code if log is not None else None,
+            "duration": log.duration if log is not None else None,
+            "stdout_bytes": log.stdout_bytes if log is not None else None,
+            "stderr_bytes": log.stderr_bytes if log is not None else None,
+            "stdout_path": log.stdout_path if log is not None else None,
+            "stderr_path": log.stderr_path if log is not None else None,
+            "worker_id": log.worker_id if log is not None else None,
+            "hostname": log.hostname if log is not None else None,
+            "message": message,
+        }
+
+    def rows(self) -> Iterator[dict]:
+        for task in self.executor.iter_tasks(tag=self.tag, status=self.status, batch_size=self.batch_size):
+            yield self.row(task)
+            if self.progress is not None:
+                self.progress.update(1)
+
+    def export_file(self, output, format: str = None) -> int:
+        """Export to output, '-' writes to stdout. Return the number of tasks exported."""
+        format = self.format_of(output, format)
+        if output == "-":
+            return self.export_to(sys.stdout, format)
+        with open(output, mode="w", newline="") as file:
+            return self.export_to(file, format)
+
+    def export_to(self, file, format: str = "jsonl") -> int:
+        count = 0
+        if format == "csv":
+            writer = csv.DictWriter(file, fieldnames=COLUMNS)
+            writer.writeheader()
+            for row in self.rows():
+                writer.writerow({ name: json.dumps(value) if isinstance(value, (dict, list)) else value
+                                  for name, value in row.items() })
+                count += 1
+        else:
+            for row in self.rows():
+                file.write(json.dumps(row) + "\n")
+                count += 1
+        self.logger.info(f"Exported {count} tasks of tag: {self.tag or 'every tag'}")
+        return count
@@ -0,0 +1,115 @@
+import heapq
+import logging
+import time
+from typing import Callable, Dict, List, Set
+from .model.orm import Status, Task
+
+DEFAULT_WEIGHT = 1.0
+
+
+class FairShareClaimer:
+    """
+    Claim the tasks of several tags, or of every tag, for one worker pool.
+
+    Each claim shares its slots between the tags in proportion of their weight, counting the
+    tasks already running (IN_PROGRESS in the database, whichever worker runs them), so the
+    running tasks of a tag converge to weight / sum of the weights. A tag never runs more than
+    its max_concurrency tasks at a time, across every worker sharing the database. Within a
+    tag, tasks are claimed highest priority first. Weights and caps come from the tag settings,
+    see Executor.set_tag_setting, a tag without settings has weight 1 and no cap.
+
+    claimer = FairShareClaimer(executor, tags=['urgent', 'backfill'])
+    StreamingScheduler(claim=claimer.claim, ...)
+
+    tags            -- tags to serve, None serves every tag with NEW or RE_PROCESS tasks
+    claim_tag       -- callable(tag, batch_size) -> List[Task], defaults to Executor.get_next_batch
+    statuses        -- statuses claimed by the default claim_tag
+    refresh_seconds -- how long tag settings and the list of tags are cached
+    """
+
+    def __init__(self, executor, tags: List[str] = None, claim_tag: Callable[[str, int], List[Task]] = None,
+                 statuses: List[Status] = None, refresh_seconds: float = 10):
+        self.executor = executor
+        self.all_tags = tags is None
+        self.tags: List[str] = [] if tags is None else list(tags)
+        self.statuses = statuses or [Status.NEW, Status.RE_PROCESS]
+        self.claim_tag = claim_tag or (lambda tag, size: executor.get_next_batch(tag, self.statuses, batch_size=size))
+        self.refresh_seconds = float(refresh_seconds)
+        self.weights: Dict[str, float] = {}
+        self.caps: Dict[str, int] = {}
+        self.refreshed_at = None
+        # True when the last claim left claimable tasks behind because of concurrency caps
+        self.throttled = False
+        self.logger = logging.getLogger(__class__.__name__)
+
+    def claim(self, batch_size: int) -> List[Task]:
+        self.__refresh()
+        running = self.__running()
+        drained: Set[str] = set()
+        tasks: List[Task] = []
+        remaining = int(batch_size)
+        while remaining > 0:
+            shares = self.allocate(remaining, running, drained)
+            if not shares:
+                break
+            for tag, size in shares.items():
+                claimed = self.claim_tag(tag, size)
+                tasks.extend(claimed)
+                running[tag] = running.get(tag, 0) + len(claimed)
+                remaining -= len(claimed)
+                if len(claimed) < size:
+                    drained.add(tag)
+        self.throttled = remaining > 0 and any(tag not in drained for tag in self.tags)
+        if not tasks and self.all_tags:
+            # New tags may have been added since the last refresh
+            self.refreshed_at = None
+        self.logger.debug(f"Claimed {len(tasks)} tasks of {len(self.tags)} tags, throttled: {self.throttled}")
+        return sorted(tasks, key=lambda task: (-task.priority, task.id))
+
+    def allocate(self, slots: int, running: Dict[str, int], drained: Set[str] = frozenset()) -> Dict[str, int]:
+        """Share slots between the tags not drained, the tag furthest below its weighted share first."""
+        shares: Dict[str, int] = {}
+        heap = []
+        for order, tag in enumerate(self.tags):
+            if tag in drained or not self.__has_room(tag, running.get(tag, 0)):
+                continue
+            heap.append(((running.get(tag, 0) + 1) / self.weight(tag), order, tag))
+        heapq.heapify(heap)
+        for _ in range(slots):
+            if not heap:
+                break
+            _, order, tag = heapq.heappop(heap)
+            shares[tag] = shares.get(tag, 0) + 1
+            load = running.get(tag, 0) + shares[tag]
+            if self.__has_room(tag, load):
+                heapq.heappush(heap, ((load + 1) / self.weight(tag), order, tag))
+        return shares
+
+    def weight(self, tag) -> float:
+        return self.weights.get(tag, DEFAULT_WEIGHT)
+
+    def wait(self, seconds: float = 1) -> bool:
+        """Idle hook: sleep while capped tags wait for slots held by other workers, False when not throttled."""
+        if not self.throttled:
+            return False
+        time.sleep(seconds)
+        return True
+
+    def __has_room(self, tag, load: int) -> bool:
+        cap = self.caps.get(tag)
+        return cap is None or load < cap
+
+    def __running(self) -> Dict[str, int]:
+        if len(self.tags) == 1 and not self.caps:
+            return {}
+        return self.executor.count_tasks_by_tag(Status.IN_PROGRESS)
+
+    def __refresh(self) -> None:
+        if self.refreshed_at is not None and time.monotonic() - self.refreshed_at < self.refresh_seconds:
+            return
+        if self.all_tags:
+            self.tags = self.executor.get_claimable_tags(self.statuses)
+        settings = self.executor.get_tag_settings()
+        self.weights = { s.tag: s.weight for s in settings if s.weight }
+        self.caps = { s.tag: s.max_concurrency for s in settings if s.max_concurrency }
+        self.refreshed_at = time.monotonic()
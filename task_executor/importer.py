@@ -0,0 +1,85 @@
+import ast
+import json
+import logging
+import sys
+from typing import Iterable, List, Optional, Tuple
+
+
+class ImportResult:
+    def __init__(self):
+        self.lines = 0
+        self.inserted = 0
+        self.bad = 0
+        self.bad_lines: List[Tuple[int, str]] = []
+
+    def __repr__(self) -> str:
+        return f"ImportResult(lines={self.lines!r}, inserted={self.inserted!r}, bad={self.bad!r})"
+
+
+class TaskImporter:
+    """
+    Stream task contents into the database with constant memory.
+
+    Lines are read one at a time from a file or stdin, each one holding a JSON object, e.g.
+        {"command": ["az", "tag", "list", "--resource-id", "/SUBSCRIPTIONS/...."]}
+    Python dict literals are accepted as well. Every commit_size parsed lines are inserted
+    in a single executemany transaction. Blank lines are skipped, other lines that are not
+    an object are counted as bad and the first max_bad_lines of them are kept for the report.
+    """
+
+    def __init__(self, executor, tag, commit_size: int = 10000, progress=None, max_bad_lines: int = 100):
+        self.executor = executor
+        self.tag = tag
+        self.commit_size = int(commit_size)
+        self.progress = progress
+        self.max_bad_lines = int(max_bad_lines)
+        self.logger = logging.getLogger(__class__.__name__)
+
+    @staticmethod
+    def parse(line: str) -> Optional[dict]:
+        try:
+            content = json.loads(line)
+        except ValueError:
+            try:
+                content = ast.literal_eval(line)
+            except (ValueError, SyntaxError):
+                return None
+        return content if isinstance(content, dict) else None
+
+    def import_file(self, command_file) -> ImportResult:
+        """Import command_file, '-' reads from stdin."""
+        if command_file == "-":
+            return self.import_lines(sys.stdin)
+        with open(command_file, mode='r') as file:
+            return self.import_lines(file)
+
+    def import_lines(self, lines: Iterable[str]) -> ImportResult:
+        result = ImportResult()
+        chunk: List[dict] = []
+
+        for line in lines:
+            result.lines += 1
+            line = line.strip()
+            if line:
+                content = self.parse(line)
+                if content is None:
+                    result.bad += 1
+                    self.logger.warning(f"Skipping bad line {result.lines}: {line[:200]}")
+                    if len(result.bad_lines) < self.max_bad_lines:
+                        result.bad_lines.append((result.lines, line[:200]))
+                else:
+                    chunk.append(content)
+                    if len(chunk) >= self.commit_size:
+                        result.inserted += self.__flush(chunk)
+                        chunk = []
+            if self.progress is not None:
+                self.progress.update(1)
+
+        result.inserted += self.__flush(chunk)
+        self.logger.info(f"Imported tag: {self.tag}, {result}")
+        return result
+
+    def __flush(self, chunk: List[dict]) -> int:
+        if not chunk:
+            return 0
+        return self.executor.insert_tasks(tag=self.tag, contents=chunk)
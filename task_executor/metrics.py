@@ -0,0 +1,274 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Upper bounds in seconds, from sub-millisecond claims and commits to long commands
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+
+class Metric:
+    """A named value per label combination, updates only take a lock and a dict lookup."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values: Dict[Tuple, object] = {}
+
+    def key(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def label_text(self, key: Tuple, extra: str = "") -> str:
+        pairs = [ f'{name}="{escape(value)}"' for name, value in zip(self.labelnames, key) ]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> List[Tuple[str, float]]:
+        with self.lock:
+            return [ (self.name + self.label_text(key), value) for key, value in sorted(self.values.items()) ]
+
+    def snapshot(self):
+        with self.lock:
+            return [ dict(zip(self.labelnames, key), value=value) for key, value in sorted(self.values.items()) ]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def replace(self, values: Dict[Tuple, float]) -> None:
+        """Set every label combination at once, the ones missing from values are dropped."""
+        with self.lock:
+            self.values = dict(values)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # one count per bucket, the last one is +Inf, then sum and count
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def samples(self) -> List[Tuple[str, float]]:
+        samples = []
+        with self.lock:
+            for key, counts in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    samples.append((f"{self.name}_bucket" + self.label_text(key, 'le="' + le + '"'), cumulative))
+                samples.append((f"{self.name}_sum{self.label_text(key)}", counts[-2]))
+                samples.append((f"{self.name}_count{self.label_text(key)}", counts[-1]))
+        return samples
+
+    def snapshot(self):
+        with self.lock:
+            return [ dict(zip(self.labelnames, key), count=counts[-1], sum=counts[-2],
+                          buckets=dict(zip([ repr(b) for b in self.buckets ] + ["+Inf"], counts[:-2])))
+                     for key, counts in sorted(self.values.items()) ]
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metrics:
+    """
+    Counters and histograms of the executor hot paths.
+
+    claim_seconds       -- latency of a batch claim
+    spawn_seconds       -- time to start a command process (fork/exec)
+    run_seconds         -- wall time of a command, by final status
+    db_write_seconds    -- latency of a group commit of task completions
+    tasks_total         -- finished tasks by status, cache hits included
+    busy_workers        -- commands running now, busy_seconds_total / capacity is the utilisation
+    queue_depth         -- tasks per tag and status, refreshed by collect() from the database
+
+    Updating a metric costs a lock and a dict lookup, so they stay on in production. Expose them
+    with MetricsReporter, over HTTP in the Prometheus text format and/or as a JSON snapshot file.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.claim_seconds = Histogram("task_executor_claim_seconds", "Latency of a batch claim", buckets=buckets)
+        self.claimed_total = Counter("task_executor_claimed_total", "Tasks claimed")
+        self.spawn_seconds = Histogram("task_executor_spawn_seconds", "Time to start a command process", buckets=buckets)
+        self.run_seconds = Histogram("task_executor_run_seconds", "Wall time of a command", ["status"], buckets=buckets)
+        self.db_write_seconds = Histogram("task_executor_db_write_seconds", "Latency of a group commit of completions", buckets=buckets)
+        self.db_write_rows = Counter("task_executor_db_write_rows_total", "Task completions committed")
+        self.tasks_total = Counter("task_executor_tasks_total", "Finished tasks", ["status"])
+        self.busy_workers = Gauge("task_executor_busy_workers", "Commands running now")
+        self.busy_seconds = Counter("task_executor_busy_seconds_total", "Time spent running commands, summed over workers")
+        self.capacity = Gauge("task_executor_worker_capacity", "Commands that can run at once")
+        self.queue_depth = Gauge("task_executor_queue_depth", "Tasks per tag and status", ["tag", "status"])
+        self.started = time.time()
+        self.all: List[Metric] = [ self.claim_seconds, self.claimed_total, self.spawn_seconds, self.run_seconds,
+                                   self.db_write_seconds, self.db_write_rows, self.tasks_total, self.busy_workers,
+                                   self.busy_seconds, self.capacity, self.queue_depth ]
+
+    def timed_claim(self, claim: Callable[[int], list]) -> Callable[[int], list]:
+        """Wrap a claim function so that its latency and the claimed tasks are measured."""
+        def measured(batch_size: int) -> list:
+            started = time.perf_counter()
+            tasks = claim(batch_size)
+            self.claim_seconds.observe(time.perf_counter() - started)
+            self.claimed_total.inc(len(tasks))
+            return tasks
+        return measured
+
+    def command_started(self) -> None:
+        self.busy_workers.inc()
+
+    def command_finished(self, elapsed: float) -> None:
+        self.busy_workers.dec()
+        self.busy_seconds.inc(elapsed)
+
+    def task_completed(self, completion) -> None:
+        status = getattr(completion.status, "name", completion.status)
+        self.tasks_total.inc(status=status)
+        if completion.duration is not None:
+            self.run_seconds.observe(completion.duration, status=status)
+        if completion.spawn_duration is not None:
+            self.spawn_seconds.observe(completion.spawn_duration)
+
+    def collect(self, executor) -> None:
+        """Refresh queue_depth from the database, one GROUP BY query."""
+        self.queue_depth.replace({ (tag, getattr(status, "name", status)): count
+                                   for tag, status, count in executor.count_tasks_by_tag_and_status() })
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.all:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name} {value!r}" for name, value in metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        return { "timestamp": time.time(), "uptime_seconds": time.time() - self.started,
+                 "metrics": { metric.name: metric.snapshot() for metric in self.all } }
+
+
+class MetricsReporter:
+    """
+    Background thread refreshing the queue depth every interval seconds and, optionally,
+    serving the metrics on http://host:port/metrics and writing them as JSON to snapshot_file.
+
+    with MetricsReporter(metrics, executor, port=9464, snapshot_file='metrics.json'):
+        ...
+    """
+
+    def __init__(self, metrics: Metrics, executor, port: int = None, host: str = "127.0.0.1",
+                 snapshot_file: str = None, interval: float = 15):
+        self.metrics = metrics
+        self.executor = executor
+        self.port = port
+        self.host = host
+        self.snapshot_file = snapshot_file
+        self.interval = float(interval)
+        self.server: ThreadingHTTPServer = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.__run, name="MetricsReporter", daemon=True)
+        self.logger = logging.getLogger(__class__.__name__)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self) -> None:
+        # The first scrape already has the queue depth
+        self.report()
+        if self.port is not None:
+            metrics = self.metrics
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split("?")[0] not in ("/", "/metrics"):
+                        self.send_error(404)
+                        return
+                    body = metrics.render().encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self.server = ThreadingHTTPServer((self.host, int(self.port)), Handler)
+            self.port = self.server.server_address[1]
+            threading.Thread(target=self.server.serve_forever, name="MetricsServer", daemon=True).start()
+            self.logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        # Last snapshot with the final counts
+        self.report()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def report(self) -> None:
+        try:
+            self.metrics.collect(self.executor)
+            if self.snapshot_file:
+                temporary = f"{self.snapshot_file}.tmp"
+                with open(temporary, "w") as f:
+                    json.dump(self.metrics.snapshot(), f)
+                os.replace(temporary, self.snapshot_file)
+        except Exception as e:
+            self.logger.error(e)
+
+    def __run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.report()
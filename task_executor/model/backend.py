@@ -0,0 +1,225 @@
+"""
+Storage backends of the task executor.
+
+Executor delegates every read and write to a StorageBackend:
+    ExecutorActionDB  -- one SQLite file (default), see executor_action_db.py
+    MemoryBackend     -- dicts of the current process, for ephemeral runs and tests, see memory_backend.py
+    ShardedBackend    -- tags spread over several SQLite files, see sharded_backend.py
+
+Every backend returns the ORM classes of orm.py (detached, or transient for the memory backend),
+stores task log messages as JSON text and passes the conformance suite of test/test_backends.py.
+"""
+
+from __future__ import annotations
+import ast
+import datetime
+import json
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, List
+from .orm import CachedResult, Status, TagSetting, Task, Worker
+
+BACKENDS = ("sqlite", "memory", "sharded")
+
+# Final statuses of a failed task, the tasks depending on it end as UPSTREAM_FAILED
+FAILED = (Status.COMPLETED_ERROR, Status.TIMED_OUT, Status.UPSTREAM_FAILED)
+# Statuses of a task still to complete, with the dependency checks
+UNFINISHED = (Status.NEW, Status.IN_PROGRESS, Status.RE_PROCESS, Status.WAITING)
+# Statuses of a task running or still to be claimed, a parent in one of them will finish
+PENDING = (Status.NEW, Status.IN_PROGRESS, Status.RE_PROCESS)
+# Final statuses, the tasks retention may archive
+FINISHED = (Status.COMPLETED_OK,) + FAILED
+
+
+class StorageBackend(ABC):
+    """Tasks, task logs, workers, tag settings and cached results, see Executor for the meaning of each call."""
+
+    @abstractmethod
+    def create_db(self) -> None:
+        ...
+
+    @abstractmethod
+    def migrate_db(self, vacuum: bool = False) -> List[int]:
+        ...
+
+    @abstractmethod
+    def schema_version(self) -> int:
+        ...
+
+    @abstractmethod
+    def add_task(self, tag, content) -> int:
+        ...
+
+    def add_multi_task(self, tag, content_list: List[str]):
+        self.insert_tasks(tag, [ self.parse_content(content) for content in content_list ])
+
+    @abstractmethod
+    def insert_tasks(self, tag, contents: List[dict]) -> int:
+        ...
+
+    @abstractmethod
+    def update_task(self, task: Task, **kwargs) -> None:
+        ...
+
+    @abstractmethod
+    def remove_task(self, task: Task) -> None:
+        ...
+
+    @abstractmethod
+    def get_expired_tasks(self, updated_before: datetime.datetime, statuses=FINISHED, tag=None, limit: int = 1000) -> List[Task]:
+        ...
+
+    @abstractmethod
+    def delete_tasks(self, task_ids) -> int:
+        ...
+
+    @abstractmethod
+    def compact(self, pages: int = 1000) -> int:
+        ...
+
+    @abstractmethod
+    def add_task_log(self, task, status, message, created_at, updated_at):
+        ...
+
+    @abstractmethod
+    def complete_tasks(self, completions) -> None:
+        ...
+
+    @abstractmethod
+    def claim_tasks(self, tag, status, batch_size: int = 1, worker_id: str = None, lease_seconds: float = None) -> List[Task]:
+        ...
+
+    @abstractmethod
+    def count_tasks_by_tag(self, status) -> Dict[str, int]:
+        ...
+
+    @abstractmethod
+    def count_tasks_by_tag_and_status(self, tag=None) -> List[tuple]:
+        ...
+
+    @abstractmethod
+    def count_completions_by_tag(self, windows: List[float], tag=None) -> Dict[str, List[int]]:
+        ...
+
+    @abstractmethod
+    def get_task_phases(self, tag=None) -> List[dict]:
+        ...
+
+    @abstractmethod
+    def iter_tasks(self, tag=None, status=None, batch_size: int = 1000) -> Iterator[Task]:
+        ...
+
+    @abstractmethod
+    def get_claimable_tags(self, status) -> List[str]:
+        ...
+
+    @abstractmethod
+    def next_retry_at(self, tag) -> float | None:
+        ...
+
+    @abstractmethod
+    def count_pending_parents(self, tags=None) -> int:
+        ...
+
+    @abstractmethod
+    def register_worker(self, worker_id: str, hostname: str, pid: int) -> None:
+        ...
+
+    @abstractmethod
+    def deregister_worker(self, worker_id: str) -> None:
+        ...
+
+    @abstractmethod
+    def renew_leases(self, worker_id: str, lease_seconds: float) -> int:
+        ...
+
+    @abstractmethod
+    def reclaim_expired_leases(self, status: Status = Status.RE_PROCESS, worker_timeout: float = None) -> int:
+        ...
+
+    @abstractmethod
+    def get_workers(self) -> List[Worker]:
+        ...
+
+    @abstractmethod
+    def get_tag_setting(self, tag) -> TagSetting:
+        ...
+
+    @abstractmethod
+    def get_tag_settings(self) -> List[TagSetting]:
+        ...
+
+    @abstractmethod
+    def set_tag_setting(self, tag, **kwargs) -> TagSetting:
+        ...
+
+    @abstractmethod
+    def get_cached_result(self, key: str, min_created_at: float = None) -> CachedResult:
+        ...
+
+    @abstractmethod
+    def put_cached_result(self, key: str, task_id: int, message, **kwargs) -> None:
+        ...
+
+    @abstractmethod
+    def record_cache_hits(self, hits: Dict[str, int]) -> None:
+        ...
+
+    @abstractmethod
+    def evict_cached_results(self, max_age: float = None, max_bytes: int = None) -> int:
+        ...
+
+    @abstractmethod
+    def cache_summary(self) -> Dict[str, int]:
+        ...
+
+    @abstractmethod
+    def get_task(self, **kwargs) -> Task | List[Task]:
+        ...
+
+    def encode_message(self, message) -> str | bytes:
+        """Task log messages are stored as JSON text, read them back with json.loads."""
+        if message is not None and not isinstance(message, str):
+            message = json.dumps(message)
+        return message
+
+    @staticmethod
+    def parse_content(content) -> dict:
+        """A task content given as a dict or as its Python / JSON text."""
+        return json.loads(json.dumps(ast.literal_eval(str(content))))
+
+    @staticmethod
+    def task_priority(content) -> int:
+        """Priority of a task from its content, higher runs first, 0 by default."""
+        return int(content.get("priority") or 0) if isinstance(content, dict) else 0
+
+    @staticmethod
+    def task_dependencies(content) -> tuple:
+        """(parent task ids, parent tags) of the "depends_on" key of a content: integers are task ids, strings tags."""
+        parents = content.get("depends_on") if isinstance(content, dict) else None
+        if parents is None:
+            return [], []
+        parents = parents if isinstance(parents, list) else [parents]
+        parent_ids = [ parent for parent in parents if isinstance(parent, int) and not isinstance(parent, bool) ]
+        parent_tags = [ parent for parent in parents if isinstance(parent, str) ]
+        if len(parent_ids) + len(parent_tags) != len(parents):
+            raise ValueError(f"depends_on takes task ids and tags: {parents}")
+        return parent_ids, parent_tags
+
+    @staticmethod
+    def phases(completion, written_at: float) -> dict:
+        """Phase timestamps and durations of a completion committed at written_at, None when unknown."""
+        c = completion
+        timestamps = { name: getattr(c, name, None) for name in ("queued_at", "claimed_at", "started_at", "finished_at") }
+        between = lambda start, end: end - start if start is not None and end is not None else None
+        spawn_duration = getattr(c, "spawn_duration", None)
+        return dict(
+            timestamps,
+            worker_id=getattr(c, "worker_id", None),
+            hostname=getattr(c, "hostname", None),
+            written_at=written_at,
+            queue_wait=between(timestamps["queued_at"], timestamps["claimed_at"]),
+            claim_duration=getattr(c, "claim_duration", None),
+            pickup_wait=between(timestamps["claimed_at"], timestamps["started_at"]),
+            spawn_duration=spawn_duration,
+            exec_duration=between(spawn_duration, c.duration) if spawn_duration is not None else c.duration,
+            write_wait=between(timestamps["finished_at"], written_at))
@@ -0,0 +1,150 @@
+"""
+Compact column types and encodings of the task executor database.
+
+    status      -- small integer code of a Status, see STATUS_CODES
+    timestamps  -- integer milliseconds since the epoch, read back as datetime
+    content     -- task content, message -- task log message, encoded by a codec:
+
+    json     -- plain JSON text (default), readable with the sqlite3 shell
+    zlib     -- zlib compressed JSON, a BLOB starting with b"z"
+    msgpack  -- msgpack, a BLOB starting with b"m", needs `pip install msgpack`
+
+Encoded values are self-describing, so rows written with different codecs, or before codecs
+existed, are read back alike and the codec can be changed at any time:
+
+    Executor(db_file_full_path='./task_executor.sqlite', codec='zlib')
+"""
+
+import datetime
+import json
+import zlib
+from sqlalchemy import Integer, String
+from sqlalchemy.types import TypeDecorator
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+CODECS = ("json", "zlib", "msgpack")
+ZLIB = b"z"
+MSGPACK = b"m"
+ZLIB_LEVEL = 6
+
+
+def check_codec(codec: str) -> str:
+    codec = codec or "json"
+    if codec not in CODECS:
+        raise ValueError(f"unknown codec: {codec}, use one of {', '.join(CODECS)}")
+    if codec == "msgpack" and msgpack is None:
+        raise ValueError("the msgpack codec needs the msgpack package: pip install msgpack")
+    return codec
+
+def encode(value, codec: str = "json", text: bool = False):
+    """
+    Encode a task content (text=False) or a task log message (text=True) for storage.
+    The json codec leaves the value as is, the column type writes it as JSON or text.
+    """
+    if codec == "json" or value is None:
+        return value
+    if codec == "zlib":
+        raw = value if text else json.dumps(value)
+        return ZLIB + zlib.compress(raw.encode(), ZLIB_LEVEL)
+    if codec == "msgpack":
+        return MSGPACK + msgpack.packb(value, use_bin_type=True)
+    raise ValueError(f"unknown codec: {codec}")
+
+def decode(value, text: bool = False):
+    """Read back a stored content or message, whatever codec wrote it."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value if text else json.loads(value)
+    value = bytes(value)
+    if value[:1] == ZLIB:
+        raw = zlib.decompress(value[1:]).decode()
+        return raw if text else json.loads(raw)
+    if value[:1] == MSGPACK:
+        if msgpack is None:
+            raise ValueError("reading msgpack encoded rows needs the msgpack package: pip install msgpack")
+        return msgpack.unpackb(value[1:], raw=False)
+    raise ValueError(f"unknown encoding tag: {value[:1]!r}")
+
+
+class StatusCode(TypeDecorator):
+    """A Status stored as a small integer, Status members or their names are accepted."""
+
+    impl = Integer
+    cache_ok = True
+
+    def __init__(self, enum_class, codes):
+        super().__init__()
+        self.enum_class = enum_class
+        # Part of the statement cache key, so hashable
+        self.codes = tuple(dict(codes).items())
+        self.to_code = dict(self.codes)
+        self.members = { code: member for member, code in self.codes }
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, int):
+            return value
+        if isinstance(value, str):
+            value = self.enum_class[value]
+        return self.to_code[value]
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            # Rows not migrated yet keep the name
+            return self.enum_class[value]
+        return self.members[value]
+
+
+class EpochMillis(TypeDecorator):
+    """
+    A local time stored as integer milliseconds since the epoch and read back as a naive
+    datetime, so str() of it looks like the text timestamps written by older versions.
+    datetime, ISO text or epoch seconds (int or float) are accepted.
+    """
+
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            value = datetime.datetime.fromisoformat(value)
+        if isinstance(value, datetime.datetime):
+            value = value.timestamp()
+        return int(round(float(value) * 1000))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            return datetime.datetime.fromisoformat(value)
+        return datetime.datetime.fromtimestamp(value / 1000)
+
+
+class Packed(TypeDecorator):
+    """
+    JSON content (text=False) or text message (text=True) encoded by a codec. The codec is
+    applied by the database layer, values already encoded (bytes) are stored as they are.
+    """
+
+    impl = String
+    cache_ok = True
+
+    def __init__(self, text: bool = False):
+        super().__init__()
+        self.text = text
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, bytes):
+            return value
+        return value if self.text else json.dumps(value)
+
+    def process_result_value(self, value, dialect):
+        return decode(value, text=self.text)
@@ -19,25 +19,51 @@ engine.add_task_log(message='dummy message', status=Status.IN_PROGRESS.name, tas
 """
 
 from __future__ import annotations
-import ast
 import datetime
-import json
 import logging
+import time
 import traceback
-from typing import List, overload
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
+from typing import Dict, Iterator, List, overload
+from sqlalchemy import Boolean, Integer, bindparam, create_engine, delete, event, func, insert, or_, select, union_all, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.orm import aliased, sessionmaker, Session
 from ..exceptions import TaskError, TaskLogError
-from .orm import Status, Task, TaskLog
+from . import codec as codecs, migration
+from .backend import FAILED, FINISHED, PENDING, UNFINISHED, StorageBackend
+from .orm import Base, CachedResult, Status, TagSetting, Task, TaskDependency, TaskLog, Worker
+from .storage_profile import StorageProfile, get_storage_profile
 
+# Ids bound to one IN (...) of the dependency queries, below the SQLite limit of variables
+ID_CHUNK = 10000
 
-class ExecutorActionDB:
-    def __init__(self, db_file_full_path: str, echo=True):
+
+class ExecutorActionDB(StorageBackend):
+    def __init__(self, db_file_full_path: str, echo=True, storage_profile: StorageProfile | str = None, codec: str = None):
         self.db_file_full_path = db_file_full_path
-        self.engine = create_engine(f'sqlite:///{self.db_file_full_path}', echo=echo, pool_size=0, max_overflow=-1)
+        self.storage_profile = get_storage_profile(storage_profile)
+        # Encoding of new contents and messages, rows written with any codec are read back alike
+        self.codec = codecs.check_codec(codec)
+        # Last in first out keeps the few busiest connections (and their page cache) warm
+        self.engine = create_engine(
+            f'sqlite:///{self.db_file_full_path}', echo=echo,
+            poolclass=QueuePool, pool_size=self.storage_profile.pool_size,
+            max_overflow=self.storage_profile.max_overflow, pool_use_lifo=True,
+            connect_args={"timeout": self.storage_profile.busy_timeout / 1000, "check_same_thread": False})
+        event.listen(self.engine, "connect", self.__apply_pragmas)
         self.session = sessionmaker(bind=self.engine)
         self.logger = logging.getLogger(__class__.__name__)
 
+    def __apply_pragmas(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in self.storage_profile.pragmas():
+            cursor.execute(pragma)
+        cursor.close()
+
+    def pragma(self, name: str):
+        with self.engine.connect() as connection:
+            return connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+
     def create_task(self):
         Task.__table__.create(self.engine)
 
@@ -57,44 +83,100 @@ class ExecutorActionDB:
             self.logger.debug(e.args)
 
     def create_db(self):
-        self.drop_task()
-        self.create_task()
-        self.drop_task_log()
-        self.create_task_log()
+        """Drop and create every table of the schema, orm.Base.metadata, stamped with the latest schema version."""
+        Base.metadata.drop_all(self.engine)
+        Base.metadata.create_all(self.engine)
+        with self.engine.connect() as connection:
+            migration.enable_incremental_vacuum(connection)
+        migration.stamp(self.engine)
+
+    def migrate_db(self, vacuum: bool = False) -> List[int]:
+        """
+        Apply the pending migrations, return their versions. With vacuum the file is also switched to
+        auto_vacuum = INCREMENTAL by a one-off VACUUM, which needs every worker stopped.
+        """
+        try:
+            applied = migration.migrate(self.engine)
+            self.logger.info(f"Schema version {self.schema_version()}, applied migrations: {applied}")
+            if vacuum:
+                with self.engine.connect() as connection:
+                    migration.enable_incremental_vacuum(connection)
+                self.logger.info(f"auto_vacuum is {self.pragma('auto_vacuum')}")
+            return applied
+        except Exception as e:
+            self.logger.error(e)
+            raise e
+
+    def schema_version(self) -> int:
+        return migration.get_schema_version(self.engine)
 
-    def add_task(self, tag, content):
+    def add_task(self, tag, content) -> int:
+        """Add a task and return its id. A "depends_on" key makes it WAITING for its parents, see insert_tasks."""
         try:
             session = self.session()            
+            content = self.parse_content(content)
+            parent_ids, parent_tags = self.task_dependencies(content)
+            self.__check_dependencies(session, tag, [ (parent_ids, parent_tags) ])
             task = Task(
                 tag=tag,
-                content=json.loads(json.dumps(ast.literal_eval(str(content)))),
-                status=Status.NEW.name,
-                created_at=str(datetime.datetime.now()),
-                updated_at=str(datetime.datetime.now()))
+                content=self.encode_content(content),
+                priority=self.task_priority(content),
+                status=Status.WAITING if parent_ids or parent_tags else Status.NEW,
+                created_at=datetime.datetime.now(),
+                updated_at=datetime.datetime.now())
             session.add(task)
-            # session.flush()
+            session.flush()
+            task_id = task.id
+            if parent_ids or parent_tags:
+                self.__add_dependencies(session, [ (task_id, tag, parent_ids, parent_tags) ])
             session.commit()
             session.close()
+            return task_id
         except Exception as e:
             self.logger.error(e)
             raise TaskError(e)
 
     def add_multi_task(self, tag, content_list: List[str]):
         try:
-            session = self.session()
+            super().add_multi_task(tag, content_list)
+        except TaskError:
+            raise
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
 
-            for content in content_list:
-                task = Task(
-                    tag=tag,
-                    content=json.loads(json.dumps(ast.literal_eval(content))),
-                    status=Status.NEW.name,
-                    created_at=str(datetime.datetime.now()),
-                    updated_at=str(datetime.datetime.now()))
-                session.add(task)
+    def insert_tasks(self, tag, contents: List[dict]) -> int:
+        """
+        Insert already parsed task contents with status NEW in one executemany transaction.
+        The "priority" key of a content, if any, sets the priority of its task.
 
-            # session.flush()
+        The "depends_on" key lists the parents of a task: task ids (of earlier tasks) and tags, e.g.
+        {"command": [...], "depends_on": [12, "list-resources"]}. Such a task is WAITING until every
+        parent task, and every task of each parent tag, is COMPLETED_OK, it then becomes NEW. As soon
+        as one of them ends COMPLETED_ERROR, TIMED_OUT or UPSTREAM_FAILED, it ends UPSTREAM_FAILED.
+        A parent tag without any task yet is not complete, a task cannot depend on its own tag.
+        """
+        try:
+            if not contents:
+                return 0
+            now = datetime.datetime.now()
+            dependencies = [ self.task_dependencies(content) for content in contents ]
+            rows = [ { "tag": tag, "content": self.encode_content(content), "priority": self.task_priority(content),
+                       "status": Status.WAITING if parent_ids or parent_tags else Status.NEW,
+                       "created_at": now, "updated_at": now }
+                     for content, (parent_ids, parent_tags) in zip(contents, dependencies) ]
+            session = self.session()
+            self.__check_dependencies(session, tag, dependencies)
+            if any(parent_ids or parent_tags for parent_ids, parent_tags in dependencies):
+                task_ids = session.execute(insert(Task).returning(Task.id, sort_by_parameter_order=True), rows).scalars().all()
+                self.__add_dependencies(session, [ (task_id, tag, parent_ids, parent_tags)
+                                                   for task_id, (parent_ids, parent_tags) in zip(task_ids, dependencies)
+                                                   if parent_ids or parent_tags ])
+            else:
+                session.execute(insert(Task), rows)
             session.commit()
             session.close()
+            return len(contents)
         except Exception as e:
             self.logger.error(e)
             raise TaskError(e)
@@ -108,10 +190,10 @@ class ExecutorActionDB:
                 tag=kwargs.get("tag") or task_row.tag,
                 content=kwargs.get("content") or task_row.content,
                 status=kwargs.get("status") or task_row.status,
-                updated_at=str(datetime.datetime.now()))
+                updated_at=datetime.datetime.now())
             task_session.update({
                 Task.tag: task_update.tag,
-                Task.content: task_update.content,
+                Task.content: self.encode_content(task_update.content),
                 Task.status: task_update.status,
                 Task.updated_at: task_update.updated_at
             }, synchronize_session = False)
@@ -123,9 +205,12 @@ class ExecutorActionDB:
             raise TaskError(e)
 
     def remove_task(self, task: Task) -> None:
+        """Remove task with its task logs and dependency edges."""
         try:
             session = self.session()            
-            session.query(Task).filter(Task.id == Task.id).delete(synchronize_session=False)
+            session.execute(delete(TaskLog).where(TaskLog.task_id == task.id))
+            session.execute(delete(TaskDependency).where(TaskDependency.task_id == task.id))
+            session.query(Task).filter(Task.id == task.id).delete(synchronize_session=False)
             # session.flush()
             session.commit()
             session.close()
@@ -133,16 +218,93 @@ class ExecutorActionDB:
             self.logger.error(e)
             raise TaskError(e)
 
+    def get_expired_tasks(self, updated_before: datetime.datetime, statuses=FINISHED, tag=None, limit: int = 1000) -> List[Task]:
+        """
+        Up to limit tasks in statuses, the finished ones by default, last updated before updated_before, by id,
+        each with all its task logs, oldest first, in task.logs. Tasks a WAITING task depends on, by id or by
+        tag, are left out: without them the dependents would never be released.
+        """
+        try:
+            waiting = aliased(Task)
+            parents = (
+                select(TaskDependency.parent_task_id)
+                .join(waiting, waiting.id == TaskDependency.task_id)
+                .where(waiting.status == Status.WAITING, TaskDependency.parent_task_id.is_not(None)))
+            parent_tags = (
+                select(TaskDependency.parent_tag)
+                .join(waiting, waiting.id == TaskDependency.task_id)
+                .where(waiting.status == Status.WAITING, TaskDependency.parent_tag.is_not(None)))
+            query = (
+                select(Task)
+                .where(Task.status.in_(list(statuses)), Task.updated_at < updated_before,
+                       Task.id.not_in(parents), Task.tag.not_in(parent_tags))
+                .order_by(Task.id)
+                .limit(int(limit)))
+            if tag is not None:
+                query = query.where(Task.tag == tag)
+            session = self.session()
+            tasks = session.execute(query).scalars().all()
+            logs: Dict[int, list] = {}
+            for chunk in self.__chunks([ task.id for task in tasks ]):
+                for log in session.execute(select(TaskLog).where(TaskLog.task_id.in_(chunk)).order_by(TaskLog.id)).scalars():
+                    logs.setdefault(log.task_id, []).append(log)
+            session.close()
+            for task in tasks:
+                # Not a relationship, every log of the task
+                task.logs = logs.get(task.id, [])
+            return tasks
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def delete_tasks(self, task_ids) -> int:
+        """Delete the tasks of task_ids with their task logs and dependency edges in one transaction, return how many."""
+        try:
+            deleted = 0
+            session = self.session()
+            for chunk in self.__chunks(task_ids):
+                session.execute(delete(TaskLog).where(TaskLog.task_id.in_(chunk)))
+                session.execute(delete(TaskDependency).where(TaskDependency.task_id.in_(chunk)))
+                deleted += session.execute(delete(Task).where(Task.id.in_(chunk))).rowcount
+            session.commit()
+            session.close()
+            return deleted
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def compact(self, pages: int = 1000) -> int:
+        """
+        Give up to pages free pages of the file back to the file system, return how many. One short write
+        transaction, repeat it until it returns less than pages. Needs auto_vacuum = INCREMENTAL, set by
+        create_db and by migrate_db(vacuum=True), nothing is done otherwise.
+        """
+        try:
+            connection = self.engine.raw_connection()
+            try:
+                if connection.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                    self.logger.warning("auto_vacuum is not INCREMENTAL, stop the workers and run migrate_executor_db --vacuum to compact the database")
+                    return 0
+                before = connection.execute("PRAGMA freelist_count").fetchone()[0]
+                # executescript steps the pragma to the end, execute would free a single page
+                connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+                return before - connection.execute("PRAGMA freelist_count").fetchone()[0]
+            finally:
+                connection.close()
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
     def add_task_log(self, task, status, message, created_at, updated_at):
         try:
             task: Task = task
             status: str = status
 
             task_log = TaskLog(
-                message=str(message),
+                message=self.encode_message(message),
                 status=status,
-                created_at=created_at or str(datetime.datetime.now()),
-                updated_at=updated_at or str(datetime.datetime.now()),
+                created_at=created_at or datetime.datetime.now(),
+                updated_at=updated_at or datetime.datetime.now(),
                 task_id=task.id
             )
             session = self.session()            
@@ -156,6 +318,674 @@ class ExecutorActionDB:
             self.logger.error(e)
             raise TaskLogError(e)
 
+    def complete_tasks(self, completions) -> None:
+        """
+        Write the final status and the task log of many finished tasks in one transaction.
+
+        completions -- iterable of result_writer.Completion
+
+        A completion is only written while its task is still IN_PROGRESS and claimed by the worker_id of
+        the completion: the late completion of a worker whose lease expired, the task reclaimed and claimed
+        by another worker since, is dropped with a warning.
+        """
+        try:
+            completions = list(completions)
+            if not completions:
+                return
+            now = datetime.datetime.now()
+            written_at = time.time()
+            session = self.session()
+            written = self.__complete_claimed(session, completions, now)
+            if len(written) < len(completions):
+                stale = [ c.task_id for c in completions if c not in written ]
+                self.logger.warning(f"Dropped {len(stale)} completions of tasks no longer claimed by their worker: {stale}")
+            completions = written
+            if not completions:
+                session.rollback()
+                session.close()
+                return
+            session.execute(
+                insert(TaskLog),
+                [ {
+                    "task_id": c.task_id,
+                    "message": self.encode_message(c.message),
+                    "status": c.status,
+                    "created_at": c.created_at or now,
+                    "updated_at": c.updated_at or now,
+                    "return_code": c.return_code,
+                    "stdout_bytes": c.stdout_bytes,
+                    "stderr_bytes": c.stderr_bytes,
+                    "duration": c.duration,
+                    "stdout_path": c.stdout_path,
+                    "stderr_path": c.stderr_path,
+                    **self.phases(c, written_at)
+                } for c in completions ])
+            if self.__has_dependencies(session):
+                # Released and failed dependents are committed with their parents
+                self.__resolve_dependencies(session, finished=[ c.task_id for c in completions if c.retry_at is None ])
+            session.commit()
+            session.close()
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskLogError(e)
+
+    def __complete_claimed(self, session: Session, completions: list, now) -> list:
+        """
+        Move the tasks of completions still IN_PROGRESS and claimed by their worker_id to their final status,
+        return the completions written. One executemany over the claims read first, then row by row, the
+        guarded UPDATE telling which completion is stale, when a claim changed in between.
+        """
+        complete = (
+            update(Task.__table__)
+            .where(Task.id == bindparam("task_id"), Task.status == Status.IN_PROGRESS,
+                   Task.worker_id.is_not_distinct_from(bindparam("claimed_by")))
+            .values(status=bindparam("final_status"), not_before=bindparam("retry_at"), updated_at=now, lease_expires_at=None))
+        parameters = lambda c: {
+            "task_id": c.task_id,
+            "claimed_by": c.worker_id,
+            "final_status": c.status if c.retry_at is None else Status.RE_PROCESS,
+            "retry_at": c.retry_at }
+        claimed = {}
+        for chunk in self.__chunks({ c.task_id for c in completions }):
+            claimed.update(session.execute(
+                select(Task.id, Task.worker_id).where(Task.id.in_(chunk), Task.status == Status.IN_PROGRESS)).all())
+        written = [ c for c in completions if c.task_id in claimed and claimed[c.task_id] == c.worker_id ]
+        if not written or session.execute(complete, [ parameters(c) for c in written ]).rowcount == len(written):
+            return written
+        session.rollback()
+        return [ c for c in completions if session.execute(complete, parameters(c)).rowcount ]
+
+    def encode_message(self, message) -> str | bytes:
+        """Task log messages are stored as JSON text (compressed by the codec), read them back with json.loads."""
+        return codecs.encode(super().encode_message(message), self.codec, text=True)
+
+    def encode_content(self, content):
+        """Task contents are stored as JSON, or as bytes of the codec."""
+        return codecs.encode(content, self.codec)
+
+    def __check_dependencies(self, session: Session, tag, dependencies: List[tuple]) -> None:
+        """
+        Raise ValueError, before anything is written, unless every parent task id of dependencies, (parent ids,
+        parent tags) of new tasks of tag, already exists and no parent waits, through any chain of WAITING
+        tasks, for tag: the new tasks join tag, so such a parent would wait for them and both stay WAITING forever.
+        Parents by id are earlier tasks, only the tag dependencies can lead back to the new tasks.
+        """
+        parent_ids = { parent for ids, _ in dependencies for parent in ids }
+        for chunk in self.__chunks(parent_ids):
+            parent_ids -= set(session.execute(select(Task.id).where(Task.id.in_(chunk))).scalars())
+        if parent_ids:
+            raise ValueError(f"depends_on unknown tasks: {sorted(parent_ids)}")
+        if any(tag in parent_tags for _, parent_tags in dependencies):
+            raise ValueError(f"a task cannot depend on its own tag: {tag}")
+        edges = (
+            select(TaskDependency.parent_task_id, TaskDependency.parent_tag)
+            .join(Task, Task.id == TaskDependency.task_id)
+            .where(Task.status == Status.WAITING))
+        if session.execute(edges.where(TaskDependency.parent_tag == tag).limit(1)).first() is None:
+            return
+        task_ids = { parent for ids, _ in dependencies for parent in ids }
+        tags = { parent for _, parent_tags in dependencies for parent in parent_tags }
+        seen_ids, seen_tags = set(), set()
+        while task_ids or tags:
+            seen_tags |= tags
+            if tags:
+                task_ids |= set(session.execute(
+                    select(Task.id).where(Task.tag.in_(list(tags)), Task.status == Status.WAITING)).scalars()) - seen_ids
+            seen_ids |= task_ids
+            next_ids, next_tags = set(), set()
+            for chunk in self.__chunks(task_ids):
+                for parent_task_id, parent_tag in session.execute(edges.where(TaskDependency.task_id.in_(chunk))):
+                    if parent_tag == tag:
+                        raise ValueError(f"depends_on makes a cycle, a parent waits for tag {tag}")
+                    if parent_task_id is not None:
+                        next_ids.add(parent_task_id)
+                    if parent_tag is not None:
+                        next_tags.add(parent_tag)
+            task_ids, tags = next_ids - seen_ids, next_tags - seen_tags
+
+    def __add_dependencies(self, session: Session, tasks: List[tuple]) -> None:
+        """Insert the edges of new WAITING tasks, (id, tag, parent ids, parent tags), and settle those already satisfied."""
+        edges = []
+        for task_id, tag, parent_ids, parent_tags in tasks:
+            edges += [ { "task_id": task_id, "parent_task_id": parent, "parent_tag": None } for parent in parent_ids ]
+            edges += [ { "task_id": task_id, "parent_task_id": None, "parent_tag": parent } for parent in parent_tags ]
+        session.execute(insert(TaskDependency), edges)
+        self.__resolve_dependencies(session, waiting=[ task_id for task_id, *_ in tasks ])
+
+    @staticmethod
+    def __has_dependencies(session: Session) -> bool:
+        return session.execute(select(TaskDependency.id).limit(1)).first() is not None
+
+    def __resolve_dependencies(self, session: Session, finished=(), waiting=()) -> None:
+        """
+        Settle the WAITING dependents of the finished tasks and the waiting tasks: NEW once every parent
+        completed OK, UPSTREAM_FAILED with a task log as soon as one failed. A task failed this way is
+        finished in turn, so a failure goes down the whole graph in one transaction.
+        """
+        finished, waiting = set(finished), set(waiting)
+        while finished or waiting:
+            # Tag states change with the tasks failed by the previous round
+            tag_states: Dict[str, Status | None] = {}
+            if finished:
+                waiting |= self.__dependents(session, finished, tag_states)
+            released, failed = self.__settle(session, waiting, tag_states)
+            now = datetime.datetime.now()
+            for chunk in self.__chunks(released):
+                session.execute(update(Task).where(Task.id.in_(chunk), Task.status == Status.WAITING)
+                                .values(status=Status.NEW, updated_at=now))
+            if failed:
+                session.execute(update(Task), [ { "id": task_id, "status": Status.UPSTREAM_FAILED, "updated_at": now }
+                                                for task_id in failed ])
+                session.execute(insert(TaskLog), [ {
+                    "task_id": task_id,
+                    "message": self.encode_message({ "error": f"{parent} failed", "upstream": parent }),
+                    "status": Status.UPSTREAM_FAILED,
+                    "created_at": now,
+                    "updated_at": now,
+                    "written_at": time.time()
+                } for task_id, parent in failed.items() ])
+            if released or failed:
+                self.logger.info(f"Dependencies: {len(released)} tasks released, {len(failed)} failed upstream")
+            finished, waiting = set(failed), set()
+
+    def __dependents(self, session: Session, finished, tag_states) -> set:
+        """WAITING tasks having a finished task as parent, or a parent tag of theirs now complete or failed."""
+        tags = set()
+        for chunk in self.__chunks(finished):
+            tags.update(session.execute(select(Task.tag).where(Task.id.in_(chunk)).distinct()).scalars())
+        parent_tags = session.execute(
+            select(TaskDependency.parent_tag).where(TaskDependency.parent_tag.in_(tags)).distinct()).scalars().all()
+        settled = [ tag for tag in parent_tags if self.__tag_state(session, tag, tag_states) is not None ]
+        query = (
+            select(TaskDependency.task_id).distinct()
+            .join(Task, Task.id == TaskDependency.task_id)
+            .where(Task.status == Status.WAITING))
+        dependents = set()
+        for chunk in self.__chunks(finished):
+            dependents.update(session.execute(query.where(TaskDependency.parent_task_id.in_(chunk))).scalars())
+        if settled:
+            dependents.update(session.execute(query.where(TaskDependency.parent_tag.in_(settled))).scalars())
+        return dependents
+
+    def __settle(self, session: Session, waiting, tag_states) -> tuple:
+        """(ids of the waiting tasks to release, { id of a task to fail: its failed parent })."""
+        parents: Dict[int, list] = {}
+        for chunk in self.__chunks(waiting):
+            edges = session.execute(
+                select(TaskDependency.task_id, TaskDependency.parent_task_id, TaskDependency.parent_tag)
+                .join(Task, Task.id == TaskDependency.task_id)
+                .where(TaskDependency.task_id.in_(chunk), Task.status == Status.WAITING))
+            for task_id, parent_task_id, parent_tag in edges:
+                parents.setdefault(task_id, []).append((parent_task_id, parent_tag))
+        statuses = {}
+        for chunk in self.__chunks({ parent_task_id for edges in parents.values() for parent_task_id, _ in edges
+                                     if parent_task_id is not None }):
+            statuses.update(session.execute(select(Task.id, Task.status).where(Task.id.in_(chunk))).all())
+        released, failed = [], {}
+        for task_id, edges in parents.items():
+            states = []
+            for parent_task_id, parent_tag in edges:
+                if parent_task_id is not None:
+                    # A removed parent never completes
+                    status = statuses.get(parent_task_id, Status.UPSTREAM_FAILED)
+                    state = Status.UPSTREAM_FAILED if status in FAILED else status if status == Status.COMPLETED_OK else None
+                    states.append((self.upstream_task(parent_task_id), state))
+                else:
+                    states.append((f"tag {parent_tag}", self.__tag_state(session, parent_tag, tag_states)))
+            upstream = next((parent for parent, state in states if state == Status.UPSTREAM_FAILED), None)
+            if upstream is not None:
+                failed[task_id] = upstream
+            elif all(state == Status.COMPLETED_OK for _, state in states):
+                released.append(task_id)
+        return released, failed
+
+    def upstream_task(self, task_id: int) -> str:
+        """How a failed parent task is named in the task logs of its dependents."""
+        return f"task {task_id}"
+
+    @staticmethod
+    def __tag_state(session: Session, tag, tag_states) -> Status | None:
+        """COMPLETED_OK when every task of tag did, UPSTREAM_FAILED when one failed, None otherwise. Three index lookups."""
+        if tag not in tag_states:
+            exists = lambda statuses: session.execute(
+                select(Task.id).where(Task.tag == tag, Task.status.in_(statuses)).limit(1)).first() is not None
+            if exists(FAILED):
+                tag_states[tag] = Status.UPSTREAM_FAILED
+            elif not exists(UNFINISHED) and exists([Status.COMPLETED_OK]):
+                tag_states[tag] = Status.COMPLETED_OK
+            else:
+                tag_states[tag] = None
+        return tag_states[tag]
+
+    @staticmethod
+    def __chunks(ids) -> Iterator[list]:
+        ids = list(ids)
+        for start in range(0, len(ids), ID_CHUNK):
+            yield ids[start:start + ID_CHUNK]
+
+    def claim_tasks(self, tag, status, batch_size: int = 1, worker_id: str = None, lease_seconds: float = None) -> List[Task]:
+        """
+        Atomically move up to batch_size tasks of tag from status to IN_PROGRESS and return them,
+        highest priority first, then oldest first.
+
+        The claim is a single UPDATE ... WHERE id IN (SELECT ... LIMIT n) RETURNING statement,
+        so its cost does not depend on the backlog size and two processes never claim the same row.
+        status can be a Status or a list of them, each status is read in priority order from
+        ix_tasks_tag_status_priority_id and only the first batch_size of each are merged.
+        Tasks waiting for a retry (not_before in the future) are skipped, the attempts counter of
+        claimed tasks is incremented and claimed_at set, the claimed tasks also get a claim_duration
+        attribute (seconds spent in this call). With lease_seconds the tasks are leased to worker_id, see
+        renew_leases and reclaim_expired_leases.
+        """
+        try:
+            statuses = list(status) if isinstance(status, (list, tuple, set)) else [status]
+            started = time.perf_counter()
+            session = self.session(expire_on_commit=False)
+            now = time.time()
+            per_status = [
+                select(Task.id, Task.priority)
+                .where(Task.tag == tag, Task.status == status, or_(Task.not_before.is_(None), Task.not_before <= now))
+                .order_by(Task.priority.desc(), Task.id)
+                .limit(batch_size)
+                .subquery()
+                for status in statuses ]
+            if len(per_status) == 1:
+                merged = per_status[0]
+            else:
+                merged = union_all(*[ select(branch.c.id, branch.c.priority) for branch in per_status ]).subquery()
+            candidates = (
+                select(merged.c.id)
+                .order_by(merged.c.priority.desc(), merged.c.id)
+                .limit(batch_size)
+                .scalar_subquery())
+            lease_expires_at = now + float(lease_seconds) if lease_seconds else None
+            result = session.execute(
+                update(Task)
+                .where(Task.id.in_(candidates))
+                .values(status=Status.IN_PROGRESS, updated_at=datetime.datetime.now(),
+                        worker_id=worker_id, lease_expires_at=lease_expires_at, attempts=Task.attempts + 1,
+                        claimed_at=now)
+                .returning(Task),
+                execution_options={"synchronize_session": False})
+            tasks = sorted(result.scalars().all(), key=lambda task: (-task.priority, task.id))
+            session.commit()
+            session.close()
+            claim_duration = time.perf_counter() - started
+            for task in tasks:
+                # Not a column, profiled in the task log of the run
+                task.claim_duration = claim_duration
+            return tasks
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def count_tasks_by_tag(self, status) -> Dict[str, int]:
+        """Number of tasks in status (a Status or a list of them) per tag, e.g. the running tasks of every tag."""
+        try:
+            statuses = list(status) if isinstance(status, (list, tuple, set)) else [status]
+            session = self.session()
+            result = session.execute(
+                select(Task.tag, func.count()).where(Task.status.in_(statuses)).group_by(Task.tag)).all()
+            session.close()
+            return { tag: count for tag, count in result }
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def count_tasks_by_tag_and_status(self, tag=None) -> List[tuple]:
+        """(tag, status, count) of every tag, or of tag, and status having tasks. Counted on the tag/status index."""
+        try:
+            session = self.session()
+            query = select(Task.tag, Task.status, func.count()).group_by(Task.tag, Task.status).order_by(Task.tag, Task.status)
+            if tag is not None:
+                query = query.where(Task.tag == tag)
+            result = session.execute(query).all()
+            session.close()
+            return [ tuple(row) for row in result ]
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def count_completions_by_tag(self, windows: List[float], tag=None) -> Dict[str, List[int]]:
+        """
+        Number of task logs committed in each of the last windows seconds, per tag. Only the task logs of
+        the longest window are read, on the written_at index, so it costs the same on any table size.
+        """
+        try:
+            now = time.time()
+            windows = [ float(window) for window in windows ]
+            session = self.session()
+            query = (
+                select(Task.tag, *[ func.sum(TaskLog.written_at >= now - window, type_=Integer) for window in windows ])
+                .join(Task, Task.id == TaskLog.task_id)
+                .where(TaskLog.written_at >= now - max(windows))
+                .group_by(Task.tag))
+            if tag is not None:
+                query = query.where(Task.tag == tag)
+            result = session.execute(query).all()
+            session.close()
+            return { row[0]: [ int(count or 0) for count in row[1:] ] for row in result }
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskLogError(e)
+
+    def get_task_phases(self, tag=None) -> List[dict]:
+        """Phase timings of every task log having them, of tag or of every tag, oldest first."""
+        try:
+            session = self.session()
+            query = (
+                select(Task.tag, TaskLog.task_id, TaskLog.id.label("log_id"), TaskLog.status, TaskLog.worker_id,
+                       TaskLog.hostname, TaskLog.queue_wait, TaskLog.claim_duration, TaskLog.pickup_wait,
+                       TaskLog.spawn_duration, TaskLog.exec_duration, TaskLog.write_wait,
+                       (TaskLog.written_at - TaskLog.queued_at).label("total"))
+                .join(Task, Task.id == TaskLog.task_id)
+                .where(TaskLog.written_at.is_not(None))
+                .order_by(TaskLog.id))
+            if tag is not None:
+                query = query.where(Task.tag == tag)
+            result = [ dict(row._mapping) for row in session.execute(query) ]
+            session.close()
+            return result
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskLogError(e)
+
+    def iter_tasks(self, tag=None, status=None, batch_size: int = 1000) -> Iterator[Task]:
+        """
+        Yield the tasks of tag and status (a Status or a list of them), or of every tag and status, by id,
+        with constant memory. Each task has its latest task log, or None, in task.latest_log.
+
+        Keyset pagination on the primary key: every page is read in a short session of its own, two
+        queries per page (tasks, then their latest logs), so a long export neither holds a read
+        transaction nor makes one query per task. The tasks are detached, task.task_logs is not loaded.
+        """
+        try:
+            statuses = list(status) if isinstance(status, (list, tuple, set)) else [status] if status is not None else None
+            last_id = 0
+            while True:
+                # likely() keeps the planner on the primary key, the tag/status index would sort the whole tag per page
+                query = select(Task).where(Task.id > last_id).order_by(Task.id).limit(int(batch_size))
+                if tag is not None:
+                    query = query.where(func.likely(Task.tag == tag, type_=Boolean))
+                if statuses is not None:
+                    query = query.where(func.likely(Task.status.in_(statuses), type_=Boolean))
+                session = self.session()
+                tasks = session.execute(query).scalars().all()
+                if not tasks:
+                    session.close()
+                    return
+                latest = (
+                    select(func.max(TaskLog.id))
+                    .where(TaskLog.task_id.in_([ task.id for task in tasks ]))
+                    .group_by(TaskLog.task_id))
+                logs = { log.task_id: log for log in session.execute(select(TaskLog).where(TaskLog.id.in_(latest))).scalars() }
+                session.close()
+                # Before yielding, callers may change the tasks
+                last_id = tasks[-1].id
+                for task in tasks:
+                    # Not a relationship, loaded per page
+                    task.latest_log = logs.get(task.id)
+                    yield task
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def get_claimable_tags(self, status) -> List[str]:
+        """Tags having at least one task in status (a Status or a list of them)."""
+        try:
+            statuses = list(status) if isinstance(status, (list, tuple, set)) else [status]
+            session = self.session()
+            result = session.execute(
+                select(Task.tag).where(Task.status.in_(statuses)).distinct().order_by(Task.tag)).scalars().all()
+            session.close()
+            return list(result)
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def next_retry_at(self, tag) -> float | None:
+        """Epoch time of the earliest task of tag waiting for a retry, None when there is none."""
+        try:
+            session = self.session()
+            result = session.execute(
+                select(func.min(func.coalesce(Task.not_before, 0)))
+                .where(Task.tag == tag, Task.status == Status.RE_PROCESS)).scalar()
+            session.close()
+            return result
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def count_pending_parents(self, tags=None) -> int:
+        """
+        Parents, tasks by id and tags, of the WAITING tasks of tags (of every tag when None) that are running
+        or still to be claimed: while there is one, the waiting tasks may still be released.
+        """
+        try:
+            session = self.session()
+            parent = aliased(Task)
+            waiting = (
+                select(TaskDependency.parent_task_id, TaskDependency.parent_tag)
+                .join(Task, Task.id == TaskDependency.task_id)
+                .where(Task.status == Status.WAITING))
+            if tags is not None:
+                waiting = waiting.where(Task.tag.in_(list(tags)))
+            waiting = waiting.subquery()
+            by_id = session.execute(
+                select(func.count(parent.id.distinct()))
+                .join(waiting, waiting.c.parent_task_id == parent.id)
+                .where(parent.status.in_(PENDING))).scalar()
+            by_tag = session.execute(
+                select(func.count(waiting.c.parent_tag.distinct()))
+                .where(select(parent.id).where(parent.tag == waiting.c.parent_tag, parent.status.in_(PENDING)).exists())).scalar()
+            session.close()
+            return by_id + by_tag
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def register_worker(self, worker_id: str, hostname: str, pid: int) -> None:
+        try:
+            session = self.session()
+            session.merge(Worker(id=worker_id, hostname=hostname, pid=pid, status="active",
+                                 started_at=str(datetime.datetime.now()), heartbeat_at=time.time()))
+            session.commit()
+            session.close()
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def deregister_worker(self, worker_id: str) -> None:
+        try:
+            session = self.session()
+            session.execute(update(Worker).where(Worker.id == worker_id).values(status="stopped", heartbeat_at=time.time()))
+            session.commit()
+            session.close()
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def renew_leases(self, worker_id: str, lease_seconds: float) -> int:
+        """Heartbeat of worker_id: extend the lease of every task it holds, return how many."""
+        try:
+            now = time.time()
+            session = self.session()
+            session.execute(update(Worker).where(Worker.id == worker_id).values(heartbeat_at=now))
+            result = session.execute(
+                update(Task)
+                .where(Task.worker_id == worker_id, Task.status == Status.IN_PROGRESS)
+                .values(lease_expires_at=now + float(lease_seconds)),
+                execution_options={"synchronize_session": False})
+            session.commit()
+            session.close()
+            return result.rowcount
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def reclaim_expired_leases(self, status: Status = Status.RE_PROCESS, worker_timeout: float = None) -> int:
+        """
+        Give the tasks whose lease expired, because their worker stopped heart-beating, back to the queue
+        with status (RE_PROCESS by default) and return how many. With worker_timeout, active workers
+        without a heartbeat for that many seconds are marked as lost.
+        """
+        try:
+            now = time.time()
+            session = self.session()
+            result = session.execute(
+                update(Task)
+                .where(Task.status == Status.IN_PROGRESS, Task.lease_expires_at < now)
+                .values(status=status, worker_id=None, lease_expires_at=None, updated_at=datetime.datetime.now()),
+                execution_options={"synchronize_session": False})
+            if worker_timeout:
+                session.execute(
+                    update(Worker)
+                    .where(Worker.status == "active", Worker.heartbeat_at < now - float(worker_timeout))
+                    .values(status="lost"))
+            session.commit()
+            session.close()
+            if result.rowcount:
+                self.logger.warning(f"Reclaimed {result.rowcount} tasks with an expired lease")
+            return result.rowcount
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def get_workers(self) -> List[Worker]:
+        try:
+            session = self.session()
+            result = session.query(Worker).order_by(Worker.started_at).all()
+            session.close()
+            return result
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def get_tag_setting(self, tag) -> TagSetting:
+        try:
+            session = self.session()
+            result = session.get(TagSetting, tag)
+            session.close()
+            return result
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def get_tag_settings(self) -> List[TagSetting]:
+        try:
+            session = self.session()
+            result = session.query(TagSetting).order_by(TagSetting.tag).all()
+            session.close()
+            return result
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def set_tag_setting(self, tag, **kwargs) -> TagSetting:
+        """Create or update the settings of tag, only the given columns are changed."""
+        try:
+            session = self.session(expire_on_commit=False)
+            setting = session.get(TagSetting, tag) or TagSetting(tag=tag)
+            for name, value in kwargs.items():
+                if name not in TagSetting.__table__.columns or name == "tag":
+                    raise ValueError(f"unknown tag setting: {name}")
+                setattr(setting, name, value)
+            session.add(setting)
+            session.commit()
+            session.close()
+            return setting
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def get_cached_result(self, key: str, min_created_at: float = None) -> CachedResult:
+        """Cached result of key, None when there is none or it is older than min_created_at."""
+        try:
+            session = self.session()
+            query = select(CachedResult).where(CachedResult.key == key)
+            if min_created_at is not None:
+                query = query.where(CachedResult.created_at >= min_created_at)
+            result = session.execute(query).scalar()
+            session.close()
+            return result
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def put_cached_result(self, key: str, task_id: int, message, **kwargs) -> None:
+        """Create or replace the cached result of key, kwargs are CachedResult columns."""
+        try:
+            now = time.time()
+            message = self.encode_message(message)
+            values = dict(key=key, task_id=task_id, message=message, size=len(message), created_at=now,
+                          last_used_at=now, hits=0, **kwargs)
+            session = self.session()
+            session.execute(
+                sqlite_insert(CachedResult).values(**values)
+                .on_conflict_do_update(index_elements=[CachedResult.key],
+                                       set_={ name: value for name, value in values.items() if name != "key" }))
+            session.commit()
+            session.close()
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def record_cache_hits(self, hits: Dict[str, int]) -> None:
+        """Add hits, a count per key, to the cached results and mark them as used now."""
+        try:
+            if not hits:
+                return
+            now = time.time()
+            session = self.session()
+            # Core executemany, an ORM bulk UPDATE would require the primary key in every row
+            table = CachedResult.__table__
+            session.connection().execute(
+                update(table)
+                .where(table.c.key == bindparam("hit_key"))
+                .values(hits=table.c.hits + bindparam("count"), last_used_at=now),
+                [ { "hit_key": key, "count": count } for key, count in hits.items() ])
+            session.commit()
+            session.close()
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def evict_cached_results(self, max_age: float = None, max_bytes: int = None) -> int:
+        """
+        Delete cached results older than max_age seconds, then the least recently used ones
+        until the messages of the remaining ones take at most max_bytes. Return how many were deleted.
+        """
+        try:
+            deleted = 0
+            session = self.session()
+            if max_age is not None:
+                deleted += session.execute(
+                    delete(CachedResult).where(CachedResult.created_at < time.time() - float(max_age))).rowcount
+            if max_bytes is not None:
+                used = (
+                    select(CachedResult.key,
+                           func.sum(CachedResult.size).over(order_by=(CachedResult.last_used_at.desc(), CachedResult.key)).label("used"))
+                    .subquery())
+                deleted += session.execute(
+                    delete(CachedResult).where(CachedResult.key.in_(select(used.c.key).where(used.c.used > int(max_bytes))))).rowcount
+            session.commit()
+            session.close()
+            return deleted
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def cache_summary(self) -> Dict[str, int]:
+        try:
+            session = self.session()
+            entries, size, hits = session.execute(
+                select(func.count(), func.coalesce(func.sum(CachedResult.size), 0), func.coalesce(func.sum(CachedResult.hits), 0))).one()
+            session.close()
+            return { "entries": entries, "bytes": size, "hits": hits }
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
     @overload
     def get_task(self, **kwargs) -> Task:
         ...
@@ -170,9 +1000,9 @@ class ExecutorActionDB:
             if kwargs.get("id"):
                 result = session.query(Task).filter(Task.id==kwargs.get("id")).first()
             elif kwargs.get("tag") and kwargs.get("status"):
-                result = session.query(Task).filter(Task.tag==kwargs.get("tag"), Task.status==kwargs.get("status")).all()
+                result = session.query(Task).filter(Task.tag==kwargs.get("tag"), Task.status==kwargs.get("status")).order_by(Task.id).all()
             elif kwargs.get("tag"):
-                result = session.query(Task).filter(Task.tag==kwargs.get("tag")).all()
+                result = session.query(Task).filter(Task.tag==kwargs.get("tag")).order_by(Task.id).all()
             else:
                 raise ValueError("provide either id or tag")
             return result
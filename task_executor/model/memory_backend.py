@@ -0,0 +1,581 @@
+"""
+In-memory storage backend: every row lives in dicts of the current process.
+
+Nothing is written to disk and nothing is left when the process ends, so it suits ephemeral
+runs (one process adding, running and exporting its own tasks) and tests.
+
+from task_executor.executor import Executor
+executor = Executor(backend="memory")
+"""
+
+from __future__ import annotations
+import datetime
+import heapq
+import logging
+import threading
+import time
+from typing import Dict, Iterator, List, Set
+from ..exceptions import TaskError, TaskLogError
+from . import migration
+from .backend import FAILED, FINISHED, PENDING, UNFINISHED, StorageBackend
+from .orm import STATUS_CODES, CachedResult, Status, TagSetting, Task, TaskLog, Worker
+
+# Statuses claimed from a heap per tag, other statuses are claimed by a scan
+QUEUED = (Status.NEW, Status.RE_PROCESS)
+TASK_COLUMNS = [ column.key for column in Task.__table__.columns ]
+TASK_LOG_COLUMNS = [ column.key for column in TaskLog.__table__.columns ]
+CACHE_COLUMNS = [ column.key for column in CachedResult.__table__.columns ]
+
+
+class MemoryBackend(StorageBackend):
+    """
+    Tasks, task logs, workers, tag settings and cached results in dicts, behind one lock.
+
+    The lock serializes every call, as the write lock of SQLite does, and claims pop the highest
+    priority tasks from one heap per tag and status, so a claim costs O(batch_size log n) on any
+    backlog. Rows are copied in and out: the Task, TaskLog, Worker, TagSetting and CachedResult
+    objects returned are transient ORM instances. Messages are kept as JSON text like in SQLite,
+    contents as dicts, the codec does not apply.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.logger = logging.getLogger(__class__.__name__)
+        self.create_db()
+
+    def create_db(self) -> None:
+        with self.lock:
+            self.tasks: Dict[int, dict] = {}
+            # By id, in commit order
+            self.logs: Dict[int, dict] = {}
+            self.task_logs: Dict[int, List[dict]] = {}
+            # Heaps of (-priority, id) per (tag, status) of QUEUED, entries of rows that changed are skipped
+            self.queues: Dict[tuple, list] = {}
+            self.counts: Dict[tuple, int] = {}
+            self.in_progress: Set[int] = set()
+            # Edges of the WAITING tasks only, dropped once a task is released or failed
+            self.parents: Dict[int, List[tuple]] = {}
+            self.task_children: Dict[int, Set[int]] = {}
+            self.tag_children: Dict[str, Set[int]] = {}
+            self.workers: Dict[str, dict] = {}
+            self.tag_settings: Dict[str, dict] = {}
+            self.cache: Dict[str, dict] = {}
+            self.last_task_id = 0
+            self.last_log_id = 0
+
+    def migrate_db(self, vacuum: bool = False) -> List[int]:
+        return []
+
+    def schema_version(self) -> int:
+        return migration.SCHEMA_VERSION
+
+    def add_task(self, tag, content) -> int:
+        try:
+            content = self.parse_content(content)
+            with self.lock:
+                return self.__insert(tag, [content])[0]
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def insert_tasks(self, tag, contents: List[dict]) -> int:
+        try:
+            with self.lock:
+                return len(self.__insert(tag, contents))
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def update_task(self, task: Task, **kwargs) -> None:
+        try:
+            with self.lock:
+                row = self.tasks[task.id]
+                row["content"] = kwargs.get("content") or row["content"]
+                row["updated_at"] = datetime.datetime.now()
+                self.__place(row, kwargs.get("tag") or row["tag"], kwargs.get("status") or row["status"])
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def remove_task(self, task: Task) -> None:
+        try:
+            self.delete_tasks([task.id])
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def get_expired_tasks(self, updated_before: datetime.datetime, statuses=FINISHED, tag=None, limit: int = 1000) -> List[Task]:
+        statuses = list(statuses)
+        tasks = []
+        with self.lock:
+            for row in self.tasks.values():
+                if len(tasks) >= int(limit):
+                    break
+                if row["status"] not in statuses or row["updated_at"] >= updated_before or (tag is not None and row["tag"] != tag):
+                    continue
+                # The parents of WAITING tasks stay
+                if self.task_children.get(row["id"]) or self.tag_children.get(row["tag"]):
+                    continue
+                task = self.__task(row)
+                task.logs = [ self.__task_log(log) for log in self.task_logs.get(row["id"], ()) ]
+                tasks.append(task)
+        return tasks
+
+    def delete_tasks(self, task_ids) -> int:
+        deleted = 0
+        with self.lock:
+            for task_id in task_ids:
+                row = self.tasks.pop(task_id, None)
+                if row is None:
+                    continue
+                self.__count(row, -1)
+                for log in self.task_logs.pop(task_id, ()):
+                    del self.logs[log["id"]]
+                self.__drop_edges(task_id)
+                deleted += 1
+        return deleted
+
+    def compact(self, pages: int = 1000) -> int:
+        """Deleted rows are freed at once, there is nothing to give back."""
+        return 0
+
+    def add_task_log(self, task, status, message, created_at, updated_at):
+        try:
+            with self.lock:
+                return self.__task_log(self.__add_log(task.id, message, status, created_at or datetime.datetime.now(),
+                                                      updated_at or datetime.datetime.now()))
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskLogError(e)
+
+    def complete_tasks(self, completions) -> None:
+        completions = list(completions)
+        if not completions:
+            return
+        with self.lock:
+            now = datetime.datetime.now()
+            written_at = time.time()
+            written, stale = [], []
+            for c in completions:
+                row = self.tasks.get(c.task_id)
+                # Only the worker still holding the task completes it, see ExecutorActionDB.complete_tasks
+                if row is None or row["status"] != Status.IN_PROGRESS or row["worker_id"] != c.worker_id:
+                    stale.append(c.task_id)
+                    continue
+                written.append(c)
+                row.update(not_before=c.retry_at, updated_at=now, lease_expires_at=None)
+                self.__place(row, row["tag"], c.status if c.retry_at is None else Status.RE_PROCESS)
+                self.__add_log(c.task_id, c.message, c.status, c.created_at or now, c.updated_at or now,
+                               return_code=c.return_code, stdout_bytes=c.stdout_bytes, stderr_bytes=c.stderr_bytes,
+                               duration=c.duration, stdout_path=c.stdout_path, stderr_path=c.stderr_path,
+                               **self.phases(c, written_at))
+            if stale:
+                self.logger.warning(f"Dropped {len(stale)} completions of tasks no longer claimed by their worker: {stale}")
+            if self.parents:
+                self.__resolve_dependencies(finished=[ c.task_id for c in written if c.retry_at is None ])
+
+    def claim_tasks(self, tag, status, batch_size: int = 1, worker_id: str = None, lease_seconds: float = None) -> List[Task]:
+        statuses = list(status) if isinstance(status, (list, tuple, set)) else [status]
+        started = time.perf_counter()
+        with self.lock:
+            now = time.time()
+            candidates = []
+            for status in statuses:
+                candidates += [ (entry, status) for entry in self.__take(tag, status, batch_size, now) ]
+            candidates.sort()
+            for entry, status in candidates[batch_size:]:
+                if status in QUEUED:
+                    heapq.heappush(self.queues[(tag, status)], entry)
+            lease_expires_at = now + float(lease_seconds) if lease_seconds else None
+            tasks = []
+            for (_, task_id), _ in candidates[:batch_size]:
+                row = self.tasks[task_id]
+                row.update(updated_at=datetime.datetime.now(), worker_id=worker_id, lease_expires_at=lease_expires_at,
+                           attempts=row["attempts"] + 1, claimed_at=now)
+                self.__place(row, tag, Status.IN_PROGRESS)
+                tasks.append(self.__task(row))
+        claim_duration = time.perf_counter() - started
+        for task in tasks:
+            task.claim_duration = claim_duration
+        return tasks
+
+    def count_tasks_by_tag(self, status) -> Dict[str, int]:
+        statuses = list(status) if isinstance(status, (list, tuple, set)) else [status]
+        result: Dict[str, int] = {}
+        with self.lock:
+            for (tag, status), count in self.counts.items():
+                if status in statuses:
+                    result[tag] = result.get(tag, 0) + count
+        return result
+
+    def count_tasks_by_tag_and_status(self, tag=None) -> List[tuple]:
+        with self.lock:
+            counts = [ (key[0], key[1], count) for key, count in self.counts.items() if tag is None or key[0] == tag ]
+        return sorted(counts, key=lambda row: (row[0], STATUS_CODES[row[1]]))
+
+    def count_completions_by_tag(self, windows: List[float], tag=None) -> Dict[str, List[int]]:
+        now = time.time()
+        windows = [ float(window) for window in windows ]
+        result: Dict[str, List[int]] = {}
+        with self.lock:
+            # Logs are appended in commit order, so only the tail of the longest window is read
+            for log in reversed(self.logs.values()):
+                if log["written_at"] is None:
+                    continue
+                if log["written_at"] < now - max(windows):
+                    break
+                row = self.tasks.get(log["task_id"])
+                if row is None or (tag is not None and row["tag"] != tag):
+                    continue
+                counts = result.setdefault(row["tag"], [0] * len(windows))
+                for i, window in enumerate(windows):
+                    counts[i] += log["written_at"] >= now - window
+        return result
+
+    def get_task_phases(self, tag=None) -> List[dict]:
+        result = []
+        with self.lock:
+            for log in self.logs.values():
+                row = self.tasks.get(log["task_id"])
+                if log["written_at"] is None or row is None or (tag is not None and row["tag"] != tag):
+                    continue
+                total = log["written_at"] - log["queued_at"] if log["queued_at"] is not None else None
+                result.append(dict(
+                    { name: log[name] for name in ("task_id", "status", "worker_id", "hostname", "queue_wait", "claim_duration",
+                                                   "pickup_wait", "spawn_duration", "exec_duration", "write_wait") },
+                    tag=row["tag"], log_id=log["id"], total=total))
+        return result
+
+    def iter_tasks(self, tag=None, status=None, batch_size: int = 1000) -> Iterator[Task]:
+        statuses = list(status) if isinstance(status, (list, tuple, set)) else [status] if status is not None else None
+        with self.lock:
+            ids = [ task_id for task_id, row in self.tasks.items()
+                    if (tag is None or row["tag"] == tag) and (statuses is None or row["status"] in statuses) ]
+        for start in range(0, len(ids), int(batch_size)):
+            with self.lock:
+                page = []
+                for task_id in ids[start:start + int(batch_size)]:
+                    row = self.tasks.get(task_id)
+                    if row is None:
+                        continue
+                    task = self.__task(row)
+                    logs = self.task_logs.get(task_id)
+                    task.latest_log = self.__task_log(logs[-1]) if logs else None
+                    page.append(task)
+            yield from page
+
+    def get_claimable_tags(self, status) -> List[str]:
+        statuses = list(status) if isinstance(status, (list, tuple, set)) else [status]
+        with self.lock:
+            return sorted({ tag for (tag, status), count in self.counts.items() if status in statuses and count })
+
+    def next_retry_at(self, tag) -> float | None:
+        with self.lock:
+            rows = [ self.tasks[task_id] for _, task_id in self.queues.get((tag, Status.RE_PROCESS), ()) if task_id in self.tasks ]
+            retry_times = [ row["not_before"] or 0 for row in rows if row["tag"] == tag and row["status"] == Status.RE_PROCESS ]
+        return min(retry_times) if retry_times else None
+
+    def count_pending_parents(self, tags=None) -> int:
+        tags = None if tags is None else set(tags)
+        with self.lock:
+            parent_ids, parent_tags = set(), set()
+            for task_id, parents in self.parents.items():
+                row = self.tasks.get(task_id)
+                if row is None or row["status"] != Status.WAITING or (tags is not None and row["tag"] not in tags):
+                    continue
+                parent_ids.update(parent for parent, _ in parents if parent is not None)
+                parent_tags.update(parent for _, parent in parents if parent is not None)
+            pending = lambda tag: any(self.counts.get((tag, status), 0) for status in PENDING)
+            return (sum(1 for parent in parent_ids if parent in self.tasks and self.tasks[parent]["status"] in PENDING)
+                    + sum(1 for tag in parent_tags if pending(tag)))
+
+    def register_worker(self, worker_id: str, hostname: str, pid: int) -> None:
+        with self.lock:
+            self.workers[worker_id] = dict(id=worker_id, hostname=hostname, pid=pid, status="active",
+                                           started_at=str(datetime.datetime.now()), heartbeat_at=time.time())
+
+    def deregister_worker(self, worker_id: str) -> None:
+        with self.lock:
+            if worker_id in self.workers:
+                self.workers[worker_id].update(status="stopped", heartbeat_at=time.time())
+
+    def renew_leases(self, worker_id: str, lease_seconds: float) -> int:
+        with self.lock:
+            now = time.time()
+            if worker_id in self.workers:
+                self.workers[worker_id]["heartbeat_at"] = now
+            rows = [ self.tasks[task_id] for task_id in self.in_progress if self.tasks[task_id]["worker_id"] == worker_id ]
+            for row in rows:
+                row["lease_expires_at"] = now + float(lease_seconds)
+            return len(rows)
+
+    def reclaim_expired_leases(self, status: Status = Status.RE_PROCESS, worker_timeout: float = None) -> int:
+        with self.lock:
+            now = time.time()
+            rows = [ self.tasks[task_id] for task_id in self.in_progress
+                     if self.tasks[task_id]["lease_expires_at"] is not None and self.tasks[task_id]["lease_expires_at"] < now ]
+            for row in rows:
+                row.update(worker_id=None, lease_expires_at=None, updated_at=datetime.datetime.now())
+                self.__place(row, row["tag"], status)
+            if worker_timeout:
+                for worker in self.workers.values():
+                    if worker["status"] == "active" and worker["heartbeat_at"] < now - float(worker_timeout):
+                        worker["status"] = "lost"
+        if rows:
+            self.logger.warning(f"Reclaimed {len(rows)} tasks with an expired lease")
+        return len(rows)
+
+    def get_workers(self) -> List[Worker]:
+        with self.lock:
+            return [ Worker(**worker) for worker in sorted(self.workers.values(), key=lambda worker: worker["started_at"]) ]
+
+    def get_tag_setting(self, tag) -> TagSetting:
+        with self.lock:
+            setting = self.tag_settings.get(tag)
+            return TagSetting(**setting) if setting is not None else None
+
+    def get_tag_settings(self) -> List[TagSetting]:
+        with self.lock:
+            return [ TagSetting(**self.tag_settings[tag]) for tag in sorted(self.tag_settings) ]
+
+    def set_tag_setting(self, tag, **kwargs) -> TagSetting:
+        try:
+            for name in kwargs:
+                if name not in TagSetting.__table__.columns or name == "tag":
+                    raise ValueError(f"unknown tag setting: {name}")
+            with self.lock:
+                setting = self.tag_settings.setdefault(tag, { column.key: None for column in TagSetting.__table__.columns })
+                setting.update(kwargs, tag=tag)
+                return TagSetting(**setting)
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def get_cached_result(self, key: str, min_created_at: float = None) -> CachedResult:
+        with self.lock:
+            cached = self.cache.get(key)
+            if cached is None or (min_created_at is not None and cached["created_at"] < min_created_at):
+                return None
+            return CachedResult(**cached)
+
+    def put_cached_result(self, key: str, task_id: int, message, **kwargs) -> None:
+        now = time.time()
+        message = self.encode_message(message)
+        with self.lock:
+            self.cache[key] = dict({ column: None for column in CACHE_COLUMNS }, key=key, task_id=task_id, message=message,
+                                   size=len(message), created_at=now, last_used_at=now, hits=0, **kwargs)
+
+    def record_cache_hits(self, hits: Dict[str, int]) -> None:
+        now = time.time()
+        with self.lock:
+            for key, count in hits.items():
+                if key in self.cache:
+                    self.cache[key]["hits"] += count
+                    self.cache[key]["last_used_at"] = now
+
+    def evict_cached_results(self, max_age: float = None, max_bytes: int = None) -> int:
+        with self.lock:
+            evicted = []
+            if max_age is not None:
+                evicted += [ key for key, cached in self.cache.items() if cached["created_at"] < time.time() - float(max_age) ]
+                for key in evicted:
+                    del self.cache[key]
+            if max_bytes is not None:
+                used = 0
+                for cached in sorted(self.cache.values(), key=lambda cached: (-cached["last_used_at"], cached["key"])):
+                    used += cached["size"]
+                    if used > int(max_bytes):
+                        evicted.append(cached["key"])
+                        del self.cache[cached["key"]]
+            return len(evicted)
+
+    def cache_summary(self) -> Dict[str, int]:
+        with self.lock:
+            return { "entries": len(self.cache), "bytes": sum(cached["size"] for cached in self.cache.values()),
+                     "hits": sum(cached["hits"] for cached in self.cache.values()) }
+
+    def get_task(self, **kwargs) -> Task | List[Task]:
+        try:
+            with self.lock:
+                if kwargs.get("id"):
+                    row = self.tasks.get(kwargs.get("id"))
+                    return self.__with_logs(self.__task(row)) if row is not None else None
+                if kwargs.get("tag"):
+                    return [ self.__with_logs(self.__task(row)) for row in self.tasks.values()
+                             if row["tag"] == kwargs.get("tag") and (not kwargs.get("status") or row["status"] == kwargs.get("status")) ]
+                raise ValueError("provide either id or tag")
+        except Exception as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def __insert(self, tag, contents: List[dict]) -> List[int]:
+        dependencies = [ self.task_dependencies(content) for content in contents ]
+        self.__check_dependencies(tag, dependencies)
+        now = datetime.datetime.now()
+        task_ids, waiting = [], []
+        for content, (parent_ids, parent_tags) in zip(contents, dependencies):
+            self.last_task_id += 1
+            row = dict({ column: None for column in TASK_COLUMNS }, id=self.last_task_id, tag=tag, content=content,
+                       priority=self.task_priority(content), attempts=0, created_at=now, updated_at=now)
+            self.tasks[row["id"]] = row
+            self.__place(row, tag, Status.WAITING if parent_ids or parent_tags else Status.NEW)
+            task_ids.append(row["id"])
+            if parent_ids or parent_tags:
+                self.parents[row["id"]] = [ (parent, None) for parent in parent_ids ] + [ (None, parent) for parent in parent_tags ]
+                for parent in parent_ids:
+                    self.task_children.setdefault(parent, set()).add(row["id"])
+                for parent in parent_tags:
+                    self.tag_children.setdefault(parent, set()).add(row["id"])
+                waiting.append(row["id"])
+        if waiting:
+            self.__resolve_dependencies(waiting=waiting)
+        return task_ids
+
+    def __check_dependencies(self, tag, dependencies: List[tuple]) -> None:
+        unknown = sorted({ parent for parent_ids, _ in dependencies for parent in parent_ids if parent not in self.tasks })
+        if unknown:
+            raise ValueError(f"depends_on unknown tasks: {unknown}")
+        if any(tag in parent_tags for _, parent_tags in dependencies):
+            raise ValueError(f"a task cannot depend on its own tag: {tag}")
+        # As ExecutorActionDB: no parent may wait, through a chain of WAITING tasks, for tag
+        if tag not in self.tag_children:
+            return
+        task_ids = { parent for parent_ids, _ in dependencies for parent in parent_ids }
+        tags = { parent for _, parent_tags in dependencies for parent in parent_tags }
+        seen_ids, seen_tags = set(), set()
+        while task_ids or tags:
+            seen_tags |= tags
+            task_ids |= { task_id for task_id in self.parents if self.tasks[task_id]["tag"] in tags } - seen_ids
+            seen_ids |= task_ids
+            next_ids, next_tags = set(), set()
+            for task_id in task_ids:
+                for parent_task_id, parent_tag in self.parents.get(task_id, ()):
+                    if parent_tag == tag:
+                        raise ValueError(f"depends_on makes a cycle, a parent waits for tag {tag}")
+                    if parent_task_id is not None:
+                        next_ids.add(parent_task_id)
+                    if parent_tag is not None:
+                        next_tags.add(parent_tag)
+            task_ids, tags = next_ids - seen_ids, next_tags - seen_tags
+
+    def __resolve_dependencies(self, finished=(), waiting=()) -> None:
+        """As ExecutorActionDB: release the waiting tasks whose parents all completed OK, fail the ones with a failed parent."""
+        finished, waiting = set(finished), set(waiting)
+        while finished or waiting:
+            for task_id in finished:
+                waiting |= self.task_children.get(task_id, set())
+                row = self.tasks.get(task_id)
+                if row is not None and self.__tag_state(row["tag"]) is not None:
+                    waiting |= self.tag_children.get(row["tag"], set())
+            released, failed = [], {}
+            for task_id in sorted(waiting):
+                if task_id not in self.parents:
+                    continue
+                states = []
+                for parent_task_id, parent_tag in self.parents[task_id]:
+                    if parent_task_id is not None:
+                        parent = self.tasks.get(parent_task_id)
+                        status = parent["status"] if parent is not None else Status.UPSTREAM_FAILED
+                        state = Status.UPSTREAM_FAILED if status in FAILED else status if status == Status.COMPLETED_OK else None
+                        states.append((f"task {parent_task_id}", state))
+                    else:
+                        states.append((f"tag {parent_tag}", self.__tag_state(parent_tag)))
+                upstream = next((parent for parent, state in states if state == Status.UPSTREAM_FAILED), None)
+                if upstream is not None:
+                    failed[task_id] = upstream
+                elif all(state == Status.COMPLETED_OK for _, state in states):
+                    released.append(task_id)
+            now = datetime.datetime.now()
+            for task_id in released:
+                self.__settle(task_id, Status.NEW, now)
+            for task_id, parent in failed.items():
+                self.__settle(task_id, Status.UPSTREAM_FAILED, now)
+                self.__add_log(task_id, { "error": f"{parent} failed", "upstream": parent }, Status.UPSTREAM_FAILED, now, now,
+                               written_at=time.time())
+            if released or failed:
+                self.logger.info(f"Dependencies: {len(released)} tasks released, {len(failed)} failed upstream")
+            finished, waiting = set(failed), set()
+
+    def __settle(self, task_id: int, status: Status, now) -> None:
+        row = self.tasks.get(task_id)
+        if row is not None and row["status"] == Status.WAITING:
+            row["updated_at"] = now
+            self.__place(row, row["tag"], status)
+        self.__drop_edges(task_id)
+
+    def __drop_edges(self, task_id: int) -> None:
+        for parent_task_id, parent_tag in self.parents.pop(task_id, ()):
+            children = self.task_children.get(parent_task_id) if parent_task_id is not None else self.tag_children.get(parent_tag)
+            if children is not None:
+                children.discard(task_id)
+
+    def __tag_state(self, tag) -> Status | None:
+        count = lambda statuses: sum(self.counts.get((tag, status), 0) for status in statuses)
+        if count(FAILED):
+            return Status.UPSTREAM_FAILED
+        if not count(UNFINISHED) and count([Status.COMPLETED_OK]):
+            return Status.COMPLETED_OK
+        return None
+
+    def __take(self, tag, status, limit: int, now: float) -> list:
+        """Pop up to limit (-priority, id) entries of due tasks of tag in status, highest priority first."""
+        if status not in QUEUED:
+            rows = [ row for row in self.tasks.values() if row["tag"] == tag and row["status"] == status
+                     and (row["not_before"] is None or row["not_before"] <= now) ]
+            return sorted((-row["priority"], row["id"]) for row in rows)[:limit]
+        heap = self.queues.get((tag, status), [])
+        taken, deferred, seen = [], [], set()
+        while heap and len(taken) < limit:
+            entry = heapq.heappop(heap)
+            row = self.tasks.get(entry[1])
+            if row is None or row["status"] != status or row["tag"] != tag or entry[1] in seen:
+                continue
+            seen.add(entry[1])
+            if row["not_before"] is not None and row["not_before"] > now:
+                deferred.append(entry)
+            else:
+                taken.append(entry)
+        for entry in deferred:
+            heapq.heappush(heap, entry)
+        return taken
+
+    def __place(self, row: dict, tag, status: Status) -> None:
+        """Move row to tag and status, keeping the counts, the queues and the in progress set in step."""
+        if row["status"] is not None:
+            self.__count(row, -1)
+        row["tag"], row["status"] = tag, status
+        self.__count(row, 1)
+        if status in QUEUED:
+            heapq.heappush(self.queues.setdefault((tag, status), []), (-row["priority"], row["id"]))
+
+    def __count(self, row: dict, delta: int) -> None:
+        key = (row["tag"], row["status"])
+        self.counts[key] = self.counts.get(key, 0) + delta
+        if not self.counts[key]:
+            del self.counts[key]
+        if row["status"] == Status.IN_PROGRESS:
+            if delta > 0:
+                self.in_progress.add(row["id"])
+            else:
+                self.in_progress.discard(row["id"])
+
+    def __add_log(self, task_id: int, message, status: Status, created_at, updated_at, **columns) -> dict:
+        self.last_log_id += 1
+        log = dict({ column: None for column in TASK_LOG_COLUMNS }, id=self.last_log_id, task_id=task_id,
+                   message=self.encode_message(message), status=status, created_at=created_at, updated_at=updated_at, **columns)
+        self.logs[log["id"]] = log
+        self.task_logs.setdefault(task_id, []).append(log)
+        return log
+
+    def __with_logs(self, task: Task) -> Task:
+        task.task_logs = [ self.__task_log(log) for log in self.task_logs.get(task.id, ()) ]
+        return task
+
+    @staticmethod
+    def __task(row: dict) -> Task:
+        return Task(**row)
+
+    @staticmethod
+    def __task_log(log: dict) -> TaskLog:
+        return TaskLog(**log)
+
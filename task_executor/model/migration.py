@@ -0,0 +1,243 @@
+"""
+Versioned schema migrations for the task executor SQLite database.
+
+The schema version is kept in the SQLite header (PRAGMA user_version). A database built
+by create_db is stamped with SCHEMA_VERSION, older files are upgraded in place by
+applying every pending migration in order:
+
+$ python -m task_executor.shell_executor migrate_executor_db
+
+A migration step is either a SQL statement or a callable receiving the connection.
+Steps must be safe to re-run, so an interrupted upgrade can simply be started again.
+"""
+
+import ast
+import json
+import logging
+from typing import Callable, Dict, List, Tuple, Union
+from sqlalchemy import Connection, Engine, text
+
+logger = logging.getLogger(__name__)
+
+Step = Union[str, Callable[[Connection], None]]
+
+
+def column_names(connection: Connection, table: str) -> List[str]:
+    return [ row[1] for row in connection.exec_driver_sql(f"PRAGMA table_info({table})") ]
+
+def add_column(table: str, column: str, ddl: str) -> Callable[[Connection], None]:
+    """Return a step adding column to table unless it already exists."""
+    def step(connection: Connection) -> None:
+        if column not in column_names(connection, table):
+            connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+    return step
+
+
+def column_types(connection: Connection, table: str) -> Dict[str, str]:
+    return { row[1]: row[2] for row in connection.exec_driver_sql(f"PRAGMA table_info({table})") }
+
+def rebuild_table(table: str, create_sql: str, conversions: Dict[str, str], done: Callable[[Dict[str, str]], bool]) -> Callable[[Connection], None]:
+    """
+    Return a step copying table into a new table created by create_sql (with {name} as table name),
+    converting columns with the SQL expressions of conversions, unless done(column types) is true.
+    SQLite cannot change the type of a column in place. Indexes must be created again afterwards.
+    """
+    def step(connection: Connection) -> None:
+        if done(column_types(connection, table)):
+            return
+        rebuilt = f"{table}_rebuild"
+        connection.exec_driver_sql(f"DROP TABLE IF EXISTS {rebuilt}")
+        connection.exec_driver_sql(create_sql.format(name=rebuilt))
+        old_columns = column_names(connection, table)
+        columns = [ column for column in column_names(connection, rebuilt) if column in old_columns ]
+        connection.exec_driver_sql(
+            f"INSERT INTO {rebuilt} ({', '.join(columns)}) "
+            f"SELECT {', '.join(conversions.get(column, column) for column in columns)} FROM {table}")
+        connection.exec_driver_sql(f"DROP TABLE {table}")
+        connection.exec_driver_sql(f"ALTER TABLE {rebuilt} RENAME TO {table}")
+    return step
+
+def repr_to_json(table: str, column: str, batch_size: int = 1000) -> Callable[[Connection], None]:
+    """
+    Return a step rewriting the Python repr strings (str(dict) of older releases) of column as JSON.
+    Values which already are JSON, or are no Python literal, are left as they are.
+    """
+    def step(connection: Connection) -> None:
+        last_id, rewritten = 0, 0
+        while True:
+            rows = connection.exec_driver_sql(
+                f"SELECT id, {column} FROM {table} WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            updates = []
+            for id, value in rows:
+                if not isinstance(value, str):
+                    continue
+                try:
+                    json.loads(value)
+                    continue
+                except ValueError:
+                    pass
+                try:
+                    updates.append((json.dumps(ast.literal_eval(value)), id))
+                except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+                    pass
+            if updates:
+                connection.exec_driver_sql(f"UPDATE {table} SET {column} = ? WHERE id = ?", updates)
+                rewritten += len(updates)
+        if rewritten:
+            logger.info(f"{table}.{column}: {rewritten} Python repr values rewritten as JSON")
+    return step
+
+def enable_incremental_vacuum(connection: Connection) -> None:
+    """
+    Switch the database to auto_vacuum = INCREMENTAL, so that the pages freed by deletes can be given back
+    to the file system a few at a time (PRAGMA incremental_vacuum). An existing database is rewritten once by VACUUM.
+
+    Not a migration step: VACUUM copies the whole file under an exclusive lock, it is an explicit offline step
+    run with every worker stopped, see migrate_executor_db --vacuum.
+    """
+    if connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+        connection.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        connection.exec_driver_sql("VACUUM")
+
+# Status names of the Enum column to the codes of orm.STATUS_CODES
+STATUS_TO_CODE = """CASE status WHEN 'NEW' THEN 0 WHEN 'IN_PROGRESS' THEN 1 WHEN 'COMPLETED_ERROR' THEN 2
+    WHEN 'COMPLETED_OK' THEN 3 WHEN 'RE_PROCESS' THEN 4 WHEN 'TIMED_OUT' THEN 5 ELSE status END"""
+
+def text_to_epoch_millis(column: str) -> str:
+    """SQL converting the local time text written by str(datetime.now()) to epoch milliseconds."""
+    return (f"CASE WHEN typeof({column}) = 'text' "
+            f"THEN CAST(ROUND((julianday({column}, 'utc') - 2440587.5) * 86400000) AS INTEGER) ELSE {column} END")
+
+COMPACT_CONVERSIONS = { "status": STATUS_TO_CODE, "created_at": text_to_epoch_millis("created_at"),
+                        "updated_at": text_to_epoch_millis("updated_at") }
+compacted = lambda types: types.get("status") == "INTEGER"
+
+COMPACT_TASKS = """CREATE TABLE {name} (
+    id INTEGER NOT NULL, tag VARCHAR NOT NULL, content VARCHAR NOT NULL, status INTEGER NOT NULL,
+    created_at INTEGER NOT NULL, updated_at INTEGER NOT NULL, worker_id VARCHAR, lease_expires_at FLOAT,
+    attempts INTEGER DEFAULT '0' NOT NULL, not_before FLOAT, priority INTEGER DEFAULT '0' NOT NULL,
+    claimed_at FLOAT, PRIMARY KEY (id))"""
+
+COMPACT_TASK_LOGS = """CREATE TABLE {name} (
+    id INTEGER NOT NULL, message VARCHAR NOT NULL, status INTEGER NOT NULL, created_at INTEGER NOT NULL,
+    updated_at INTEGER NOT NULL, task_id INTEGER, return_code INTEGER, stdout_bytes INTEGER, stderr_bytes INTEGER,
+    duration FLOAT, stdout_path VARCHAR, stderr_path VARCHAR, worker_id VARCHAR, hostname VARCHAR,
+    queued_at FLOAT, claimed_at FLOAT, started_at FLOAT, finished_at FLOAT, written_at FLOAT, queue_wait FLOAT,
+    claim_duration FLOAT, pickup_wait FLOAT, spawn_duration FLOAT, exec_duration FLOAT, write_wait FLOAT,
+    PRIMARY KEY (id), FOREIGN KEY(task_id) REFERENCES tasks (id))"""
+
+
+MIGRATIONS: List[Tuple[int, str, List[Step]]] = [
+    (1, "indexes for batch claims and task log lookups", [
+        "CREATE INDEX IF NOT EXISTS ix_tasks_tag_status_id ON tasks (tag, status, id)",
+        "CREATE INDEX IF NOT EXISTS ix_task_logs_task_id ON task_logs (task_id)",
+    ]),
+    (2, "return code, output sizes, duration and spill files of task logs", [
+        add_column("task_logs", "return_code", "INTEGER"),
+        add_column("task_logs", "stdout_bytes", "INTEGER"),
+        add_column("task_logs", "stderr_bytes", "INTEGER"),
+        add_column("task_logs", "duration", "FLOAT"),
+        add_column("task_logs", "stdout_path", "VARCHAR"),
+        add_column("task_logs", "stderr_path", "VARCHAR"),
+    ]),
+    (3, "worker registry and task leases", [
+        add_column("tasks", "worker_id", "VARCHAR"),
+        add_column("tasks", "lease_expires_at", "FLOAT"),
+        "CREATE INDEX IF NOT EXISTS ix_tasks_status_lease_expires_at ON tasks (status, lease_expires_at)",
+        """CREATE TABLE IF NOT EXISTS workers (
+            id VARCHAR NOT NULL, hostname VARCHAR NOT NULL, pid INTEGER NOT NULL, status VARCHAR NOT NULL,
+            started_at VARCHAR NOT NULL, heartbeat_at FLOAT NOT NULL, PRIMARY KEY (id))""",
+    ]),
+    (4, "per tag settings", [
+        "CREATE TABLE IF NOT EXISTS tag_settings (tag VARCHAR NOT NULL, timeout FLOAT, PRIMARY KEY (tag))",
+    ]),
+    (5, "attempt counter and retry time of tasks", [
+        add_column("tasks", "attempts", "INTEGER NOT NULL DEFAULT 0"),
+        add_column("tasks", "not_before", "FLOAT"),
+    ]),
+    (6, "task priorities, tag weights and concurrency caps", [
+        add_column("tasks", "priority", "INTEGER NOT NULL DEFAULT 0"),
+        "CREATE INDEX IF NOT EXISTS ix_tasks_tag_status_priority_id ON tasks (tag, status, priority DESC, id)",
+        "DROP INDEX IF EXISTS ix_tasks_tag_status_id",
+        add_column("tag_settings", "weight", "FLOAT"),
+        add_column("tag_settings", "max_concurrency", "INTEGER"),
+    ]),
+    (7, "result cache", [
+        """CREATE TABLE IF NOT EXISTS result_cache (
+            key VARCHAR NOT NULL, task_id INTEGER NOT NULL, message VARCHAR NOT NULL, return_code INTEGER,
+            stdout_bytes INTEGER, stderr_bytes INTEGER, stdout_path VARCHAR, stderr_path VARCHAR, duration FLOAT,
+            size INTEGER NOT NULL, created_at FLOAT NOT NULL, last_used_at FLOAT NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (key))""",
+        "CREATE INDEX IF NOT EXISTS ix_result_cache_last_used_at ON result_cache (last_used_at)",
+    ]),
+    (8, "phase timings of task runs", [
+        add_column("tasks", "claimed_at", "FLOAT"),
+        add_column("task_logs", "worker_id", "VARCHAR"),
+        add_column("task_logs", "hostname", "VARCHAR"),
+        add_column("task_logs", "queued_at", "FLOAT"),
+        add_column("task_logs", "claimed_at", "FLOAT"),
+        add_column("task_logs", "started_at", "FLOAT"),
+        add_column("task_logs", "finished_at", "FLOAT"),
+        add_column("task_logs", "written_at", "FLOAT"),
+        add_column("task_logs", "queue_wait", "FLOAT"),
+        add_column("task_logs", "claim_duration", "FLOAT"),
+        add_column("task_logs", "pickup_wait", "FLOAT"),
+        add_column("task_logs", "spawn_duration", "FLOAT"),
+        add_column("task_logs", "exec_duration", "FLOAT"),
+        add_column("task_logs", "write_wait", "FLOAT"),
+    ]),
+    (9, "compact rows: integer status codes and epoch millisecond timestamps", [
+        rebuild_table("tasks", COMPACT_TASKS, COMPACT_CONVERSIONS, compacted),
+        rebuild_table("task_logs", COMPACT_TASK_LOGS, COMPACT_CONVERSIONS, compacted),
+        repr_to_json("task_logs", "message"),
+        "CREATE INDEX IF NOT EXISTS ix_tasks_tag_status_priority_id ON tasks (tag, status, priority DESC, id)",
+        "CREATE INDEX IF NOT EXISTS ix_tasks_status_lease_expires_at ON tasks (status, lease_expires_at)",
+        "CREATE INDEX IF NOT EXISTS ix_task_logs_task_id ON task_logs (task_id)",
+    ]),
+    (10, "index task logs by commit time for throughput", [
+        "CREATE INDEX IF NOT EXISTS ix_task_logs_written_at ON task_logs (written_at)",
+    ]),
+    (11, "tag rate limit", [
+        add_column("tag_settings", "rate", "FLOAT"),
+    ]),
+    (12, "task dependencies", [
+        """CREATE TABLE IF NOT EXISTS task_dependencies (
+            id INTEGER NOT NULL, task_id INTEGER NOT NULL, parent_task_id INTEGER, parent_tag VARCHAR,
+            PRIMARY KEY (id), FOREIGN KEY(task_id) REFERENCES tasks (id))""",
+        "CREATE INDEX IF NOT EXISTS ix_task_dependencies_task_id ON task_dependencies (task_id)",
+        "CREATE INDEX IF NOT EXISTS ix_task_dependencies_parent_task_id ON task_dependencies (parent_task_id)",
+        "CREATE INDEX IF NOT EXISTS ix_task_dependencies_parent_tag ON task_dependencies (parent_tag)",
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(engine: Engine) -> int:
+    with engine.connect() as connection:
+        return connection.exec_driver_sql("PRAGMA user_version").scalar()
+
+def stamp(engine: Engine, version: int = SCHEMA_VERSION) -> None:
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+def migrate(engine: Engine) -> List[int]:
+    """Apply every migration newer than the database schema version and return their versions."""
+    applied = []
+    current = get_schema_version(engine)
+    for version, description, steps in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info(f"Applying migration {version}: {description}")
+        with engine.begin() as connection:
+            for step in steps:
+                if callable(step):
+                    step(connection)
+                else:
+                    connection.execute(text(step))
+            connection.exec_driver_sql(f"PRAGMA user_version = {version}")
+        applied.append(version)
+    return applied
@@ -1,11 +1,13 @@
+import datetime
 import enum
 from typing import List
 from typing import Optional
-from sqlalchemy import JSON, ForeignKey, Enum
+from sqlalchemy import ForeignKey, Index
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import mapped_column
 from sqlalchemy.orm import relationship
+from .codec import EpochMillis, Packed, StatusCode
 
 
 class Status(enum.Enum):
@@ -14,6 +16,21 @@ class Status(enum.Enum):
     COMPLETED_ERROR = 'completed-error'
     COMPLETED_OK = 'completed-ok'
     RE_PROCESS = 're-process'
+    TIMED_OUT = 'timed-out'
+    WAITING = 'waiting'
+    UPSTREAM_FAILED = 'upstream-failed'
+
+# Stored codes, never reuse or renumber one
+STATUS_CODES = {
+    Status.NEW: 0,
+    Status.IN_PROGRESS: 1,
+    Status.COMPLETED_ERROR: 2,
+    Status.COMPLETED_OK: 3,
+    Status.RE_PROCESS: 4,
+    Status.TIMED_OUT: 5,
+    Status.WAITING: 6,
+    Status.UPSTREAM_FAILED: 7,
+}
 
 class Base(DeclarativeBase):
     pass
@@ -22,27 +39,136 @@ class Task(Base):
     __tablename__ = "tasks"
     id: Mapped[int] = mapped_column(primary_key=True)
     tag: Mapped[str]
-    content:  Mapped[str] = mapped_column(JSON)
-    status: Mapped[str] = mapped_column(Enum(Status))
-    created_at: Mapped[str]
-    updated_at: Mapped[str]
+    content:  Mapped[dict] = mapped_column(Packed())
+    status: Mapped[Status] = mapped_column(StatusCode(Status, STATUS_CODES))
+    created_at: Mapped[datetime.datetime] = mapped_column(EpochMillis)
+    updated_at: Mapped[datetime.datetime] = mapped_column(EpochMillis)
+    worker_id: Mapped[Optional[str]]
+    lease_expires_at: Mapped[Optional[float]]
+    attempts: Mapped[int] = mapped_column(default=0, server_default="0")
+    not_before: Mapped[Optional[float]]
+    priority: Mapped[int] = mapped_column(default=0, server_default="0")
+    claimed_at: Mapped[Optional[float]]
     task_logs: Mapped[List["TaskLog"]] = relationship(back_populates="task")
 
+    __table_args__ = (
+        Index("ix_tasks_status_lease_expires_at", "status", "lease_expires_at"),
+    )
+
     def __repr__(self) -> str:
         return f"""Task(id={self.id!r}, tag={self.tag!r}, content={self.content!r},
-                   status={self.status!r}, created_at={self.created_at!r}, updated_at={self.updated_at!r},
-                   task_logs={self.task_logs!r}"""
+                   status={self.status!r}, created_at={self.created_at!r}, updated_at={self.updated_at!r}"""
+
+# Claims read the highest priority, then oldest, tasks of a tag and status straight from this index
+Index("ix_tasks_tag_status_priority_id", Task.tag, Task.status, Task.priority.desc(), Task.id)
 
 class TaskLog(Base):
     __tablename__ = "task_logs"
     id: Mapped[int] = mapped_column(primary_key=True)
-    message:  Mapped[str]
-    status: Mapped[str] = mapped_column(Enum(Status))
-    created_at: Mapped[str]
-    updated_at: Mapped[str]
+    message:  Mapped[str] = mapped_column(Packed(text=True))
+    status: Mapped[Status] = mapped_column(StatusCode(Status, STATUS_CODES))
+    created_at: Mapped[datetime.datetime] = mapped_column(EpochMillis)
+    updated_at: Mapped[datetime.datetime] = mapped_column(EpochMillis)
     task_id: Mapped[Optional[int]] = mapped_column(ForeignKey("tasks.id"))
+    return_code: Mapped[Optional[int]]
+    stdout_bytes: Mapped[Optional[int]]
+    stderr_bytes: Mapped[Optional[int]]
+    duration: Mapped[Optional[float]]
+    stdout_path: Mapped[Optional[str]]
+    stderr_path: Mapped[Optional[str]]
+    # Where and when each phase of the run happened, epoch seconds
+    worker_id: Mapped[Optional[str]]
+    hostname: Mapped[Optional[str]]
+    queued_at: Mapped[Optional[float]]
+    claimed_at: Mapped[Optional[float]]
+    started_at: Mapped[Optional[float]]
+    finished_at: Mapped[Optional[float]]
+    written_at: Mapped[Optional[float]]
+    # Phase durations in seconds: queued -> claimed -> picked up by a worker -> spawned -> finished -> committed
+    queue_wait: Mapped[Optional[float]]
+    claim_duration: Mapped[Optional[float]]
+    pickup_wait: Mapped[Optional[float]]
+    spawn_duration: Mapped[Optional[float]]
+    exec_duration: Mapped[Optional[float]]
+    write_wait: Mapped[Optional[float]]
     task: Mapped["Task"] = relationship(back_populates="task_logs")
 
+    __table_args__ = (
+        Index("ix_task_logs_task_id", "task_id"),
+        Index("ix_task_logs_written_at", "written_at"),
+    )
+
     def __repr__(self) -> str:
         return f"""TaskLog(id={self.id!r}, message={self.message!r}, status={self.status!r},
-                   created_at={self.created_at!r}, updated_at={self.updated_at!r}"""
\ No newline at end of file
+                   created_at={self.created_at!r}, updated_at={self.updated_at!r}, return_code={self.return_code!r},
+                   duration={self.duration!r}"""
+
+# An edge of the task graph: task_id waits for a parent task, or for every task of a parent tag
+class TaskDependency(Base):
+    __tablename__ = "task_dependencies"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    task_id: Mapped[int] = mapped_column(ForeignKey("tasks.id"))
+    # Exactly one of them is set
+    parent_task_id: Mapped[Optional[int]]
+    parent_tag: Mapped[Optional[str]]
+
+    __table_args__ = (
+        Index("ix_task_dependencies_task_id", "task_id"),
+        Index("ix_task_dependencies_parent_task_id", "parent_task_id"),
+        Index("ix_task_dependencies_parent_tag", "parent_tag"),
+    )
+
+    def __repr__(self) -> str:
+        return f"""TaskDependency(id={self.id!r}, task_id={self.task_id!r}, parent_task_id={self.parent_task_id!r},
+                   parent_tag={self.parent_tag!r}"""
+
+class Worker(Base):
+    __tablename__ = "workers"
+    id: Mapped[str] = mapped_column(primary_key=True)
+    hostname: Mapped[str]
+    pid: Mapped[int]
+    status: Mapped[str]
+    started_at: Mapped[str]
+    heartbeat_at: Mapped[float]
+
+    def __repr__(self) -> str:
+        return f"""Worker(id={self.id!r}, hostname={self.hostname!r}, pid={self.pid!r}, status={self.status!r},
+                   started_at={self.started_at!r}, heartbeat_at={self.heartbeat_at!r}"""
+
+
+class TagSetting(Base):
+    __tablename__ = "tag_settings"
+    tag: Mapped[str] = mapped_column(primary_key=True)
+    timeout: Mapped[Optional[float]]
+    weight: Mapped[Optional[float]]
+    max_concurrency: Mapped[Optional[int]]
+    rate: Mapped[Optional[float]]
+
+    def __repr__(self) -> str:
+        return f"""TagSetting(tag={self.tag!r}, timeout={self.timeout!r}, weight={self.weight!r},
+                   max_concurrency={self.max_concurrency!r}, rate={self.rate!r}"""
+
+
+class CachedResult(Base):
+    __tablename__ = "result_cache"
+    key: Mapped[str] = mapped_column(primary_key=True)
+    task_id: Mapped[int]
+    message: Mapped[str] = mapped_column(Packed(text=True))
+    return_code: Mapped[Optional[int]]
+    stdout_bytes: Mapped[Optional[int]]
+    stderr_bytes: Mapped[Optional[int]]
+    stdout_path: Mapped[Optional[str]]
+    stderr_path: Mapped[Optional[str]]
+    duration: Mapped[Optional[float]]
+    size: Mapped[int]
+    created_at: Mapped[float]
+    last_used_at: Mapped[float]
+    hits: Mapped[int] = mapped_column(default=0, server_default="0")
+
+    __table_args__ = (
+        Index("ix_result_cache_last_used_at", "last_used_at"),
+    )
+
+    def __repr__(self) -> str:
+        return f"""CachedResult(key={self.key!r}, task_id={self.task_id!r}, return_code={self.return_code!r},
+                   size={self.size!r}, created_at={self.created_at!r}, hits={self.hits!r}"""
@@ -0,0 +1,304 @@
+"""
+Sharded SQLite storage backend: the tags are spread over several SQLite files.
+
+Every file has its own write lock, so writers of tags in different shards never wait for each
+other. The first shard is db_file_full_path, it also keeps the workers, tag settings and cached
+results, the others sit next to it: ./task_executor.sqlite, ./task_executor.shard1.sqlite, ...
+
+from task_executor.executor import Executor
+executor = Executor(db_file_full_path='./task_executor.sqlite', backend="sharded", shards=4)
+"""
+
+from __future__ import annotations
+import copy
+import datetime
+import heapq
+import logging
+import os
+import zlib
+from typing import Callable, Dict, Iterator, List
+from sqlalchemy import inspect
+from ..exceptions import TaskError
+from .backend import FINISHED, StorageBackend
+from .executor_action_db import ExecutorActionDB
+from .orm import STATUS_CODES, CachedResult, Status, TagSetting, Task, TaskLog, Worker
+from .storage_profile import StorageProfile
+
+TASK_COLUMNS = [ column.key for column in Task.__table__.columns ]
+TASK_LOG_COLUMNS = [ column.key for column in TaskLog.__table__.columns ]
+
+
+def shard_file(db_file_full_path: str, index: int) -> str:
+    """File of shard index: db_file_full_path itself for the first one."""
+    if index == 0:
+        return db_file_full_path
+    root, ext = os.path.splitext(db_file_full_path)
+    return f"{root}.shard{index}{ext}"
+
+
+def tag_shard(tag, shards: int) -> int:
+    """Default placement of a tag, stable across processes and runs."""
+    return zlib.crc32(str(tag).encode()) % shards
+
+
+class Shard(ExecutorActionDB):
+    """One file of a ShardedBackend, taking and naming the task ids of the whole backend."""
+
+    def __init__(self, index: int, shards: int, shard_of: Callable, db_file_full_path: str, **kwargs):
+        super().__init__(db_file_full_path, **kwargs)
+        self.index = index
+        self.shards = shards
+        self.shard_of = shard_of
+
+    def task_dependencies(self, content) -> tuple:
+        """Dependencies of a content with the ids of this file, only tasks and tags of this shard can be parents."""
+        parent_ids, parent_tags = super().task_dependencies(content)
+        for parent in parent_ids:
+            if parent % self.shards != self.index:
+                raise ValueError(f"depends_on task {parent} of another shard")
+        for parent in parent_tags:
+            if self.shard_of(parent) != self.index:
+                raise ValueError(f"depends_on tag {parent} of another shard")
+        return [ parent // self.shards for parent in parent_ids ], parent_tags
+
+    def upstream_task(self, task_id: int) -> str:
+        return f"task {task_id * self.shards + self.index}"
+
+
+class ShardedBackend(StorageBackend):
+    """
+    Tags spread over shards SQLite files, every tag lives in exactly one of them.
+
+    shards -- number of files, fixed for the life of the database: changing it moves tags to other files
+    shard_of -- tag -> shard index, a CRC32 of the tag by default; put the tags of a dependency
+                pipeline in one shard, depends_on only takes tasks and tags of the shard of the task
+
+    Task ids are interleaved: the task local_id of shard i has the id local_id * shards + i, so an id
+    tells its shard and the ids of a shard keep their order. Claims, completions and counts of a tag
+    go to its shard only, listings of every tag merge the shards.
+    """
+
+    def __init__(self, db_file_full_path: str, shards: int = 4, echo=True, storage_profile: StorageProfile | str = None,
+                 codec: str = None, shard_of: Callable = None):
+        if int(shards) < 1:
+            raise ValueError(f"a sharded backend needs at least one shard: {shards}")
+        self.db_file_full_path = db_file_full_path
+        self.shard_count = int(shards)
+        self.shard_of = shard_of or (lambda tag: tag_shard(tag, self.shard_count))
+        self.shards = [ Shard(index, self.shard_count, self.shard_of, shard_file(db_file_full_path, index),
+                              echo=echo, storage_profile=storage_profile, codec=codec)
+                        for index in range(self.shard_count) ]
+        self.logger = logging.getLogger(__class__.__name__)
+
+    @property
+    def main(self) -> Shard:
+        """Shard of the workers, tag settings and cached results."""
+        return self.shards[0]
+
+    def shard(self, tag) -> Shard:
+        return self.shards[self.shard_of(tag)]
+
+    def create_db(self) -> None:
+        for shard in self.shards:
+            shard.create_db()
+
+    def migrate_db(self, vacuum: bool = False) -> List[int]:
+        applied = set()
+        for shard in self.shards:
+            applied.update(shard.migrate_db(vacuum=vacuum))
+        return sorted(applied)
+
+    def schema_version(self) -> int:
+        return min(shard.schema_version() for shard in self.shards)
+
+    def add_task(self, tag, content) -> int:
+        shard = self.shard(tag)
+        return self.__global_id(shard.add_task(tag, content), shard)
+
+    def insert_tasks(self, tag, contents: List[dict]) -> int:
+        return self.shard(tag).insert_tasks(tag, contents)
+
+    def update_task(self, task: Task, **kwargs) -> None:
+        shard, local_id = self.__locate(task.id)
+        if kwargs.get("tag") and self.shard(kwargs.get("tag")) is not shard:
+            error = ValueError(f"cannot move task {task.id} to tag {kwargs.get('tag')} of another shard")
+            self.logger.error(error)
+            raise TaskError(error)
+        shard.update_task(Task(id=local_id), **kwargs)
+
+    def remove_task(self, task: Task) -> None:
+        shard, local_id = self.__locate(task.id)
+        shard.remove_task(Task(id=local_id))
+
+    def get_expired_tasks(self, updated_before: datetime.datetime, statuses=FINISHED, tag=None, limit: int = 1000) -> List[Task]:
+        """The expired tasks of the first shards having some, by id within each shard."""
+        shards = [ self.shard(tag) ] if tag is not None else self.shards
+        tasks = []
+        for shard in shards:
+            if len(tasks) >= int(limit):
+                break
+            for task in shard.get_expired_tasks(updated_before, statuses=statuses, tag=tag, limit=int(limit) - len(tasks)):
+                task.id = self.__global_id(task.id, shard)
+                for log in task.logs:
+                    log.id, log.task_id = self.__global_id(log.id, shard), task.id
+                tasks.append(task)
+        return tasks
+
+    def delete_tasks(self, task_ids) -> int:
+        per_shard: Dict[int, list] = {}
+        for task_id in task_ids:
+            shard, local_id = self.__locate(task_id)
+            per_shard.setdefault(shard.index, []).append(local_id)
+        return sum(self.shards[index].delete_tasks(local_ids) for index, local_ids in per_shard.items())
+
+    def compact(self, pages: int = 1000) -> int:
+        return sum(shard.compact(pages) for shard in self.shards)
+
+    def add_task_log(self, task, status, message, created_at, updated_at):
+        shard, local_id = self.__locate(task.id)
+        task_log = shard.add_task_log(Task(id=local_id), status, message, created_at, updated_at)
+        task_log.task_id = task.id
+        return task_log
+
+    def complete_tasks(self, completions) -> None:
+        per_shard: Dict[int, list] = {}
+        for c in completions:
+            shard, local_id = self.__locate(c.task_id)
+            local = copy.copy(c)
+            local.task_id = local_id
+            per_shard.setdefault(shard.index, []).append(local)
+        for index, local in per_shard.items():
+            self.shards[index].complete_tasks(local)
+
+    def claim_tasks(self, tag, status, batch_size: int = 1, worker_id: str = None, lease_seconds: float = None) -> List[Task]:
+        shard = self.shard(tag)
+        tasks = shard.claim_tasks(tag, status, batch_size=batch_size, worker_id=worker_id, lease_seconds=lease_seconds)
+        for task in tasks:
+            task.id = self.__global_id(task.id, shard)
+        return tasks
+
+    def count_tasks_by_tag(self, status) -> Dict[str, int]:
+        result: Dict[str, int] = {}
+        for shard in self.shards:
+            for tag, count in shard.count_tasks_by_tag(status).items():
+                result[tag] = result.get(tag, 0) + count
+        return result
+
+    def count_tasks_by_tag_and_status(self, tag=None) -> List[tuple]:
+        shards = [ self.shard(tag) ] if tag is not None else self.shards
+        counts = [ tuple(row) for shard in shards for row in shard.count_tasks_by_tag_and_status(tag=tag) ]
+        return sorted(counts, key=lambda row: (row[0], STATUS_CODES[row[1]]))
+
+    def count_completions_by_tag(self, windows: List[float], tag=None) -> Dict[str, List[int]]:
+        shards = [ self.shard(tag) ] if tag is not None else self.shards
+        result: Dict[str, List[int]] = {}
+        for shard in shards:
+            result.update(shard.count_completions_by_tag(windows, tag=tag))
+        return result
+
+    def get_task_phases(self, tag=None) -> List[dict]:
+        shards = [ self.shard(tag) ] if tag is not None else self.shards
+        phases = []
+        for shard in shards:
+            for phase in shard.get_task_phases(tag=tag):
+                phases.append(dict(phase, task_id=self.__global_id(phase["task_id"], shard),
+                                   log_id=self.__global_id(phase["log_id"], shard)))
+        return sorted(phases, key=lambda phase: phase["log_id"])
+
+    def iter_tasks(self, tag=None, status=None, batch_size: int = 1000) -> Iterator[Task]:
+        """The tasks by id, the shards are read page by page side by side when tag is None."""
+        shards = [ self.shard(tag) ] if tag is not None else self.shards
+        streams = [ self.__iter_shard(shard, tag, status, batch_size) for shard in shards ]
+        return heapq.merge(*streams, key=lambda task: task.id)
+
+    def get_claimable_tags(self, status) -> List[str]:
+        return sorted({ tag for shard in self.shards for tag in shard.get_claimable_tags(status) })
+
+    def next_retry_at(self, tag) -> float | None:
+        return self.shard(tag).next_retry_at(tag)
+
+    def count_pending_parents(self, tags=None) -> int:
+        # A task and its parents share a shard
+        shards = self.shards if tags is None else { self.shard(tag).index: self.shard(tag) for tag in tags }.values()
+        return sum(shard.count_pending_parents(tags) for shard in shards)
+
+    def register_worker(self, worker_id: str, hostname: str, pid: int) -> None:
+        self.main.register_worker(worker_id, hostname, pid)
+
+    def deregister_worker(self, worker_id: str) -> None:
+        self.main.deregister_worker(worker_id)
+
+    def renew_leases(self, worker_id: str, lease_seconds: float) -> int:
+        return sum(shard.renew_leases(worker_id, lease_seconds) for shard in self.shards)
+
+    def reclaim_expired_leases(self, status: Status = Status.RE_PROCESS, worker_timeout: float = None) -> int:
+        return sum(shard.reclaim_expired_leases(status, worker_timeout if shard is self.main else None)
+                   for shard in self.shards)
+
+    def get_workers(self) -> List[Worker]:
+        return self.main.get_workers()
+
+    def get_tag_setting(self, tag) -> TagSetting:
+        return self.main.get_tag_setting(tag)
+
+    def get_tag_settings(self) -> List[TagSetting]:
+        return self.main.get_tag_settings()
+
+    def set_tag_setting(self, tag, **kwargs) -> TagSetting:
+        return self.main.set_tag_setting(tag, **kwargs)
+
+    def get_cached_result(self, key: str, min_created_at: float = None) -> CachedResult:
+        return self.main.get_cached_result(key, min_created_at=min_created_at)
+
+    def put_cached_result(self, key: str, task_id: int, message, **kwargs) -> None:
+        self.main.put_cached_result(key, task_id, message, **kwargs)
+
+    def record_cache_hits(self, hits: Dict[str, int]) -> None:
+        self.main.record_cache_hits(hits)
+
+    def evict_cached_results(self, max_age: float = None, max_bytes: int = None) -> int:
+        return self.main.evict_cached_results(max_age=max_age, max_bytes=max_bytes)
+
+    def cache_summary(self) -> Dict[str, int]:
+        return self.main.cache_summary()
+
+    def get_task(self, **kwargs) -> Task | List[Task]:
+        """As ExecutorActionDB.get_task, only a task read by id comes with its task_logs."""
+        if kwargs.get("id"):
+            shard, local_id = self.__locate(kwargs.get("id"))
+            task = shard.get_task(id=local_id)
+            return self.__copy(task, shard, task.task_logs) if task is not None else None
+        if kwargs.get("tag"):
+            shard = self.shard(kwargs.get("tag"))
+            return [ self.__copy(task, shard) for task in shard.get_task(**kwargs) ]
+        return self.main.get_task(**kwargs)
+
+    def __iter_shard(self, shard: Shard, tag, status, batch_size: int) -> Iterator[Task]:
+        for task in shard.iter_tasks(tag=tag, status=status, batch_size=batch_size):
+            task.id = self.__global_id(task.id, shard)
+            if task.latest_log is not None:
+                task.latest_log.task_id = task.id
+                task.latest_log.id = self.__global_id(task.latest_log.id, shard)
+            yield task
+
+    def __copy(self, task: Task, shard: Shard, task_logs=None) -> Task:
+        """A transient copy with the ids of the backend, get_task leaves its tasks in an open session."""
+        values = inspect(task).dict
+        copied = Task(**dict({ column: values.get(column) for column in TASK_COLUMNS },
+                             id=self.__global_id(task.id, shard)))
+        for task_log in task_logs or ():
+            values = inspect(task_log).dict
+            copied.task_logs.append(TaskLog(**dict({ column: values.get(column) for column in TASK_LOG_COLUMNS },
+                                                   id=self.__global_id(task_log.id, shard), task_id=copied.id)))
+        return copied
+
+    def __locate(self, task_id: int) -> tuple:
+        """(shard, id in its file) of a task id of the backend."""
+        try:
+            return self.shards[int(task_id) % self.shard_count], int(task_id) // self.shard_count
+        except (TypeError, ValueError) as e:
+            self.logger.error(e)
+            raise TaskError(e)
+
+    def __global_id(self, local_id: int, shard: Shard) -> int:
+        return local_id * self.shard_count + shard.index
@@ -0,0 +1,94 @@
+import gzip
+import os
+from typing import Optional
+
+
+class OutputPolicy:
+    """
+    How much of a command's stdout and stderr is kept.
+
+    max_bytes -- bytes kept per stream in the task log, when a stream is longer its first
+                 and last max_bytes / 2 bytes are kept around a truncation marker
+    spill_dir -- when set, a stream longer than max_bytes is also written in full to a
+                 gzip file in this directory, referenced from the task log row
+    """
+
+    def __init__(self, max_bytes: int = 1048576, spill_dir: Optional[str] = None):
+        self.max_bytes = int(max_bytes)
+        self.spill_dir = spill_dir
+
+    def capture(self, task_id, stream_name: str) -> "StreamCapture":
+        spill_path = None
+        if self.spill_dir:
+            spill_path = os.path.join(self.spill_dir, f"task-{task_id}.{stream_name}.gz")
+        return StreamCapture(self.max_bytes, spill_path)
+
+    def __repr__(self) -> str:
+        return f"OutputPolicy(max_bytes={self.max_bytes!r}, spill_dir={self.spill_dir!r})"
+
+
+class StreamCapture:
+    """
+    Bounded buffer for one output stream, fed with chunks of bytes as they are read.
+
+    Memory use is at most max_bytes whatever the output size. Once the stream is longer
+    than max_bytes and a spill_path is set, everything is streamed to a gzip file.
+    """
+
+    def __init__(self, max_bytes: int, spill_path: Optional[str] = None):
+        self.head_size = max_bytes - max_bytes // 2
+        self.tail_size = max_bytes // 2
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total_bytes = 0
+        self.spill_path = spill_path
+        self.spill_file = None
+
+    @property
+    def truncated(self) -> bool:
+        return self.total_bytes > self.head_size + self.tail_size
+
+    def feed(self, chunk: bytes) -> None:
+        if not chunk:
+            return
+        self.total_bytes += len(chunk)
+
+        if self.spill_file is not None:
+            self.spill_file.write(chunk)
+        elif self.spill_path and self.truncated:
+            # First overflow: nothing was dropped yet, so the file starts complete
+            os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+            self.spill_file = gzip.open(self.spill_path, "wb")
+            self.spill_file.write(bytes(self.head))
+            self.spill_file.write(bytes(self.tail))
+            self.spill_file.write(chunk)
+
+        room = self.head_size - len(self.head)
+        if room > 0:
+            self.head += chunk[:room]
+            chunk = chunk[room:]
+        if chunk and self.tail_size > 0:
+            self.tail += chunk
+            if len(self.tail) > self.tail_size:
+                del self.tail[:len(self.tail) - self.tail_size]
+
+    def close(self) -> None:
+        if self.spill_file is not None:
+            self.spill_file.close()
+
+    @property
+    def spilled_to(self) -> Optional[str]:
+        return self.spill_path if self.spill_file is not None else None
+
+    def text(self) -> str:
+        """Captured output decoded like subprocess universal_newlines, with a marker where bytes were dropped."""
+        if self.truncated:
+            dropped = self.total_bytes - len(self.head) - len(self.tail)
+            output = (self.__decode(self.head) + f"\n...[{dropped} bytes truncated]...\n" + self.__decode(self.tail))
+        else:
+            output = self.__decode(self.head + self.tail)
+        return output
+
+    @staticmethod
+    def __decode(output: bytes) -> str:
+        return bytes(output).decode(errors="replace").replace("\r\n", "\n").replace("\r", "\n")
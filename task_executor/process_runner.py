@@ -0,0 +1,172 @@
+import asyncio
+import os
+import selectors
+import signal
+import subprocess
+import time
+from typing import Callable, Dict, List, Optional
+from .output_capture import OutputPolicy, StreamCapture
+
+READ_SIZE = 65536
+KILL_GRACE = 5
+
+
+class ProcessResult:
+    def __init__(self, return_code: int, stdout: StreamCapture, stderr: StreamCapture, duration: float, timed_out: bool = False,
+                 spawn_duration: float = None):
+        self.return_code = return_code
+        self.stdout = stdout.text()
+        self.stderr = stderr.text()
+        self.stdout_bytes = stdout.total_bytes
+        self.stderr_bytes = stderr.total_bytes
+        self.stdout_path = stdout.spilled_to
+        self.stderr_path = stderr.spilled_to
+        self.duration = duration
+        self.timed_out = timed_out
+        # Time to start the process, part of duration
+        self.spawn_duration = spawn_duration
+
+    def __repr__(self) -> str:
+        return (f"ProcessResult(return_code={self.return_code!r}, stdout_bytes={self.stdout_bytes!r}, "
+                f"stderr_bytes={self.stderr_bytes!r}, duration={self.duration!r}, timed_out={self.timed_out!r})")
+
+
+class TimeoutPolicy:
+    """
+    Timeout of each task in seconds, the first one set of:
+        the "timeout" key of the task content, e.g. {"command": [...], "timeout": 30}
+        the timeout of the task tag, tag_timeout(tag), e.g. Executor tag settings
+        timeout, the global timeout
+    None or 0 means no timeout. kill_grace is the time between SIGTERM and SIGKILL.
+    """
+
+    def __init__(self, timeout: Optional[float] = None, tag_timeout: Callable[[str], Optional[float]] = None,
+                 kill_grace: float = KILL_GRACE):
+        self.timeout = timeout
+        self.tag_timeout = tag_timeout
+        self.kill_grace = float(kill_grace)
+        self.tag_timeouts: Dict[str, Optional[float]] = {}
+
+    def timeout_for(self, task) -> Optional[float]:
+        timeout = task.content.get("timeout") if isinstance(task.content, dict) else None
+        if timeout is None and self.tag_timeout is not None:
+            if task.tag not in self.tag_timeouts:
+                self.tag_timeouts[task.tag] = self.tag_timeout(task.tag)
+            timeout = self.tag_timeouts[task.tag]
+        if timeout is None:
+            timeout = self.timeout
+        return float(timeout) if timeout else None
+
+    def __repr__(self) -> str:
+        return f"TimeoutPolicy(timeout={self.timeout!r}, kill_grace={self.kill_grace!r})"
+
+
+def signal_group(process, sig) -> None:
+    """Send sig to the process group of process, i.e. the command and every child it started."""
+    try:
+        os.killpg(process.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def terminate(process: subprocess.Popen, kill_grace: float = KILL_GRACE) -> int:
+    """SIGTERM the process group, SIGKILL it when it is still alive after kill_grace seconds."""
+    signal_group(process, signal.SIGTERM)
+    try:
+        return process.wait(timeout=kill_grace)
+    except subprocess.TimeoutExpired:
+        signal_group(process, signal.SIGKILL)
+        return process.wait()
+
+
+def run_process(command: List[str], policy: Optional[OutputPolicy] = None, task_id=None,
+                timeout: Optional[float] = None, kill_grace: float = KILL_GRACE) -> ProcessResult:
+    """
+    Run command and capture its output as it is produced, bounded by policy.
+
+    Both pipes are drained from the calling thread with a selector, so a chatty command
+    never holds more than policy.max_bytes per stream in memory. The command runs in its
+    own process group, after timeout seconds the whole group gets SIGTERM and, kill_grace
+    seconds later, SIGKILL.
+    """
+    policy = policy or OutputPolicy()
+    stdout, stderr = policy.capture(task_id, "stdout"), policy.capture(task_id, "stderr")
+    started = time.monotonic()
+    deadline = started + float(timeout) if timeout else None
+    timed_out = False
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+        spawn_duration = time.monotonic() - started
+        with selectors.DefaultSelector() as selector:
+            selector.register(process.stdout, selectors.EVENT_READ, stdout)
+            selector.register(process.stderr, selectors.EVENT_READ, stderr)
+            while selector.get_map():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0 and not timed_out:
+                    timed_out = True
+                    terminate(process, kill_grace)
+                    # The group is dead, only read what is left in the pipes
+                    deadline = time.monotonic() + 1
+                    continue
+                if remaining is not None and remaining <= 0:
+                    break
+                for key, _ in selector.select(remaining):
+                    chunk = os.read(key.fd, READ_SIZE)
+                    if chunk:
+                        key.data.feed(chunk)
+                    else:
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
+        if timed_out:
+            return_code = process.wait()
+        else:
+            try:
+                return_code = process.wait(timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                timed_out = True
+                return_code = terminate(process, kill_grace)
+        for pipe in (process.stdout, process.stderr):
+            pipe.close()
+    finally:
+        stdout.close()
+        stderr.close()
+    return ProcessResult(return_code, stdout, stderr, time.monotonic() - started, timed_out, spawn_duration)
+
+
+async def run_process_async(command: List[str], policy: Optional[OutputPolicy] = None, task_id=None,
+                            timeout: Optional[float] = None, kill_grace: float = KILL_GRACE) -> ProcessResult:
+    """asyncio version of run_process, the pipes are read by the event loop."""
+    policy = policy or OutputPolicy()
+    stdout, stderr = policy.capture(task_id, "stdout"), policy.capture(task_id, "stderr")
+
+    async def pump(stream: asyncio.StreamReader, capture: StreamCapture) -> None:
+        while True:
+            chunk = await stream.read(READ_SIZE)
+            if not chunk:
+                break
+            capture.feed(chunk)
+
+    async def communicate() -> int:
+        await asyncio.gather(pump(process.stdout, stdout), pump(process.stderr, stderr))
+        return await process.wait()
+
+    started = time.monotonic()
+    timed_out = False
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, start_new_session=True)
+        spawn_duration = time.monotonic() - started
+        try:
+            return_code = await asyncio.wait_for(communicate(), float(timeout) if timeout else None)
+        except asyncio.TimeoutError:
+            timed_out = True
+            signal_group(process, signal.SIGTERM)
+            try:
+                return_code = await asyncio.wait_for(process.wait(), kill_grace)
+            except asyncio.TimeoutError:
+                signal_group(process, signal.SIGKILL)
+                return_code = await process.wait()
+    finally:
+        stdout.close()
+        stderr.close()
+    return ProcessResult(return_code, stdout, stderr, time.monotonic() - started, timed_out, spawn_duration)
@@ -0,0 +1,54 @@
+from typing import Dict, List
+from .stats import percentile
+
+# Phases of a task run, in order, and the end-to-end total (queued to committed)
+PHASES = [ "queue_wait", "claim_duration", "pickup_wait", "spawn_duration", "exec_duration", "write_wait", "total" ]
+PERCENTILES = (50, 95, 99)
+
+
+class TaskProfile:
+    """
+    Where the time of the tasks of each tag goes, from the phase timings of their task logs.
+
+    queue_wait      -- created to claimed, too long: more workers or bigger batches
+    claim_duration  -- the claim query of the batch
+    pickup_wait     -- claimed to started, waiting in the scheduler buffer, too long: smaller batches
+    spawn_duration  -- process start
+    exec_duration   -- the command itself
+    write_wait      -- finished to committed by the result writer
+
+    profile = TaskProfile(executor.get_task_phases(tag), top=5)
+    print(profile.format())
+    """
+
+    def __init__(self, rows: List[dict], top: int = 5):
+        self.top = int(top)
+        self.tags: Dict[str, List[dict]] = {}
+        for row in rows:
+            self.tags.setdefault(row["tag"], []).append(row)
+
+    def summary(self) -> Dict[str, dict]:
+        result = {}
+        for tag, rows in self.tags.items():
+            phases = {}
+            for phase in PHASES:
+                values = [ row[phase] for row in rows if row[phase] is not None ]
+                if values:
+                    phases[phase] = dict({ f"p{q}": percentile(values, q) for q in PERCENTILES }, max=max(values))
+            slowest = sorted((row for row in rows if row["total"] is not None), key=lambda row: row["total"], reverse=True)
+            result[tag] = { "runs": len(rows), "phases": phases, "slowest": slowest[:self.top] }
+        return result
+
+    def format(self) -> str:
+        lines = []
+        for tag, profile in self.summary().items():
+            lines.append(f"Tag: {tag}, runs: {profile['runs']}")
+            lines.append(f"  {'phase':<16}" + "".join(f"{name:>12}" for name in [ f"p{q}" for q in PERCENTILES ] + ["max"]))
+            for phase, stats in profile["phases"].items():
+                lines.append(f"  {phase:<16}" + "".join(f"{value:>12.4f}" for value in stats.values()))
+            lines.append(f"  slowest {len(profile['slowest'])} tasks (seconds):")
+            for row in profile["slowest"]:
+                phases = ", ".join(f"{phase}={row[phase]:.3f}" for phase in PHASES[:-1] if row[phase] is not None)
+                lines.append(f"    task {row['task_id']} {row['status'].name if hasattr(row['status'], 'name') else row['status']} "
+                             f"total={row['total']:.3f} on {row['worker_id']}: {phases}")
+        return "\n".join(lines) if lines else "No task logs with phase timings"
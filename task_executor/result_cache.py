@@ -0,0 +1,176 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import Future, wait
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from .model.orm import Status, Task
+from .result_writer import Completion
+
+# Content keys that do not change what a task runs
+IGNORED_KEYS = ("priority", "timeout", "cache", "depends_on")
+
+
+class ResultCache:
+    """
+    Reuse the result of a command that already completed OK instead of running it again.
+
+    Tasks are keyed by a sha256 of their normalized content (sorted keys, without the keys
+    in IGNORED_KEYS), whatever their tag. A task whose key has a COMPLETED_OK result younger
+    than ttl seconds completes at once with that result, its task log message gets
+    "cacheHit": true and the id of the task that really ran. Identical commands running at
+    the same time in this process only run once, the others wait for it. A task with
+    {"cache": false} in its content always runs.
+
+    Results are kept in the result_cache table. Every evict_every new results, and on close,
+    expired results are deleted and then the least recently used ones, until the cached
+    messages take at most max_bytes.
+
+    cache = ResultCache(executor, ttl=3600)
+    completion = cache.run(task, created_at, execute=lambda: run_it(task))
+    """
+
+    def __init__(self, executor, ttl: float, max_bytes: int = 104857600, evict_every: int = 1000):
+        self.executor = executor
+        self.ttl = float(ttl)
+        self.max_bytes = int(max_bytes)
+        self.evict_every = int(evict_every)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.in_flight: Dict[str, Future] = {}
+        self.pending_hits: Dict[str, int] = {}
+        self.stored = 0
+        self.logger = logging.getLogger(__class__.__name__)
+
+    @staticmethod
+    def key(content) -> Optional[str]:
+        """Cache key of a task content, None when the task must not be cached."""
+        if not isinstance(content, dict) or content.get("cache") is False:
+            return None
+        normalized = { name: value for name, value in content.items() if name not in IGNORED_KEYS }
+        return hashlib.sha256(json.dumps(normalized, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+    def run(self, task: Task, created_at, execute: Callable[[], Completion]) -> Completion:
+        key = self.key(task.content)
+        if key is None:
+            return execute()
+        leader, future = self.__begin(key)
+        if not leader:
+            wait((future,))
+            hit = self.__from_leader(task, created_at, future)
+            return hit if hit is not None else execute()
+        completion = None
+        try:
+            completion = self.__lookup(key, task, created_at) or execute()
+            return completion
+        finally:
+            self.__finish(key, task, completion, future)
+
+    async def run_async(self, task: Task, created_at, execute: Callable[[], Awaitable[Completion]]) -> Completion:
+        """run for the asyncio engine, database calls are made on a helper thread."""
+        key = self.key(task.content)
+        if key is None:
+            return await execute()
+        leader, future = self.__begin(key)
+        if not leader:
+            await asyncio.wait((asyncio.wrap_future(future),))
+            hit = self.__from_leader(task, created_at, future)
+            return hit if hit is not None else await execute()
+        completion = None
+        try:
+            completion = await asyncio.to_thread(self.__lookup, key, task, created_at) or await execute()
+            return completion
+        finally:
+            await asyncio.to_thread(self.__finish, key, task, completion, future)
+
+    def close(self) -> None:
+        """Record the pending hit counts and evict, call once at the end of a run."""
+        self.evict()
+        self.logger.info(f"Result cache hits: {self.hits}, misses: {self.misses}")
+
+    def evict(self) -> int:
+        with self.lock:
+            hits, self.pending_hits = self.pending_hits, {}
+        self.executor.record_cache_hits(hits)
+        evicted = self.executor.evict_cached_results(max_age=self.ttl, max_bytes=self.max_bytes)
+        if evicted:
+            self.logger.info(f"Evicted {evicted} cached results")
+        return evicted
+
+    def hit(self, task: Task, created_at, source_task_id: int, message, **kwargs) -> Completion:
+        if isinstance(message, str):
+            try:
+                message = json.loads(message)
+            except ValueError:
+                message = { "output": message }
+        message = dict(message, cacheHit=True, cachedTaskId=source_task_id)
+        duration = (datetime.datetime.now() - created_at).total_seconds() if created_at else None
+        return Completion(task.id, Status.COMPLETED_OK, message, created_at=created_at, duration=duration,
+                          attempts=task.attempts, **kwargs)
+
+    def __begin(self, key) -> Tuple[bool, Future]:
+        """Register the first task running key as leader, the other ones get its future to wait on."""
+        with self.lock:
+            if key in self.in_flight:
+                return False, self.in_flight[key]
+            future = self.in_flight[key] = Future()
+            return True, future
+
+    def __lookup(self, key, task: Task, created_at) -> Optional[Completion]:
+        cached = self.executor.get_cached_result(key, min_created_at=time.time() - self.ttl)
+        with self.lock:
+            if cached is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.pending_hits[key] = self.pending_hits.get(key, 0) + 1
+        return self.hit(task, created_at, cached.task_id, cached.message, return_code=cached.return_code,
+                        stdout_bytes=cached.stdout_bytes, stderr_bytes=cached.stderr_bytes,
+                        stdout_path=cached.stdout_path, stderr_path=cached.stderr_path)
+
+    def __from_leader(self, task: Task, created_at, future: Future) -> Optional[Completion]:
+        """Hit from the leader's completion, None (the follower runs itself) when it failed or the leader broke."""
+        if future.exception() is not None:
+            return None
+        source_task_id, completion = future.result()
+        if completion is None or completion.status != Status.COMPLETED_OK:
+            return None
+        with self.lock:
+            self.hits += 1
+            key = self.key(task.content)
+            self.pending_hits[key] = self.pending_hits.get(key, 0) + 1
+        return self.hit(task, created_at, source_task_id, completion.message, return_code=completion.return_code,
+                        stdout_bytes=completion.stdout_bytes, stderr_bytes=completion.stderr_bytes,
+                        stdout_path=completion.stdout_path, stderr_path=completion.stderr_path)
+
+    def __finish(self, key, task: Task, completion: Optional[Completion], future: Future) -> None:
+        try:
+            if completion is not None and completion.status == Status.COMPLETED_OK and not completion.message.get("cacheHit"):
+                # Stored before the key leaves in_flight, so a later identical task finds it
+                self.executor.put_cached_result(key, task.id, completion.message, return_code=completion.return_code,
+                                                stdout_bytes=completion.stdout_bytes, stderr_bytes=completion.stderr_bytes,
+                                                stdout_path=completion.stdout_path, stderr_path=completion.stderr_path,
+                                                duration=completion.duration)
+                with self.lock:
+                    self.stored += 1
+                    due = self.stored % self.evict_every == 0
+                if due:
+                    self.evict()
+        except Exception as e:
+            self.logger.error(e)
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+            # The followers block on future: it must be set whatever the completion holds
+            try:
+                message = completion.message if completion is not None else None
+                source_task_id = message.get("cachedTaskId", task.id) if isinstance(message, dict) else task.id
+                future.set_result((source_task_id, completion))
+            except Exception as e:
+                self.logger.error(e)
+                if not future.done():
+                    future.set_exception(e)
@@ -0,0 +1,179 @@
+import datetime
+import logging
+import queue
+import threading
+import time
+from typing import List
+from .exceptions import TaskLogError
+from .model.orm import Status
+from .process_runner import ProcessResult
+
+
+class Completion:
+    """Final status and task log of a finished task, handed from a worker thread to the ResultWriter."""
+
+    def __init__(self, task_id: int, status: Status, message, created_at=None, updated_at=None,
+                 return_code: int = None, stdout_bytes: int = None, stderr_bytes: int = None,
+                 duration: float = None, stdout_path: str = None, stderr_path: str = None, retry_at: float = None,
+                 attempts: int = None, spawn_duration: float = None, worker_id: str = None):
+        self.task_id = task_id
+        self.status = status
+        self.message = message
+        self.created_at = created_at
+        self.updated_at = updated_at or datetime.datetime.now()
+        self.return_code = return_code
+        self.stdout_bytes = stdout_bytes
+        self.stderr_bytes = stderr_bytes
+        self.duration = duration
+        self.stdout_path = stdout_path
+        self.stderr_path = stderr_path
+        # When set the task goes back to RE_PROCESS until this epoch time, the log keeps status
+        self.retry_at = retry_at
+        self.attempts = attempts
+        self.spawn_duration = spawn_duration
+        # Phase timings, epoch seconds, see track()
+        self.finished_at = time.time()
+        self.started_at = self.finished_at - duration if duration is not None else None
+        self.queued_at = None
+        self.claimed_at = None
+        self.claim_duration = None
+        # The worker the task is claimed by, the completion is dropped once another worker claimed it
+        self.worker_id = worker_id
+        self.hostname = None
+
+    @classmethod
+    def from_result(cls, task_id: int, result: ProcessResult, created_at=None, attempts: int = None) -> "Completion":
+        if result.timed_out:
+            status = Status.TIMED_OUT
+        elif result.return_code == 0:
+            status = Status.COMPLETED_OK
+        else:
+            status = Status.COMPLETED_ERROR
+        message = { "stdout": result.stdout, "stderr": result.stderr, "returnCode": result.return_code }
+        if result.timed_out:
+            message["timedOut"] = True
+        return cls(task_id, status, message, created_at=created_at, return_code=result.return_code,
+                   stdout_bytes=result.stdout_bytes, stderr_bytes=result.stderr_bytes, duration=result.duration,
+                   stdout_path=result.stdout_path, stderr_path=result.stderr_path, attempts=attempts,
+                   spawn_duration=result.spawn_duration)
+
+    @classmethod
+    def from_exception(cls, task_id: int, error: Exception, created_at=None, attempts: int = None) -> "Completion":
+        message = { "output": error.__str__(), "returnCode": 1 }
+        duration = (datetime.datetime.now() - created_at).total_seconds() if created_at else None
+        return cls(task_id, Status.COMPLETED_ERROR, message, created_at=created_at, return_code=1, duration=duration,
+                   attempts=attempts)
+
+    def track(self, task) -> "Completion":
+        """Copy the queue and claim times of task, the phases before the command started, and the worker holding it."""
+        created_at = getattr(task, "created_at", None)
+        try:
+            self.queued_at = datetime.datetime.fromisoformat(str(created_at)).timestamp() if created_at else None
+        except ValueError:
+            self.queued_at = None
+        self.claimed_at = getattr(task, "claimed_at", None)
+        self.claim_duration = getattr(task, "claim_duration", None)
+        self.worker_id = getattr(task, "worker_id", None)
+        return self
+
+    def __repr__(self) -> str:
+        return f"Completion(task_id={self.task_id!r}, status={self.status!r})"
+
+
+class ResultWriter:
+    """
+    Group commit of task completions.
+
+    Worker threads submit() completions to a queue, a single writer thread flushes them to the
+    database through Executor.complete_tasks, many per transaction. A flush happens when
+    max_batch completions are waiting or max_delay seconds after the first one arrived.
+    close() stops the writer after every submitted completion has been committed. With metrics
+    (a metrics.Metrics) the latency of every commit is measured.
+
+    with ResultWriter(executor) as writer:
+        writer.submit(Completion(task.id, Status.COMPLETED_OK, message, created_at))
+    """
+
+    _STOP = object()
+
+    def __init__(self, executor, max_batch: int = 500, max_delay: float = 0.2, max_retries: int = 5, metrics=None):
+        self.executor = executor
+        self.metrics = metrics
+        self.max_batch = int(max_batch)
+        self.max_delay = float(max_delay)
+        self.max_retries = int(max_retries)
+        self.queue: queue.Queue = queue.Queue()
+        self.written = 0
+        self.failed: List[Completion] = []
+        self.thread = threading.Thread(target=self.__run, name="ResultWriter", daemon=True)
+        self.logger = logging.getLogger(__class__.__name__)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def submit(self, completion: Completion) -> None:
+        self.queue.put(completion)
+
+    def flush(self) -> None:
+        """Block until every completion submitted so far is committed."""
+        if not self.thread.is_alive():
+            return
+        flushed = threading.Event()
+        self.queue.put(flushed)
+        flushed.wait()
+
+    def close(self) -> None:
+        if self.thread.is_alive():
+            self.queue.put(self._STOP)
+            self.thread.join()
+        if self.failed:
+            raise TaskLogError(f"{len(self.failed)} task completions could not be written, first: {self.failed[0]}")
+
+    def __run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch, flushed = [], []
+            deadline = None
+            while len(batch) < self.max_batch:
+                try:
+                    timeout = None if deadline is None else max(0, deadline - time.monotonic())
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stopping = True
+                    break
+                if isinstance(item, threading.Event):
+                    flushed.append(item)
+                    break
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.max_delay
+            self.__write(batch)
+            for event in flushed:
+                event.set()
+
+    def __write(self, batch: List[Completion]) -> None:
+        if not batch:
+            return
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                started = time.perf_counter()
+                self.executor.complete_tasks(batch)
+                if self.metrics is not None:
+                    self.metrics.db_write_seconds.observe(time.perf_counter() - started)
+                    self.metrics.db_write_rows.inc(len(batch))
+                self.written += len(batch)
+                self.logger.debug(f"Committed {len(batch)} task completions")
+                return
+            except Exception as e:
+                self.logger.error(f"Writing {len(batch)} task completions failed, attempt {attempt}: {e}")
+                time.sleep(min(0.1 * 2 ** attempt, 2))
+        self.failed.extend(batch)
@@ -0,0 +1,159 @@
+import datetime
+import gzip
+import json
+import logging
+import os
+import time
+from typing import Dict, List
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from .model import migration
+from .model.backend import FINISHED
+from .model.executor_action_db import ExecutorActionDB
+from .model.orm import Base, Task, TaskLog
+
+ARCHIVE_FORMATS = ("jsonl", "sqlite")
+TASK_COLUMNS = [ column.key for column in Task.__table__.columns ]
+TASK_LOG_COLUMNS = [ column.key for column in TaskLog.__table__.columns ]
+
+
+class JsonlArchive:
+    """
+    Append archived tasks to a JSON lines file, gzip compressed when its name ends with .gz.
+    One line per task with every task log in "logs", JSON messages kept as objects. Every run
+    appends a new gzip member, gzip.open reads them all as one stream.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = gzip.open(path, mode="at") if str(path).endswith(".gz") else open(path, mode="a")
+
+    @staticmethod
+    def record(task) -> dict:
+        value = lambda row, column: str(getattr(row, column)) if column in ("created_at", "updated_at") else getattr(row, column)
+        record = { column: value(task, column) for column in TASK_COLUMNS }
+        record["status"] = task.status.name
+        record["logs"] = []
+        for log in task.logs:
+            log_record = { column: value(log, column) for column in TASK_LOG_COLUMNS }
+            log_record["status"] = log.status.name
+            try:
+                log_record["message"] = json.loads(log.message)
+            except (TypeError, ValueError):
+                pass
+            record["logs"].append(log_record)
+        return record
+
+    def write(self, tasks: List[Task]) -> None:
+        """Append tasks and flush them to disk before they are deleted from the database."""
+        for task in tasks:
+            self.file.write(json.dumps(self.record(task), default=str) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class SqliteArchive:
+    """
+    Copy archived tasks and their task logs, ids kept, to a separate SQLite database with the schema
+    of the task executor, so the usual tools (export, stats) read it. A task archived twice is kept once.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.db = ExecutorActionDB(path, echo=False)
+        Base.metadata.create_all(self.db.engine)
+        if self.db.schema_version() == 0:
+            migration.stamp(self.db.engine)
+
+    def write(self, tasks: List[Task]) -> None:
+        if not tasks:
+            return
+        session = self.db.session()
+        session.execute(sqlite_insert(Task).on_conflict_do_nothing(),
+                        [ { column: getattr(task, column) for column in TASK_COLUMNS } for task in tasks ])
+        logs = [ { column: getattr(log, column) for column in TASK_LOG_COLUMNS } for task in tasks for log in task.logs ]
+        if logs:
+            session.execute(sqlite_insert(TaskLog).on_conflict_do_nothing(), logs)
+        session.commit()
+        session.close()
+
+    def close(self) -> None:
+        self.db.engine.dispose()
+
+
+def open_archive(path: str, format: str = None):
+    """The archive of path: SQLite for a .sqlite or .db file, JSON lines (gzip for .gz) otherwise."""
+    format = format or ("sqlite" if str(path).lower().endswith((".sqlite", ".db")) else "jsonl")
+    if format not in ARCHIVE_FORMATS:
+        raise ValueError(f"unknown archive format: {format}, use one of {', '.join(ARCHIVE_FORMATS)}")
+    return SqliteArchive(path) if format == "sqlite" else JsonlArchive(path)
+
+
+class Retention:
+    """
+    Move finished tasks older than a policy, with their task logs, out of the database into an archive.
+
+    older_than -- seconds since the last update of a task, its completion, before it is archived
+    statuses -- statuses archived, every final status by default (COMPLETED_OK, COMPLETED_ERROR,
+                TIMED_OUT, UPSTREAM_FAILED); tasks a WAITING task depends on always stay
+    tag -- only archive the tasks of tag, every tag by default
+    archive -- JsonlArchive or SqliteArchive, None deletes the tasks without keeping them
+    batch_size -- tasks archived, then deleted in one short transaction, at a time
+    pause -- seconds slept between two batches, so the workers get the write lock in between
+    vacuum_pages -- free pages given back to the file system per incremental vacuum step, 0 skips it
+
+    A batch is written and flushed to the archive before it is deleted: after a crash in between it
+    is in both, and archived again by the next run, never lost. Workers keep running meanwhile, every
+    write transaction is bounded by batch_size tasks or vacuum_pages pages.
+
+    retention = Retention(executor, older_than=7 * 86400, archive=open_archive('archive.jsonl.gz'))
+    retention.run()  # {'archived': 1200, 'deleted': 1200, 'pages': 310}
+    """
+
+    def __init__(self, executor, older_than: float, statuses=FINISHED, tag=None, archive=None,
+                 batch_size: int = 500, pause: float = 0.05, vacuum_pages: int = 1000, progress=None):
+        self.executor = executor
+        self.older_than = float(older_than)
+        self.statuses = list(statuses)
+        self.tag = tag
+        self.archive = archive
+        self.batch_size = int(batch_size)
+        self.pause = float(pause)
+        self.vacuum_pages = int(vacuum_pages)
+        self.progress = progress
+        self.logger = logging.getLogger(__class__.__name__)
+
+    def run(self) -> Dict[str, int]:
+        updated_before = datetime.datetime.now() - datetime.timedelta(seconds=self.older_than)
+        archived = deleted = 0
+        while True:
+            tasks = self.executor.get_expired_tasks(updated_before, statuses=self.statuses, tag=self.tag, limit=self.batch_size)
+            if not tasks:
+                break
+            if self.archive is not None:
+                self.archive.write(tasks)
+                archived += len(tasks)
+            count = self.executor.delete_tasks([ task.id for task in tasks ])
+            deleted += count
+            if self.progress is not None:
+                self.progress.update(len(tasks))
+            if not count:
+                self.logger.warning(f"None of {len(tasks)} expired tasks could be deleted, stopping")
+                break
+            time.sleep(self.pause)
+        pages = self.compact()
+        self.logger.info(f"Retention: {archived} tasks archived, {deleted} deleted, {pages} pages freed")
+        return { "archived": archived, "deleted": deleted, "pages": pages }
+
+    def compact(self) -> int:
+        """Incremental vacuum, vacuum_pages at a time, until no free page is left."""
+        freed = 0
+        while self.vacuum_pages > 0:
+            pages = self.executor.compact(self.vacuum_pages)
+            freed += pages
+            if pages < self.vacuum_pages:
+                break
+            time.sleep(self.pause)
+        return freed
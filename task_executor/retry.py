@@ -0,0 +1,55 @@
+import random
+import time
+from typing import Iterable, Optional
+from .model.orm import Status
+
+
+class RetryPolicy:
+    """
+    When and how late a failed task runs again.
+
+    max_attempts   -- runs of a task including the first one, 1 disables retries
+    backoff        -- delay in seconds before the second run, doubled at every further attempt
+    backoff_max    -- upper bound of the delay
+    jitter         -- 'full' draws the delay uniformly between 0 and the backoff so that throttled
+                      tasks do not come back all at once, 'none' waits exactly the backoff
+    retry_on       -- return codes worth a retry, None retries every non zero return code
+    retry_timeouts -- retry TIMED_OUT tasks as well
+
+    A task to retry goes back to RE_PROCESS with a "not before" time, claims skip it until then.
+    """
+
+    def __init__(self, max_attempts: int = 1, backoff: float = 1.0, backoff_max: float = 300.0,
+                 jitter: str = "full", retry_on: Optional[Iterable[int]] = None, retry_timeouts: bool = False):
+        if jitter not in ("full", "none"):
+            raise ValueError(f"unknown jitter: {jitter}, use either full or none")
+        self.max_attempts = int(max_attempts)
+        self.backoff = float(backoff)
+        self.backoff_max = float(backoff_max)
+        self.jitter = jitter
+        self.retry_on = None if retry_on is None else { int(code) for code in retry_on }
+        self.retry_timeouts = bool(retry_timeouts)
+
+    def should_retry(self, attempts: int, status: Status, return_code: Optional[int]) -> bool:
+        """attempts is the number of runs so far, the one that just finished included."""
+        if attempts >= self.max_attempts:
+            return False
+        if status == Status.TIMED_OUT:
+            return self.retry_timeouts
+        if status != Status.COMPLETED_ERROR:
+            return False
+        return self.retry_on is None or return_code in self.retry_on
+
+    def delay(self, attempts: int) -> float:
+        backoff = min(self.backoff_max, self.backoff * 2 ** max(0, attempts - 1))
+        return random.uniform(0, backoff) if self.jitter == "full" else backoff
+
+    def retry_at(self, attempts: int, status: Status, return_code: Optional[int]) -> Optional[float]:
+        """Epoch time of the next run, None when the task must not be retried."""
+        if not self.should_retry(attempts, status, return_code):
+            return None
+        return time.time() + self.delay(attempts)
+
+    def __repr__(self) -> str:
+        return (f"RetryPolicy(max_attempts={self.max_attempts!r}, backoff={self.backoff!r}, backoff_max={self.backoff_max!r}, "
+                f"jitter={self.jitter!r}, retry_on={self.retry_on!r}, retry_timeouts={self.retry_timeouts!r})")
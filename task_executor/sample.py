@@ -1,5 +1,5 @@
-import ast
 import datetime
+import json
 import subprocess
 import time
 import threading
@@ -75,9 +75,9 @@ def main():
         # Get the fisrt 2 tasks with status NEW     
         tasks = executor.get_next_batch(tag, Status.NEW, batch_size=batch_size)
 
-    tasks = executor.get_task_by_tag(tag=tag)
-    for task in tasks:
-        output.append(ast.literal_eval(task.task_logs[0].message)["returnCode"])
+    # Tasks are streamed page by page with their latest task log, no query per task
+    for task in executor.iter_tasks(tag=tag):
+        output.append(json.loads(task.latest_log.message)["returnCode"])
 
     print(f"Execution returnCode: {output}")
 
@@ -0,0 +1,80 @@
+import logging
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Deque, List
+from .model.orm import Task
+
+
+class StreamingScheduler:
+    """
+    Keep max_workers tasks in flight until the claim function returns no more tasks.
+
+    A slot is refilled as soon as one task finishes and the next batch is claimed in the
+    background while the current one is still running, so there is no barrier per batch.
+
+    claim     -- callable(batch_size) -> List[Task], e.g. a partial over Executor.get_next_batch
+    run_task  -- callable(task) executed on the worker pool
+    progress  -- optional tqdm-like object, updated once per finished task
+    idle      -- optional callable() -> bool, called when nothing is claimable and nothing runs,
+                 returning True (e.g. after sleeping until a retry is due) makes the scheduler claim again
+    """
+
+    def __init__(self, claim: Callable[[int], List[Task]], run_task: Callable[[Task], None],
+                 batch_size: int, max_workers: int, progress=None, idle: Callable[[], bool] = None):
+        self.claim = claim
+        self.run_task = run_task
+        self.batch_size = int(batch_size)
+        self.max_workers = int(max_workers)
+        self.progress = progress
+        self.idle = idle
+        self.logger = logging.getLogger(__class__.__name__)
+
+    def run(self) -> int:
+        pending: Deque[Task] = deque()
+        in_flight = set()
+        finished = 0
+        next_claim = None
+        exhausted = False
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool, \
+             ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch") as prefetcher:
+            next_claim = prefetcher.submit(self.claim, self.batch_size)
+
+            while True:
+                # Refill every free worker slot
+                while len(in_flight) < self.max_workers:
+                    if not pending:
+                        if exhausted:
+                            break
+                        if next_claim is None:
+                            next_claim = prefetcher.submit(self.claim, self.batch_size)
+                        batch = next_claim.result()
+                        next_claim = None
+                        if not batch:
+                            exhausted = True
+                            break
+                        pending.extend(batch)
+                    in_flight.add(pool.submit(self.run_task, pending.popleft()))
+
+                # Prefetch the next claim while the buffer runs low
+                if not exhausted and next_claim is None and len(pending) < self.max_workers:
+                    next_claim = prefetcher.submit(self.claim, self.batch_size)
+
+                if not in_flight:
+                    if not pending and self.idle is not None and self.idle():
+                        exhausted = False
+                        continue
+                    break
+
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        self.logger.error(e)
+                    finished += 1
+                    if self.progress is not None:
+                        self.progress.update(1)
+
+        self.logger.info(f"Scheduler finished {finished} tasks")
+        return finished
@@ -1,15 +1,35 @@
 import datetime
+import json
 import logging
 import os
-import re
-import subprocess
+import socket
 import threading
+import time
 import traceback
 import fire
 from concurrent.futures import ALL_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from tqdm import tqdm
+from .model.backend import FINISHED
 from .model.orm import Status, Task
+from .async_engine import AsyncEngine
+from .callable_runner import CallableRunner, describe, is_callable_task
+from .coalesce import ShellPool
 from .executor import Executor
+from .exporter import TaskExporter
+from .fair_share import FairShareClaimer
+from .importer import TaskImporter
+from .metrics import Metrics, MetricsReporter
+from .output_capture import OutputPolicy
+from .profiler import TaskProfile
+from .process_runner import TimeoutPolicy, run_process
+from .result_cache import ResultCache
+from .result_writer import Completion, ResultWriter
+from .retention import Retention, open_archive
+from .retry import RetryPolicy
+from .scheduler import StreamingScheduler
+from .stats import TaskStats, WINDOWS
+from .throttle import AimdController, RateLimiter
+from .worker import TaskWorker
 
 # Set logging
 logfile = "shell-executor.debug.log"
@@ -17,9 +37,39 @@ logging.basicConfig(level=logging.DEBUG,
                     format='%(name)s: %(asctime)s | %(levelname)s | %(filename)s:%(lineno)s | %(funcName)s - %(message)s',
                     handlers=[logging.FileHandler(logfile)])
 
+HOSTNAME = socket.gethostname()
+
 class ShellExecutor(object):
-    def __init__(self):
+    """
+    Shell command task executor.
+
+    Global flags:
+        --storage_profile  durable, balanced (default), throughput or legacy, see model/storage_profile.py
+        --codec            json (default), zlib or msgpack encoding of new task contents and messages, see model/codec.py
+        --backend          sqlite (default, one database file) or sharded (tags spread over several files),
+                           see model/backend.py
+        --shards           number of database files of the sharded backend, 4 by default
+    """
+    def __init__(self, storage_profile="balanced", codec="json", backend="sqlite", shards=4):
+        if backend not in ("sqlite", "sharded"):
+            raise ValueError(f"unknown storage backend: {backend}, use either sqlite or sharded")
+        self.storage_profile = storage_profile
+        self.codec = codec
+        self.backend = backend
+        self.shards = int(shards)
         self.executor: Executor = None
+        self.writer: ResultWriter = None
+        self.output_policy: OutputPolicy = None
+        self.timeout_policy: TimeoutPolicy = None
+        self.retry_policy: RetryPolicy = None
+        self.cache: ResultCache = None
+        self.metrics: Metrics = None
+        self.reporter: MetricsReporter = None
+        self.rate_limiter: RateLimiter = None
+        self.concurrency_controller: AimdController = None
+        self.shell_pool: ShellPool = None
+        self.callables: CallableRunner = None
+        self.worker_id = f"{HOSTNAME}:{os.getpid()}"
         self.db_name = f"{os.getcwd()}/shell-executor.sqlite"
         self.logger = logging.getLogger(__class__.__name__)
 
@@ -35,14 +85,33 @@ class ShellExecutor(object):
         """
         self.__log_start()
         
-        self.executor: Executor = Executor(db_file_full_path=self.db_name)
+        self.executor: Executor = Executor(db_file_full_path=self.db_name, storage_profile=self.storage_profile, codec=self.codec,
+                                           backend=self.backend, shards=self.shards)
         self.executor.create_db()
         self.logger.info(f"Database file {self.db_name}")
         
         self.__log_end()
 
+    def migrate_executor_db(self, vacuum=False) -> None:
+        """
+        Upgrade an existing task executor database in place to the current schema version.
+        Tasks and task logs are kept, unlike create_executor_db.
+
+        vacuum = 'True', also switch the file to auto_vacuum = INCREMENTAL, so archive_tasks can give
+                 the pages it frees back to the file system. This rewrites the whole file once with
+                 VACUUM under an exclusive lock: stop every worker first.
+        """
+        self.__log_start()
+
+        self.__get_executor()
+        applied = self.executor.migrate_db(vacuum=vacuum)
+        print(f"Database file {self.db_name}, applied migrations: {applied or 'none, already up to date'}")
+
+        self.__log_end()
+
     def __get_executor(self) -> None:
-        self.executor: Executor = Executor(db_file_full_path=self.db_name)
+        self.executor: Executor = Executor(db_file_full_path=self.db_name, storage_profile=self.storage_profile, codec=self.codec,
+                                           backend=self.backend, shards=self.shards)
 
     def add_command(self, tag, command) -> None:
         """
@@ -62,93 +131,554 @@ class ShellExecutor(object):
         
         self.__log_end()
 
-    def add_multi_command(self, tag, command_file) -> None:
+    def add_multi_command(self, tag, command_file="-", commit_size=10000) -> None:
         """
-        Add multiple command to the task executor database.
+        Add multiple command to the task executor database, one JSON command per line.
+        The file is streamed, without command_file (or with '-') the commands are read from stdin.
 
         example:
-            python shell_executor.py add_command --tag=sandpit --command_file=commands.txt
+            python shell_executor.py add_multi_command --tag=sandpit --command_file=commands.txt
+            sqlite3 billing.sqlite < commands.sql | python shell_executor.py add_multi_command sandpit --commit_size=50000
 
-        command = {'command':['az','tag','list','--resource-id','/SUBSCRIPTIONS/....']}
-        tag = 'sandpit'           
+        command = {"command": ["az", "tag", "list", "--resource-id", "/SUBSCRIPTIONS/...."]}
+        tag = 'sandpit'
+        commit_size = number of tasks inserted per transaction
         """
         self.__log_start()
         self.__get_executor()
 
         # Add task command into the TaskExecutor Database with Status NEW
         try:
-            content_list = []
-            with open(command_file, mode='r') as file:
-                for line in file.readlines():
-                    if re.match('^{.*}$', line) != None:
-                        content_list.append(line.rstrip('\n'))
-            self.executor.add_multi_task(tag=tag, content_list=content_list)
+            with tqdm(desc="Lines", unit=" lines") as progress:
+                result = TaskImporter(self.executor, tag, commit_size=commit_size, progress=progress).import_file(command_file)
+            print(f"Inserted {result.inserted} tasks for tag {tag} from {result.lines} lines, {result.bad} bad lines")
+            for line_number, line in result.bad_lines:
+                print(f"  line {line_number}: {line}")
         except Exception as e:
             self.logger.error(e)
             print(e)
 
         self.__log_end()
 
-    def run_command(self, tag, batch_size, max_workers):
+    def export(self, tag=None, output="-", status=None, format=None, batch_size=1000) -> None:
+        """
+        Export tasks with the result of their latest run, streamed with constant memory.
+        Example Argument:
+            tag = 'sandpit', optional, every tag by default
+            output = './results.jsonl' or './results.csv', '-' (default) writes JSON lines to stdout
+            status = 'COMPLETED_ERROR,TIMED_OUT', optional, only tasks in these statuses
+            format = 'jsonl' or 'csv', optional, from the output extension by default
+            batch_size = '1000', tasks read per query
+        """
+        self.__get_executor()
+        statuses = [ Status[name] for name in self.__names(status) ] if status is not None else None
+        exporter = TaskExporter(self.executor, tag=tag, status=statuses, batch_size=batch_size)
+        if output == "-":
+            exporter.export_file(output, format)
+            return
+        with tqdm(desc="Tasks", unit=" tasks") as progress:
+            exporter.progress = progress
+            count = exporter.export_file(output, format)
+        print(f"Exported {count} tasks to {output}")
+
+    def archive_tasks(self, older_than=604800, output="shell-executor.archive.jsonl.gz", tag=None, status=None,
+                      purge=False, batch_size=500, pause=0.05, vacuum_pages=1000) -> None:
+        """
+        Move finished tasks older than a retention policy, with their task logs, out of the database
+        into an archive file, then give the freed pages back to the file system. Safe to run while
+        workers are busy: tasks are archived and deleted batch_size at a time, each batch in its own
+        short transaction, and the file is shrunk by incremental vacuum, vacuum_pages at a time.
+        Example Argument:
+            older_than = '604800', seconds since the completion of a task, 7 days by default
+            output = './archive.jsonl.gz' (default name, JSON lines, gzip for .gz) or './archive.sqlite'
+                     (a task executor database), appended to when it exists
+            tag = 'sandpit', optional, every tag by default
+            status = 'COMPLETED_OK', optional, every final status by default
+            purge = 'True' deletes the tasks without archiving them
+            batch_size = '500', tasks archived and deleted per transaction
+            pause = '0.05', seconds between two transactions, leaves the write lock to the workers
+            vacuum_pages = '1000', pages freed per incremental vacuum step, 0 skips the vacuum
+        """
+        self.__log_start()
+
+        self.__get_executor()
+        statuses = [ Status[name] for name in self.__names(status) ] if status is not None else FINISHED
+        archive = None if purge else open_archive(output)
+        retention = Retention(self.executor, older_than=older_than, statuses=statuses, tag=tag, archive=archive,
+                              batch_size=batch_size, pause=pause, vacuum_pages=vacuum_pages)
+        try:
+            with tqdm(desc="Archived", unit=" tasks") as progress:
+                retention.progress = progress
+                result = retention.run()
+        finally:
+            if archive is not None:
+                archive.close()
+        done = f"Archived {result['archived']} tasks to {output}" if archive is not None else f"Purged {result['deleted']} tasks"
+        print(f"{done}, {result['pages']} free pages given back")
+
+        self.__log_end()
+
+    def __run_task(self, task) -> Task:
+        self.logger.info(f"TaskId: {task.id}, ThreadName: {threading.current_thread().name}, ThreadId: {threading.current_thread().ident} started")
+        self.logger.info(f"Runing task with content: {describe(task.content)}")
+        created_at = datetime.datetime.now()
+
+        execute = lambda: self.__execute(task, created_at)
+        completion = self.cache.run(task, created_at, execute) if self.cache is not None else execute()
+
+        self.__complete(completion.track(task))
+        status = completion.status
+
+        self.logger.info(f"Status: {status}, TaskId: {task.id}, ThreadName: {threading.current_thread().name}, ThreadId: {threading.current_thread().ident} finished.")
+
+    def __execute(self, task, created_at) -> Completion:
+        if self.concurrency_controller is None:
+            return self.__run_command(task, created_at)
+        slot = self.concurrency_controller.acquire()
+        completion = None
+        try:
+            completion = self.__run_command(task, created_at)
+            return completion
+        finally:
+            self.concurrency_controller.release(slot, completion)
+
+    def __run_command(self, task, created_at) -> Completion:
+        if self.rate_limiter is not None:
+            self.rate_limiter.wait(task.tag)
+        if self.metrics is not None:
+            self.metrics.command_started()
+        started = time.monotonic()
+        try:
+            if is_callable_task(task.content):
+                return self.callables.run(task, created_at, self.output_policy, self.timeout_policy.timeout_for(task))
+            run = self.shell_pool.run if self.shell_pool is not None else run_process
+            result = run(task.content["command"], self.output_policy, task_id=task.id,
+                         timeout=self.timeout_policy.timeout_for(task), kill_grace=self.timeout_policy.kill_grace)
+            return Completion.from_result(task.id, result, created_at=created_at, attempts=task.attempts)
+        except Exception as e:
+            completion = Completion.from_exception(task.id, e, created_at=created_at, attempts=task.attempts)
+            self.logger.debug(f'{describe(task.content)}\nstatus: {completion.status}\nmessage: {completion.message}\nUnexpected Error: {traceback.format_exc()}')
+            return completion
+        finally:
+            if self.metrics is not None:
+                self.metrics.command_finished(time.monotonic() - started)
+
+    def run_command(self, tag, batch_size, max_workers, scheduler="chunk", engine="thread",
+                    max_output_bytes=1048576, spill_dir=None, timeout=None, kill_grace=5,
+                    max_attempts=1, backoff=1.0, backoff_max=300, retry_on=None, retry_timeouts=False,
+                    cache_ttl=None, cache_max_bytes=104857600, metrics_port=None, metrics_file=None, metrics_interval=15,
+                    rate=None, burst=None, adaptive=False, min_workers=1, throttle_on=None, throttle_stderr=None,
+                    latency_target=None, coalesce=False, callable_pool="process", callable_workers=None):
         """
         Run commands. Example Argument:
-            tag = 'sandpit'          
+            tag = 'sandpit', several tags 'urgent,backfill' or every tag '*'
             batch_size = '2'
             max_workers = '2'
-        """
-        def run_task(task) -> Task:
-            self.logger.info(f"TaskId: {task.id}, ThreadName: {threading.current_thread().name}, ThreadId: {threading.current_thread().ident} started")
-            self.logger.info(f"Runing task with content: {task.content['command']}")
-            created_at = datetime.datetime.now()
+            scheduler = 'chunk' (default) or 'stream'
+            engine = 'thread' (default) or 'async'
+            max_output_bytes = '1048576', bytes of stdout and of stderr kept in the task log,
+                               longer output keeps its first and last half around a marker
+            spill_dir = './output', optional, longer output is also saved in full as gzip files there
+            timeout = '300', optional, seconds before a command is killed, see below
+            kill_grace = '5', seconds between SIGTERM and SIGKILL of a timed out command
+            max_attempts = '3', runs of a failed task including the first one, default 1 (no retry)
+            backoff = '1', seconds before the first retry, doubled at each attempt with full jitter
+            backoff_max = '300', upper bound of the retry delay
+            retry_on = '1,255', return codes to retry, default every non zero return code
+            retry_timeouts = 'True', retry TIMED_OUT tasks as well
+            cache_ttl = '3600', optional, reuse the result of an identical command completed OK
+                        within that many seconds instead of running it, see below
+            cache_max_bytes = '104857600', size of the cached results kept in the result_cache table
+            metrics_port = '9464', optional, serve metrics on http://127.0.0.1:9464/metrics (Prometheus)
+            metrics_file = './metrics.json', optional, write a JSON snapshot of the metrics there
+            metrics_interval = '15', seconds between queue depth refreshes and snapshots
+            rate = '5', optional, commands started per second per tag, the rate of configure_tag wins
+            burst = '1', commands a tag can start at once after an idle period, within its rate
+            adaptive = 'True', adapt the commands in flight between min_workers and max_workers, see below
+            min_workers = '1', lower bound of the adaptive concurrency, also where it starts
+            throttle_on = '1,255', return codes lowering the adaptive concurrency, default every non zero one
+            throttle_stderr = 'TooManyRequests|429', optional, regular expression of stderr lowering it as well
+            latency_target = '30', optional, commands running longer lower it as well
+            coalesce = 'True', run the commands in long lived bash co-processes instead of one process each,
+                       thread engine only, see below
+            callable_pool = 'process' (default) or 'thread', pool running the Python callable tasks, see below
+            callable_workers = '8', optional, size of that pool, the number of CPUs by default
 
-            try:
-                process = subprocess.run(task.content["command"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-                return_code = process.returncode
-                message = { "stdout": process.stdout, "stderr": process.stderr, "returnCode": process.returncode }
+        A task "timeout" key ({"command": [...], "timeout": 30}) wins over the tag timeout
+        (configure_tag) which wins over the timeout argument. A timed out command gets SIGTERM
+        then SIGKILL together with every process it started, its task ends as TIMED_OUT.
 
-                if process.returncode == 0:
-                    status = Status.COMPLETED_OK
-                else:
-                    status = Status.COMPLETED_ERROR
-
-                # Update the status of the task depending on the standard error
-                self.executor.update_task(task, status=status)
-                task = self.executor.get_task_by_id(id=task.id)
-                self.executor.add_task_log(task=task, message=message, status=status, created_at=created_at, updated_at=datetime.datetime.now())
-            except Exception as e:
-                return_code = 1
-                message = { "output": e.__str__(), "returnCode": return_code }
-                status = Status.COMPLETED_ERROR
-                self.executor.update_task(task, status=status)
-                task = self.executor.get_task_by_id(id=task.id)
-                self.executor.add_task_log(task=task, message=message, status=status, created_at=created_at, updated_at=datetime.datetime.now())
-                self.logger.debug(f'command: {task.content["command"]}\nstatus: {status}\nmessage: {message}\nreturnCode: {return_code}\nUnexpected Error: {traceback.format_exc()}')
-
-            self.logger.info(f"Status: {status}, TaskId: {task.id}, ThreadName: {threading.current_thread().name}, ThreadId: {threading.current_thread().ident} finished.")
+        The chunk scheduler runs one batch at a time and waits for all of it to finish.
+        The stream scheduler keeps max_workers commands in flight, refills a slot as soon
+        as a command finishes and claims the next batch in the background.
+        The async engine runs the commands as asyncio subprocesses from a single thread,
+        max_workers is then the number of concurrent commands (hundreds are fine) and
+        the scheduler argument is ignored, it always streams.
+
+        Tasks are run highest "priority" key first ({"command": [...], "priority": 10}), 0 by default.
+        With several tags, the workers are shared between tags in proportion of their weight
+        and a tag never runs more than its max_concurrency tasks, see configure_tag.
 
+        Tasks with a "depends_on" key ({"command": [...], "depends_on": [12, "list"]}) are WAITING
+        until their parent tasks, and every task of their parent tags, completed OK. The run claims
+        them as soon as they are released and only stops once no waiting task has a running parent.
+
+        NEW and RE_PROCESS tasks are run. A failed task to retry goes back to RE_PROCESS and is
+        not claimed before its backoff is over, the stream scheduler and the async engine wait
+        for pending retries before finishing, the chunk scheduler leaves them for the next run.
+
+        With cache_ttl, tasks with the same content (whatever their tag, priority or timeout) run
+        once: a later one completes at once with a log marked "cacheHit" and the id of the task
+        that ran, identical commands running at the same time wait for the first one.
+        {"command": [...], "cache": false} opts a task out.
+
+        With adaptive, the commands in flight start at min_workers and grow while commands succeed,
+        doubling until the first sign of throttling then by one per round, and are halved on a
+        failed, timed out or slow command (AIMD, as TCP congestion control). rate caps the
+        starts per second of each tag on top of it, with a token bucket.
+
+        With coalesce, each worker thread sends its commands to a bash co-process of its own, which
+        forks them as jobs with their output redirected to files, instead of spawning a process from
+        Python for every command. For tags of many millisecond commands it halves the overhead per
+        task, every task still gets its own stdout, stderr, return code and task log row.
+        A missing command then ends with return code 127 rather than a Python error.
+
+        A task {"callable": "package.module:function", "args": [...], "kwargs": {...}} calls that
+        function instead of running a command, on a pool of warm Python processes (or threads) started
+        at the first such task and kept for the whole run, so an import or a model loaded at module
+        level is paid once per pool process. Its JSON serializable return value is kept in the task log
+        with what it printed, an exception ends it as COMPLETED_ERROR with its traceback.
+        """
         self.__log_start()
         self.__get_executor()
 
         # Show progress bar
-        total_tasks = len(self.executor.get_task_by_tag_and_status(tag, Status.NEW))
-        
-        # Execute the task in Get the first batch woth 2 tasks (batch_size) in status NEW
-        tasks = self.executor.get_next_batch(tag, Status.NEW, batch_size=batch_size)
+        tags = self.__tags(tag)
+        total_tasks = self.__count_claimable(tags, waiting=True)
 
-        # Run 2 x tasks in paralell (max_workers) until there are no more tasks with status NEW
+        self.__start_run(max_output_bytes, spill_dir, timeout, kill_grace,
+                         RetryPolicy(max_attempts, backoff, backoff_max, retry_on=self.__codes(retry_on), retry_timeouts=retry_timeouts),
+                         cache_ttl, cache_max_bytes, callable_pool, callable_workers)
+        self.__start_throttling(rate, burst, max_workers if adaptive else None, min_workers, throttle_on, throttle_stderr,
+                                latency_target)
+        claimer = FairShareClaimer(self.executor, tags=tags, statuses=TaskWorker.CLAIM_STATUSES,
+                                   claim_tag=lambda tag, size: self.executor.get_next_batch(
+                                       tag, TaskWorker.CLAIM_STATUSES, batch_size=size, worker_id=self.worker_id))
+        claim = self.__measured(claimer.claim, max_workers)
+        idle = lambda: self.__wait_for_retries(claimer) or self.__wait_for_dependencies(tags) or claimer.wait()
+        try:
+            self.__start_metrics(metrics_port, metrics_file, metrics_interval)
+            if coalesce:
+                if engine != "thread":
+                    raise ValueError("coalesce runs with the thread engine only")
+                self.shell_pool = ShellPool()
+            if engine == "async":
+                self.__run_async(claim, batch_size, max_workers, total_tasks, idle)
+            elif engine != "thread":
+                raise ValueError(f"unknown engine: {engine}, use either thread or async")
+            elif scheduler == "stream":
+                self.__run_stream(claim, batch_size, max_workers, total_tasks, idle)
+            elif scheduler == "chunk":
+                self.__run_chunks(claim, batch_size, max_workers, total_tasks, lambda: self.__wait_for_dependencies(tags))
+            else:
+                raise ValueError(f"unknown scheduler: {scheduler}, use either chunk or stream")
+        finally:
+            self.__close_shell_pool()
+            self.__close_callables()
+            # Commit every pending task completion before leaving
+            self.writer.close()
+            self.__close_cache()
+            self.__stop_metrics()
+
+        self.__log_end()
 
-        for chunk in tqdm(range(0, total_tasks, batch_size), desc="Task Chunks"):
-            if tasks == []:
-                break
-            self.logger.info(f"Processing chunk {chunk}")
-            with ThreadPoolExecutor(max_workers=max_workers) as thread_executor:
-                thread_list = [ thread_executor.submit(run_task, task) for task in tasks ]
-                wait(thread_list, return_when=ALL_COMPLETED)
+    def run_worker(self, tag, batch_size, max_workers, engine="thread", lease_seconds=60,
+                   max_output_bytes=1048576, spill_dir=None, timeout=None, kill_grace=5,
+                   max_attempts=1, backoff=1.0, backoff_max=300, retry_on=None, retry_timeouts=False,
+                   cache_ttl=None, cache_max_bytes=104857600, metrics_port=None, metrics_file=None, metrics_interval=15,
+                   rate=None, burst=None, adaptive=False, min_workers=1, throttle_on=None, throttle_stderr=None,
+                   latency_target=None, callable_pool="process", callable_workers=None):
+        """
+        Run commands as one of many workers sharing the database, on this host or others.
+        Example Argument:
+            tag = 'sandpit', several tags 'urgent,backfill' or every tag '*'
+            batch_size = '10'
+            max_workers = '8'
+            engine = 'thread' (default) or 'async'
+            lease_seconds = '60'
+            max_output_bytes, spill_dir, timeout, kill_grace, the retry, cache, metrics, throttling and callable arguments as in run_command
 
-            # Get the fisrt 2 tasks with status NEW     
-            tasks = self.executor.get_next_batch(tag, Status.NEW, batch_size=batch_size)
+        The worker registers itself in the workers table and claims NEW and RE_PROCESS tasks
+        with a lease of lease_seconds, renewed by a heartbeat. When a worker dies its leases
+        expire and the other workers give its tasks back to the queue as RE_PROCESS.
+        Start as many as needed, e.g. one per core:
+            for i in $(seq 4); do python -m task_executor.shell_executor run_worker sandpit 10 8 & done
+        """
+        self.__log_start()
+        self.__get_executor()
+
+        tags = self.__tags(tag)
+        total_tasks = self.__count_claimable(tags, waiting=True)
+
+        self.__start_run(max_output_bytes, spill_dir, timeout, kill_grace,
+                         RetryPolicy(max_attempts, backoff, backoff_max, retry_on=self.__codes(retry_on), retry_timeouts=retry_timeouts),
+                         cache_ttl, cache_max_bytes, callable_pool, callable_workers)
+        self.__start_throttling(rate, burst, max_workers if adaptive else None, min_workers, throttle_on, throttle_stderr,
+                                latency_target)
+        try:
+            with TaskWorker(self.executor, lease_seconds=lease_seconds) as worker:
+                print(f"Worker {worker.worker_id}")
+                self.worker_id = worker.worker_id
+                claimer = FairShareClaimer(self.executor, tags=tags, statuses=TaskWorker.CLAIM_STATUSES,
+                                           claim_tag=lambda tag, size: worker.claim(tag, batch_size=size))
+                claim = self.__measured(claimer.claim, max_workers)
+                idle = lambda: self.__wait_for_retries(claimer) or self.__wait_for_dependencies(tags) or claimer.wait()
+                self.__start_metrics(metrics_port, metrics_file, metrics_interval)
+                if engine == "async":
+                    self.__run_async(claim, batch_size, max_workers, total_tasks, idle)
+                elif engine == "thread":
+                    self.__run_stream(claim, batch_size, max_workers, total_tasks, idle)
+                else:
+                    raise ValueError(f"unknown engine: {engine}, use either thread or async")
+                # Completions must be committed while the leases are still renewed
+                self.writer.flush()
+        finally:
+            self.__close_callables()
+            self.writer.close()
+            self.__close_cache()
+            self.__stop_metrics()
 
         self.__log_end()
 
+    def configure_tag(self, tag, timeout=None, weight=None, max_concurrency=None, rate=None) -> None:
+        """
+        Set the settings of a tag, used by every run of its tasks. Example Argument:
+            tag = 'sandpit'
+            timeout = '300', seconds before a command of the tag is killed, 0 removes it
+            weight = '3', share of the workers in multi tag runs relative to other tags, default 1
+            max_concurrency = '4', most tasks of the tag running at once across all workers, 0 removes it
+            rate = '5', commands of the tag started per second by each worker, 0 for no limit
+        """
+        self.__get_executor()
+        if weight is not None and float(weight) <= 0:
+            raise ValueError(f"weight must be positive: {weight}")
+        settings = { name: value for name, value in { "timeout": timeout, "weight": weight,
+                                                      "max_concurrency": max_concurrency, "rate": rate }.items() if value is not None }
+        setting = self.executor.set_tag_setting(tag, **settings)
+        print(setting)
+
+    def profile(self, tag=None, top=5, output=None) -> None:
+        """
+        Show where the time of the tasks goes, per tag: p50/p95/p99 and max of each phase
+        (queue wait, claim, pickup wait, spawn, exec, result write) and the slowest tasks.
+        Example Argument:
+            tag = 'sandpit', optional, every tag by default
+            top = '5', number of slowest tasks shown per tag
+            output = './profile.json', optional, also write the profile as JSON
+        """
+        self.__get_executor()
+        profile = TaskProfile(self.executor.get_task_phases(tag), top=top)
+        print(profile.format())
+        if output:
+            with open(output, "w") as f:
+                json.dump(profile.summary(), f, indent=2, default=lambda value: getattr(value, "name", str(value)))
+
+    def status(self, tag=None, windows=WINDOWS, watch=None, output=None) -> None:
+        """
+        Show the tasks of each tag per status, the task logs committed per second over recent
+        windows and the ETA. Aggregate queries only, safe to run while workers are busy.
+        Example Argument:
+            tag = 'sandpit', optional, every tag by default
+            windows = '60,300,900', throughput windows in seconds
+            watch = '5', optional, refresh every 5 seconds until Ctrl-C
+            output = './status.json', optional, also write the stats as JSON
+        """
+        self.__get_executor()
+        try:
+            while True:
+                stats = TaskStats.collect(self.executor, tag=tag, windows=windows)
+                if watch:
+                    # Clear the terminal and redraw in place
+                    print(f"\033[2J\033[H{datetime.datetime.now():%Y-%m-%d %H:%M:%S}")
+                print(stats.format(), flush=True)
+                if output:
+                    with open(output, "w") as f:
+                        json.dump(stats.summary(), f, indent=2)
+                if not watch:
+                    return
+                time.sleep(float(watch))
+        except KeyboardInterrupt:
+            pass
+
+    def cache_stats(self) -> None:
+        """
+        Show the number of cached results, their size in bytes and how many times they were reused.
+        """
+        self.__get_executor()
+        print(self.executor.cache_summary())
+
+    def __start_run(self, max_output_bytes, spill_dir, timeout, kill_grace, retry_policy, cache_ttl=None,
+                    cache_max_bytes=104857600, callable_pool="process", callable_workers=None) -> None:
+        self.output_policy = OutputPolicy(max_bytes=max_output_bytes, spill_dir=spill_dir)
+        self.retry_policy = retry_policy
+        self.cache = ResultCache(self.executor, ttl=cache_ttl, max_bytes=cache_max_bytes) if cache_ttl else None
+        self.timeout_policy = TimeoutPolicy(timeout=timeout, kill_grace=kill_grace, tag_timeout=self.__tag_timeout)
+        # The pool only starts with the first callable task
+        self.callables = CallableRunner(pool=callable_pool, max_workers=callable_workers)
+        self.metrics = Metrics()
+        self.writer = ResultWriter(self.executor, metrics=self.metrics)
+        self.writer.start()
+
+    def __start_throttling(self, rate, burst, max_workers, min_workers, throttle_on, throttle_stderr, latency_target) -> None:
+        """Rate limit per tag, and adaptive concurrency when max_workers is given."""
+        self.rate_limiter = RateLimiter(rate=rate, burst=burst, tag_rate=self.__tag_rate)
+        self.concurrency_controller = None
+        if max_workers is not None:
+            self.concurrency_controller = AimdController(
+                max_limit=int(max_workers), min_limit=int(min_workers), codes=self.__codes(throttle_on),
+                stderr_patterns=[str(throttle_stderr)] if throttle_stderr else (), latency_target=latency_target)
+
+    def __measured(self, claim, max_workers):
+        self.metrics.capacity.set(int(max_workers))
+        return self.metrics.timed_claim(claim)
+
+    def __start_metrics(self, port, snapshot_file, interval) -> None:
+        if port is None and snapshot_file is None:
+            return
+        self.reporter = MetricsReporter(self.metrics, self.executor, port=port, snapshot_file=snapshot_file, interval=interval)
+        self.reporter.start()
+        if port is not None:
+            print(f"Metrics on http://{self.reporter.host}:{self.reporter.port}/metrics")
+
+    def __stop_metrics(self) -> None:
+        if self.reporter is not None:
+            self.reporter.stop()
+            self.reporter = None
+
+    def __close_shell_pool(self) -> None:
+        if self.shell_pool is not None:
+            self.shell_pool.close()
+            self.shell_pool = None
+
+    def __close_callables(self) -> None:
+        if self.callables is not None:
+            self.callables.close()
+            self.callables = None
+
+    def __close_cache(self) -> None:
+        if self.cache is not None:
+            self.cache.close()
+            print(f"Result cache hits: {self.cache.hits}, misses: {self.cache.misses}")
+
+    def __complete(self, completion: Completion) -> None:
+        # worker_id is the claim's, see Completion.track
+        completion.hostname = HOSTNAME
+        self.metrics.task_completed(completion)
+        completion.retry_at = self.retry_policy.retry_at(completion.attempts or 1, completion.status, completion.return_code)
+        if completion.retry_at is not None:
+            self.logger.info(f"TaskId: {completion.task_id} attempt {completion.attempts} {completion.status}, retry in {completion.retry_at - time.time():.1f}s")
+        # Status update and task log are committed together by the result writer
+        self.writer.submit(completion)
+
+    def __wait_for_retries(self, claimer) -> bool:
+        """Sleep until the next retry of the claimer's tags is due, False when no task waits for a retry."""
+        if self.retry_policy.max_attempts <= 1:
+            return False
+        self.writer.flush()
+        retry_times = [ retry_at for retry_at in (self.executor.next_retry_at(tag) for tag in claimer.tags) if retry_at is not None ]
+        if not retry_times:
+            return False
+        delay = min(retry_times) - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        elif not claimer.wait():
+            # Due, yet the last claim came back empty and no fair-share cap holds it: it just became due
+            time.sleep(0.1)
+        return True
+
+    @staticmethod
+    def __codes(codes):
+        if codes is None or isinstance(codes, int):
+            return codes if codes is None else [codes]
+        if isinstance(codes, str):
+            return [ int(code) for code in codes.split(",") if code ]
+        return [ int(code) for code in codes ]
+
+    @staticmethod
+    def __names(names):
+        if isinstance(names, (list, tuple)):
+            return [ str(name) for name in names ]
+        return [ name for name in str(names).split(",") if name ]
+
+    @staticmethod
+    def __tags(tag):
+        """Tags of a run, None for every tag ('*')."""
+        if isinstance(tag, (list, tuple)):
+            return [ str(t) for t in tag ]
+        if tag == "*":
+            return None
+        return [ t for t in str(tag).split(",") if t ]
+
+    def __count_claimable(self, tags, waiting=False) -> int:
+        """Tasks of tags to claim now, with waiting also the ones waiting for their dependencies."""
+        counts = self.executor.count_tasks_by_tag(TaskWorker.CLAIM_STATUSES + ([Status.WAITING] if waiting else []))
+        return sum(counts.values()) if tags is None else sum(counts.get(tag, 0) for tag in tags)
+
+    def __wait_for_dependencies(self, tags) -> bool:
+        """Commit the finished tasks, which releases their dependents, False when no task of tags waits for its parents."""
+        waiting = self.executor.count_tasks_by_tag(Status.WAITING)
+        if not (sum(waiting.values()) if tags is None else sum(waiting.get(tag, 0) for tag in tags)):
+            return False
+        self.writer.flush()
+        if self.__count_claimable(tags):
+            return True
+        if self.executor.count_pending_parents(tags):
+            # Parents running on other workers, or still to run there
+            time.sleep(1)
+            return True
+        self.logger.warning(f"Tasks waiting for parents nobody runs: {waiting}")
+        return False
+
+    def __tag_timeout(self, tag):
+        setting = self.executor.get_tag_setting(tag)
+        return setting.timeout if setting else None
+
+    def __tag_rate(self, tag):
+        setting = self.executor.get_tag_setting(tag)
+        return setting.rate if setting else None
+
+    def __run_stream(self, claim, batch_size, max_workers, total_tasks, idle=None):
+        with tqdm(total=total_tasks, desc="Tasks") as progress:
+            StreamingScheduler(claim=claim, run_task=self.__run_task, batch_size=batch_size,
+                               max_workers=max_workers, progress=progress, idle=idle).run()
+
+    def __run_async(self, claim, batch_size, max_workers, total_tasks, idle=None):
+        with tqdm(total=total_tasks, desc="Tasks") as progress:
+            AsyncEngine(claim=claim, complete=self.__complete, batch_size=batch_size,
+                        concurrency=max_workers, progress=progress, output_policy=self.output_policy,
+                        timeout_policy=self.timeout_policy, idle=idle, cache=self.cache, metrics=self.metrics,
+                        rate_limiter=self.rate_limiter, concurrency_controller=self.concurrency_controller,
+                        callables=self.callables).run()
+
+    def __run_chunks(self, claim, batch_size, max_workers, total_tasks, released=None):
+        # Execute the task in Get the first batch woth 2 tasks (batch_size) in status NEW
+        tasks = claim(batch_size)
+
+        # Run 2 x tasks in paralell (max_workers) until there are no more tasks with status NEW
+        with tqdm(total=-(-total_tasks // batch_size), desc="Task Chunks") as progress:
+            chunk = 0
+            while tasks != []:
+                self.logger.info(f"Processing chunk {chunk}")
+                with ThreadPoolExecutor(max_workers=max_workers) as thread_executor:
+                    thread_list = [ thread_executor.submit(self.__run_task, task) for task in tasks ]
+                    wait(thread_list, return_when=ALL_COMPLETED)
+                progress.update(1)
+                chunk += batch_size
+
+                # Get the fisrt 2 tasks with status NEW, or the dependents released by this chunk
+                tasks = claim(batch_size)
+                while tasks == [] and released is not None and released():
+                    tasks = claim(batch_size)
+
 if __name__ == "__main__":
     fire.Fire(ShellExecutor)
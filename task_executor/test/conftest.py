@@ -0,0 +1,14 @@
+from pytest import fixture
+from task_executor.executor import Executor
+
+@fixture
+def executor_codec():
+    """Codec of the executor fixture, json by default, a test module needing another one overrides it."""
+    return None
+
+@fixture
+def executor(tmp_path, executor_codec) -> Executor:
+    """Executor on a new, empty database of its own, test modules seed it by overriding executor(executor)."""
+    executor: Executor = Executor(db_file_full_path=str(tmp_path / "executor.sqlite"), codec=executor_codec)
+    executor.create_db()
+    return executor
@@ -0,0 +1,41 @@
+import threading
+import time
+from task_executor.async_engine import AsyncEngine
+from task_executor.model.orm import Status
+
+
+class FakeTask:
+    def __init__(self, id, command):
+        self.id = id
+        self.content = { "command": command }
+        self.attempts = 1
+
+class FakeQueue:
+    def __init__(self, commands):
+        self.tasks = [ FakeTask(id, command) for id, command in enumerate(commands) ]
+        self.lock = threading.Lock()
+
+    def claim(self, batch_size):
+        with self.lock:
+            batch, self.tasks = self.tasks[:batch_size], self.tasks[batch_size:]
+            return batch
+
+def test_async_engine_records_output_and_return_code():
+    queue = FakeQueue([ ["echo", "0"], ["cmd-not-exist", "1"], ["bash", "-c", "echo err >&2; exit 3"] ])
+    completions = {}
+    finished = AsyncEngine(claim=queue.claim, complete=lambda c: completions.update({ c.task_id: c }),
+                           batch_size=2, concurrency=2).run()
+    assert finished == 3
+    assert completions[0].status == Status.COMPLETED_OK
+    assert completions[0].message == { "stdout": "0\n", "stderr": "", "returnCode": 0 }
+    assert completions[1].status == Status.COMPLETED_ERROR
+    assert completions[1].message["returnCode"] == 1
+    assert completions[2].message == { "stdout": "", "stderr": "err\n", "returnCode": 3 }
+
+def test_async_engine_runs_commands_concurrently():
+    queue = FakeQueue([ ["sleep", "0.5"] ] * 40)
+    completions = []
+    start = time.monotonic()
+    AsyncEngine(claim=queue.claim, complete=completions.append, batch_size=10, concurrency=40).run()
+    assert len(completions) == 40
+    assert time.monotonic() - start < 3
@@ -0,0 +1,238 @@
+import datetime
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pytest import fixture, raises
+from task_executor.exceptions import TaskError
+from task_executor.executor import Executor
+from task_executor.model.backend import BACKENDS
+from task_executor.model.orm import Status, Task
+from task_executor.model.sharded_backend import ShardedBackend
+from task_executor.result_writer import Completion
+
+# Conformance suite: every storage backend passes every test of this file
+
+@fixture(params=BACKENDS)
+def executor(request, tmp_path) -> Executor:
+    executor: Executor = Executor(db_file_full_path=str(tmp_path / "backend.sqlite"), backend=request.param, shards=3)
+    executor.create_db()
+    return executor
+
+def contents(count, **kwargs):
+    return [ dict({ "command": ["echo", str(i)] }, **kwargs) for i in range(count) ]
+
+def complete(executor, tasks, status=Status.COMPLETED_OK, retry_at=None):
+    executor.complete_tasks([ Completion(task.id, status, { "returnCode": 0 }, retry_at=retry_at) for task in tasks ])
+
+def test_add_and_get_tasks(executor):
+    first = executor.add_task("a", "{ 'command': 'some command'}")
+    second = executor.add_task("a", { "command": ["true"] })
+    executor.add_multi_task("b", [ "{ 'command': 'x'}" ] * 2)
+    assert executor.insert_tasks("b", contents(3)) == 3
+    assert executor.get_task_by_id(first).content == { "command": "some command" }
+    assert [ task.id for task in executor.get_task_by_tag("a") ] == [first, second]
+    assert len(executor.get_task_by_tag_and_status("b", Status.NEW)) == 5
+    assert executor.get_task_by_id(first + second + 1000) is None
+    assert executor.get_task_by_tag("missing") == []
+    with raises(TaskError):
+        executor.add_task("a", "not a content")
+
+def test_claims_follow_priority_then_id(executor):
+    executor.insert_tasks("t", contents(3) + contents(2, priority=5))
+    ids = [ task.id for task in executor.iter_tasks(tag="t") ]
+    claimed = executor.get_next_batch("t", Status.NEW, batch_size=3, worker_id="w", lease_seconds=60)
+    assert [ task.id for task in claimed ] == ids[3:] + ids[:1]
+    assert all(task.status == Status.IN_PROGRESS and task.attempts == 1 and task.worker_id == "w" for task in claimed)
+    assert all(task.lease_expires_at > time.time() and task.claim_duration >= 0 for task in claimed)
+    assert executor.count_tasks_by_tag(Status.NEW) == { "t": 2 }
+    assert executor.count_tasks_by_tag([Status.NEW, Status.IN_PROGRESS]) == { "t": 5 }
+
+def test_concurrent_claims_do_not_overlap(executor):
+    executor.insert_tasks("t", contents(40))
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [ pool.submit(executor.get_next_batch, "t", Status.NEW, 3) for _ in range(20) ]
+    claimed = [ task.id for future in futures for task in future.result() ]
+    assert sorted(claimed) == sorted(task.id for task in executor.iter_tasks(tag="t"))
+
+def test_retries_wait_for_not_before(executor):
+    executor.insert_tasks("t", contents(2))
+    tasks = executor.get_next_batch("t", Status.NEW, batch_size=2)
+    retry_at = time.time() + 60
+    complete(executor, tasks[:1], status=Status.COMPLETED_ERROR, retry_at=retry_at)
+    complete(executor, tasks[1:], status=Status.COMPLETED_ERROR, retry_at=0)
+    assert executor.next_retry_at("t") == 0
+    assert [ task.id for task in executor.get_next_batch("t", [Status.NEW, Status.RE_PROCESS], batch_size=5) ] == [tasks[1].id]
+    assert executor.next_retry_at("t") == retry_at
+    assert executor.next_retry_at("other") is None
+    assert executor.get_task_by_id(tasks[0].id).attempts == 1
+
+def test_completions_latest_logs_and_counts(executor):
+    executor.insert_tasks("a", contents(3))
+    executor.insert_tasks("b", contents(1))
+    tasks = executor.get_next_batch("a", Status.NEW, batch_size=2)
+    complete(executor, tasks[:1])
+    complete(executor, tasks[1:], status=Status.COMPLETED_ERROR)
+    streamed = { task.id: task for task in executor.iter_tasks(batch_size=2) }
+    assert len(streamed) == 4 and list(streamed) == sorted(streamed)
+    assert streamed[tasks[0].id].latest_log.task_id == tasks[0].id
+    assert json.loads(streamed[tasks[0].id].latest_log.message) == { "returnCode": 0 }
+    assert streamed[tasks[1].id].latest_log.status == Status.COMPLETED_ERROR
+    assert sorted(task.tag for task in streamed.values() if task.latest_log is None) == ["a", "b"]
+    assert [ task.id for task in executor.iter_tasks(status=[Status.COMPLETED_OK, Status.COMPLETED_ERROR]) ] == \
+        [ task.id for task in tasks ]
+    assert executor.count_tasks_by_tag_and_status() == [
+        ("a", Status.NEW, 1), ("a", Status.COMPLETED_ERROR, 1), ("a", Status.COMPLETED_OK, 1), ("b", Status.NEW, 1) ]
+    assert executor.count_completions_by_tag([60, 3600]) == { "a": [2, 2] }
+    assert executor.get_claimable_tags(Status.NEW) == ["a", "b"]
+    phases = executor.get_task_phases(tag="a")
+    assert [ phase["task_id"] for phase in phases ] == [ task.id for task in tasks ]
+    assert all(phase["tag"] == "a" and phase["write_wait"] is not None for phase in phases)
+
+def test_update_task_and_task_logs(executor):
+    task_id = executor.add_task("a", { "command": ["true"] })
+    task = executor.get_task_by_id(task_id)
+    executor.update_task(task, status=Status.RE_PROCESS)
+    executor.add_task_log(task=task, message={ "note": 1 }, status=Status.RE_PROCESS, created_at=None, updated_at=None)
+    task = executor.get_task_by_id(task_id)
+    assert task.status == Status.RE_PROCESS
+    assert [ json.loads(log.message) for log in task.task_logs ] == [ { "note": 1 } ]
+    assert [ task.id for task in executor.get_next_batch("a", Status.RE_PROCESS) ] == [task_id]
+    with raises(TaskError):
+        executor.update_task(Task(id=task_id + 1000), status=Status.NEW)
+
+def test_remove_task_removes_only_that_task(executor):
+    first, second = executor.add_task("a", { "command": ["true"] }), executor.add_task("a", { "command": ["true"] })
+    executor.add_task_log(task=executor.get_task_by_id(first), message={}, status=Status.NEW, created_at=None, updated_at=None)
+    executor.remove_task(executor.get_task_by_id(first))
+    assert executor.get_task_by_id(first) is None
+    assert [ task.id for task in executor.iter_tasks() ] == [second]
+
+def test_expired_tasks_and_delete(executor):
+    executor.insert_tasks("a", contents(3))
+    parent, pending = executor.add_task("b", { "command": ["true"] }), executor.add_task("b", { "command": ["true"] })
+    executor.add_task("b", { "command": ["true"], "depends_on": [parent, pending] })
+    claimed = executor.get_next_batch("a", Status.NEW, batch_size=2) + executor.get_next_batch("b", Status.NEW)
+    complete(executor, claimed[:1])
+    complete(executor, claimed[1:2], status=Status.COMPLETED_ERROR, retry_at=0)
+    complete(executor, executor.get_next_batch("a", Status.RE_PROCESS), status=Status.COMPLETED_ERROR)
+    complete(executor, claimed[2:])
+    time.sleep(0.01)
+    expired = executor.get_expired_tasks(datetime.datetime.now())
+    # The parent of the WAITING task stays
+    assert [ task.id for task in expired ] == [ task.id for task in claimed[:2] ]
+    assert [ len(task.logs) for task in expired ] == [1, 2]
+    assert all(log.task_id == task.id for task in expired for log in task.logs)
+    assert executor.get_expired_tasks(datetime.datetime.now() - datetime.timedelta(hours=1)) == []
+    assert [ task.id for task in executor.get_expired_tasks(datetime.datetime.now(), limit=1) ] == [claimed[0].id]
+    assert executor.delete_tasks([ task.id for task in expired ]) == 2
+    assert executor.get_expired_tasks(datetime.datetime.now()) == []
+    assert executor.count_tasks_by_tag_and_status(tag="a") == [("a", Status.NEW, 1)]
+    assert executor.count_completions_by_tag([3600], tag="a") == {}
+    assert executor.compact() >= 0
+
+def test_leases_and_workers(executor):
+    executor.insert_tasks("a", contents(2))
+    executor.register_worker("w1", "host", 1)
+    executor.register_worker("w2", "host", 2)
+    executor.get_next_batch("a", Status.NEW, worker_id="w1", lease_seconds=60)
+    executor.get_next_batch("a", Status.NEW, worker_id="w2", lease_seconds=-1)
+    assert executor.renew_leases("w1", 60) == 1
+    assert executor.reclaim_expired_leases() == 1
+    assert executor.count_tasks_by_tag(Status.RE_PROCESS) == { "a": 1 }
+    executor.deregister_worker("w1")
+    assert [ (worker.id, worker.status) for worker in executor.get_workers() ] == [("w1", "stopped"), ("w2", "active")]
+
+def test_late_completion_of_a_reclaimed_task_is_dropped(executor):
+    executor.insert_tasks("a", contents(2))
+    late = executor.get_next_batch("a", Status.NEW, worker_id="A", lease_seconds=-1)[0]
+    assert executor.reclaim_expired_leases() == 1
+    task = executor.get_next_batch("a", Status.RE_PROCESS, worker_id="B", lease_seconds=60)[0]
+    other = executor.get_next_batch("a", Status.NEW, worker_id="B", lease_seconds=60)[0]
+    executor.complete_tasks([ Completion(late.id, Status.COMPLETED_ERROR, { "returnCode": 1 }).track(late),
+                              Completion(other.id, Status.COMPLETED_OK, { "returnCode": 0 }).track(other) ])
+    reclaimed = executor.get_task_by_id(task.id)
+    assert (reclaimed.status, reclaimed.worker_id, reclaimed.task_logs) == (Status.IN_PROGRESS, "B", [])
+    assert executor.get_task_by_id(other.id).status == Status.COMPLETED_OK
+    # The same completion twice in one batch is written once
+    executor.complete_tasks([ Completion(task.id, Status.COMPLETED_OK, { "returnCode": 0 }).track(task) ] * 2)
+    assert [ log.status for log in executor.get_task_by_id(task.id).task_logs ] == [Status.COMPLETED_OK]
+
+def test_tag_settings(executor):
+    executor.set_tag_setting("a", rate=5.0)
+    executor.set_tag_setting("a", max_concurrency=2)
+    setting = executor.get_tag_setting("a")
+    assert (setting.rate, setting.max_concurrency, setting.timeout) == (5.0, 2, None)
+    assert executor.get_tag_setting("b") is None
+    assert [ setting.tag for setting in executor.get_tag_settings() ] == ["a"]
+    with raises(TaskError):
+        executor.set_tag_setting("a", unknown=1)
+
+def test_result_cache(executor):
+    executor.put_cached_result("k1", 1, { "stdout": "x" }, return_code=0, duration=0.1)
+    executor.put_cached_result("k2", 2, { "stdout": "yy" }, return_code=0, duration=0.1)
+    cached = executor.get_cached_result("k1")
+    assert (cached.task_id, json.loads(cached.message)) == (1, { "stdout": "x" })
+    assert executor.get_cached_result("k1", min_created_at=time.time() + 60) is None
+    executor.record_cache_hits({ "k1": 3 })
+    assert executor.cache_summary()["hits"] == 3 and executor.cache_summary()["entries"] == 2
+    assert executor.evict_cached_results(max_bytes=len(cached.message)) == 1
+    assert executor.get_cached_result("k2") is None
+
+def test_dependencies(executor):
+    ok, bad = executor.add_task("list", { "command": ["true"] }), executor.add_task("list", { "command": ["false"] })
+    released = executor.add_task("list", { "command": ["true"], "depends_on": [ok] })
+    failed = executor.add_task("list", { "command": ["true"], "depends_on": [bad] })
+    chained = executor.add_task("list", { "command": ["true"], "depends_on": [failed] })
+    assert executor.get_task_by_id(released).status == Status.WAITING
+    claimed = executor.get_next_batch("list", Status.NEW, batch_size=10)
+    assert [ task.id for task in claimed ] == [ok, bad]
+    complete(executor, claimed[:1])
+    complete(executor, claimed[1:], status=Status.COMPLETED_ERROR)
+    assert [ executor.get_task_by_id(id).status for id in (released, failed, chained) ] == \
+        [Status.NEW, Status.UPSTREAM_FAILED, Status.UPSTREAM_FAILED]
+    log = executor.get_task_by_id(chained).task_logs[-1]
+    assert json.loads(log.message) == { "error": f"task {failed} failed", "upstream": f"task {failed}" }
+    with raises(TaskError):
+        executor.add_task("list", { "command": ["true"], "depends_on": "list" })
+
+def test_dependency_cycles_are_rejected(executor):
+    # Tags of one shard: dependencies never cross shards
+    executor.add_task("c", { "command": ["true"], "depends_on": "a" })
+    with raises(TaskError):
+        executor.add_task("a", { "command": ["true"], "depends_on": "c" })
+    waiting = executor.add_task("d", { "command": ["true"], "depends_on": "c" })
+    with raises(TaskError):
+        executor.insert_tasks("a", contents(1, depends_on=["d"]))
+    with raises(TaskError):
+        executor.add_task("a", { "command": ["true"], "depends_on": [waiting] })
+    assert executor.get_task_by_tag("a") == []
+    executor.add_task("w", { "command": ["true"], "depends_on": "d" })
+
+def test_pending_parents_of_waiting_tasks(executor):
+    # Tags of one shard: dependencies never cross shards
+    parent = executor.add_task("list", { "command": ["true"] })
+    executor.add_task("x", { "command": ["true"], "depends_on": [parent, "list"] })
+    executor.insert_tasks("unrelated", contents(2))
+    executor.get_next_batch("unrelated", Status.NEW)
+    assert executor.count_pending_parents() == 2
+    assert executor.count_pending_parents(["x"]) == 2
+    assert executor.count_pending_parents(["unrelated"]) == 0
+    claimed = executor.get_next_batch("list", Status.NEW)
+    assert executor.count_pending_parents(["x"]) == 2
+    complete(executor, claimed, status=Status.COMPLETED_ERROR, retry_at=time.time() + 60)
+    assert executor.count_pending_parents(["x"]) == 2
+    executor.add_task("stuck", { "command": ["true"], "depends_on": ["never"] })
+    assert executor.count_pending_parents(["stuck"]) == 0
+
+def test_sharded_backend_spreads_tags_over_files(tmp_path):
+    backend = ShardedBackend(str(tmp_path / "sharded.sqlite"), shards=2, echo=False, shard_of=lambda tag: int(tag[-1]) % 2)
+    executor = Executor(backend=backend)
+    executor.create_db()
+    first, second = executor.add_task("t0", { "command": ["true"] }), executor.add_task("t1", { "command": ["true"] })
+    assert (first % 2, second % 2) == (0, 1)
+    assert (tmp_path / "sharded.shard1.sqlite").exists()
+    assert [ task.id for task in backend.shards[1].get_task(tag="t1") ] == [second // 2]
+    with raises(TaskError):
+        executor.add_task("t1", { "command": ["true"], "depends_on": [first] })
+    with raises(TaskError):
+        executor.add_task("t1", { "command": ["true"], "depends_on": "t0" })
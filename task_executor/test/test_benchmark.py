@@ -0,0 +1,13 @@
+import json
+from task_executor.benchmark import Benchmark
+
+def test_benchmark_writes_machine_readable_results(tmp_path):
+    output = tmp_path / "bench.json"
+    Benchmark(batch_size=10, single_max=20, run_max=20).run(sizes="50", workers="2", output=str(output))
+    report = json.loads(output.read_text())
+    operations = [ (result["layer"], result["operation"]) for result in report["results"] ]
+    assert operations == [
+        ("enqueue", "add_task"), ("enqueue", "add_multi_task"), ("claim", "get_next_batch[10]"),
+        ("complete", "update_task+add_task_log"), ("complete", "complete_tasks[500]"), ("run", "run_command[stream]") ]
+    assert all(result["tasks"] > 0 and result["tasks_per_sec"] > 0 for result in report["results"])
+    assert report["version"] and "commit" in report and "describe" in report
@@ -0,0 +1,129 @@
+import json
+import os
+import time
+from pytest import fixture, raises
+from task_executor.async_engine import AsyncEngine
+from task_executor.callable_runner import CallableRunner, describe, is_callable_task, resolve
+from task_executor.executor import Executor
+from task_executor.model.orm import Status
+from task_executor.output_capture import OutputPolicy
+from task_executor.result_writer import ResultWriter
+
+MODULE = "task_executor.test.test_callable_runner"
+
+
+def add(a, b=0):
+    print(f"adding {a} and {b}")
+    return a + b
+
+def fail(message):
+    raise RuntimeError(message)
+
+def pid():
+    return os.getpid()
+
+def unserializable():
+    return { 1, 2 }
+
+def crash():
+    os._exit(3)
+
+def nap(seconds):
+    time.sleep(seconds)
+    return seconds
+
+class Greeter:
+    @staticmethod
+    def hello(name):
+        return f"hello {name}"
+
+
+class FakeTask:
+    def __init__(self, id, content):
+        self.id = id
+        self.content = content
+        self.attempts = 1
+
+def task(id, function, *args, **kwargs):
+    return FakeTask(id, { "callable": f"{MODULE}:{function}", "args": list(args), "kwargs": kwargs })
+
+@fixture
+def runner():
+    runner = CallableRunner(pool="thread", max_workers=4)
+    yield runner
+    runner.close()
+
+def test_resolve_and_describe():
+    assert resolve(f"{MODULE}:Greeter.hello")("you") == "hello you"
+    assert is_callable_task({ "callable": "m:f" }) and not is_callable_task({ "command": ["true"] })
+    assert describe({ "callable": "m:f" }) == "callable m:f"
+    with raises(ValueError):
+        resolve("no_function")
+
+def test_result_and_stdout_are_kept(runner):
+    completion = runner.run(task(1, "add", 2, b=3), None, OutputPolicy())
+    assert completion.status == Status.COMPLETED_OK
+    assert completion.message == { "result": 5, "stdout": "adding 2 and 3\n", "stderr": "", "returnCode": 0 }
+    assert completion.stdout_bytes == len("adding 2 and 3\n")
+
+def test_exception_and_unserializable_result(runner):
+    completion = runner.run(task(1, "fail", "boom"), None)
+    assert completion.status == Status.COMPLETED_ERROR and completion.return_code == 1
+    assert completion.message["error"] == "RuntimeError: boom"
+    assert "raise RuntimeError(message)" in completion.message["traceback"]
+    assert runner.run(task(2, "unserializable"), None).message["result"] == "{1, 2}"
+    assert runner.run(task(3, "missing"), None).message["error"].startswith("AttributeError")
+
+def test_timeout(runner):
+    completion = runner.run(task(1, "nap", 2), None, timeout=0.2)
+    assert completion.status == Status.TIMED_OUT and completion.return_code == -1
+
+def test_process_pool_is_reused():
+    runner = CallableRunner(pool="process", max_workers=1)
+    try:
+        pids = { runner.run(task(id, "pid"), None).message["result"] for id in range(3) }
+        assert len(pids) == 1 and os.getpid() not in pids
+        assert runner.run(task(4, "add", 1, b=1), None).message["stdout"] == "adding 1 and 1\n"
+    finally:
+        runner.close()
+
+def test_crashed_process_pool_is_replaced():
+    runner = CallableRunner(pool="process", max_workers=1)
+    try:
+        completion = runner.run(task(1, "crash"), None)
+        assert completion.status == Status.COMPLETED_ERROR and completion.return_code == 1
+        assert completion.message["error"].startswith("BrokenProcessPool")
+        assert runner.run(task(2, "add", 1, b=1), None).message["result"] == 2
+    finally:
+        runner.close()
+
+def test_close_does_not_wait_for_timed_out_calls():
+    runner = CallableRunner(pool="process", max_workers=1)
+    assert runner.run(task(1, "nap", 30), None, timeout=0.5).status == Status.TIMED_OUT
+    start = time.monotonic()
+    runner.close()
+    assert time.monotonic() - start < 5
+
+def test_async_engine_runs_callables(runner):
+    tasks = [ task(id, "nap", 0.3) for id in range(4) ] + [ FakeTask(4, { "command": ["echo", "4"] }) ]
+    completions = {}
+    start = time.monotonic()
+    AsyncEngine(claim=lambda size: [ tasks.pop() for _ in range(min(size, len(tasks))) ],
+                complete=lambda c: completions.update({ c.task_id: c }), batch_size=5, concurrency=5,
+                callables=runner).run()
+    assert time.monotonic() - start < 1
+    assert [ completions[id].message.get("result") for id in range(4) ] == [0.3] * 4
+    assert completions[4].message["stdout"] == "4\n"
+
+def test_callable_task_logs_go_through_the_result_writer(tmp_path, runner):
+    executor = Executor(db_file_full_path=str(tmp_path / "callables.sqlite"))
+    executor.create_db()
+    executor.add_task(tag="py", content={ "callable": f"{MODULE}:add", "args": [20, 22] })
+    claimed = executor.get_next_batch("py", Status.NEW)
+    writer = ResultWriter(executor)
+    writer.start()
+    writer.submit(runner.run(claimed[0], None))
+    writer.close()
+    done = next(executor.iter_tasks(tag="py"))
+    assert done.status == Status.COMPLETED_OK
+    assert json.loads(done.latest_log.message)["result"] == 42
@@ -0,0 +1,61 @@
+import os
+import time
+from pytest import fixture, raises
+from task_executor.coalesce import ShellError, ShellPool, ShellSession
+from task_executor.output_capture import OutputPolicy
+
+@fixture
+def session(tmp_path):
+    session = ShellSession(work_dir=str(tmp_path))
+    yield session
+    session.close()
+
+def test_each_command_keeps_its_own_output_and_return_code(session):
+    first = session.run(["sh", "-c", "echo out; echo err >&2; exit 3"])
+    second = session.run(["echo", "it's", "$HOME"])
+    assert (first.return_code, first.stdout, first.stderr) == (3, "out\n", "err\n")
+    assert (second.return_code, second.stdout, second.stderr) == (0, "it's $HOME\n", "")
+    assert first.spawn_duration <= first.duration
+
+def test_commands_do_not_change_the_session(session):
+    session.run(["cd", "/"])
+    session.run(["exit", "4"])
+    assert session.run(["pwd"]).stdout == f"{os.getcwd()}\n"
+    assert session.alive
+
+def test_missing_command(session):
+    result = session.run(["cmd-not-exist", "2"])
+    assert result.return_code == 127
+    assert "not found" in result.stderr
+
+def test_timeout_kills_only_the_command(session):
+    started = time.monotonic()
+    result = session.run(["sh", "-c", "sleep 30 & sleep 30"], timeout=0.3, kill_grace=1)
+    assert result.timed_out and result.return_code < 0
+    assert time.monotonic() - started < 5
+    assert session.run(["echo", "next"]).stdout == "next\n"
+
+def test_output_policy_bounds_output(session, tmp_path):
+    policy = OutputPolicy(max_bytes=100, spill_dir=str(tmp_path / "spill"))
+    result = session.run(["sh", "-c", "head -c 10000 /dev/zero | tr '\\0' x"], policy, task_id=7)
+    assert result.stdout_bytes == 10000 and result.stdout_path is not None
+    assert os.listdir(session.work_dir) == []
+
+def test_pool_reuses_and_replaces_sessions(tmp_path):
+    pool = ShellPool(work_dir=str(tmp_path), max_commands=3)
+    results = [ pool.run(["echo", str(i)]) for i in range(5) ]
+    assert [ result.stdout for result in results ] == [ f"{i}\n" for i in range(5) ]
+    assert pool.started == 2
+    pool.close()
+
+def test_dead_shell_is_not_reused(tmp_path):
+    pool = ShellPool(work_dir=str(tmp_path))
+    pool.run(["true"])
+    session = pool.idle.get_nowait()
+    session.process.kill()
+    session.process.wait()
+    pool.idle.put(session)
+    with raises(ShellError):
+        pool.run(["true"])
+    assert pool.run(["echo", "again"]).stdout == "again\n"
+    pool.close()
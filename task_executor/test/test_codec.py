@@ -0,0 +1,58 @@
+import sqlite3
+from pytest import fixture, raises
+from task_executor.model import codec
+from task_executor.model.orm import Status
+from task_executor.executor import Executor
+
+TAG = "task-codecTest"
+
+def test_zlib_round_trip():
+    content = {"command": ["echo", "é"], "priority": 2}
+    assert codec.decode(codec.encode(content, "zlib")) == content
+    message = '{"output": "' + "x" * 1000 + '"}'
+    encoded = codec.encode(message, "zlib", text=True)
+    assert isinstance(encoded, bytes) and len(encoded) < len(message)
+    assert codec.decode(encoded, text=True) == message
+
+def test_json_is_left_to_the_column_type():
+    content = {"command": ["echo", "1"]}
+    assert codec.encode(content, "json") is content
+    assert codec.decode('{"command": ["echo", "1"]}') == content
+    assert codec.decode("plain output", text=True) == "plain output"
+
+def test_unknown_codec_is_rejected(tmp_path):
+    with raises(ValueError):
+        codec.check_codec("bzip2")
+    with raises(ValueError):
+        Executor(db_file_full_path=str(tmp_path / "codec.sqlite"), codec="bzip2")
+
+@fixture
+def executor_codec():
+    return "zlib"
+
+def test_compact_rows_read_back_unchanged(executor: Executor):
+    executor.add_task(TAG, "{'command': ['echo', '1'], 'priority': 3}")
+    task = executor.get_next_batch(TAG, Status.NEW)[0]
+    executor.add_task_log(task, message={"output": "1"}, status=Status.COMPLETED_OK, created_at=None, updated_at=None)
+
+    connection = sqlite3.connect(executor.db_file_full_path)
+    types = connection.execute(
+        "SELECT typeof(t.status), typeof(t.created_at), typeof(t.content), typeof(l.message) "
+        "FROM tasks t JOIN task_logs l ON l.task_id = t.id").fetchone()
+    connection.close()
+    assert types == ("integer", "integer", "blob", "blob")
+
+    task = executor.get_task_by_id(task.id)
+    assert task.content == {"command": ["echo", "1"], "priority": 3}
+    assert task.priority == 3
+    assert task.status == Status.IN_PROGRESS
+    assert task.task_logs[0].message == '{"output": "1"}'
+    assert task.task_logs[0].status == Status.COMPLETED_OK
+    assert task.created_at <= task.task_logs[0].created_at
+
+def test_codecs_can_be_mixed(executor: Executor):
+    executor.add_task(TAG, "{'command': ['echo', 'zlib']}")
+    json_executor = Executor(db_file_full_path=executor.db_file_full_path)
+    json_executor.add_task(TAG, "{'command': ['echo', 'json']}")
+    contents = [ task.content["command"][1] for task in json_executor.get_task_by_tag(TAG) ]
+    assert contents == ["zlib", "json"]
@@ -0,0 +1,61 @@
+import json
+from pytest import raises
+from task_executor.exceptions import TaskError
+from task_executor.model.orm import Status
+from task_executor.result_writer import Completion
+
+def statuses(executor, tag):
+    return [ task.status for task in executor.iter_tasks(tag=tag) ]
+
+def run(executor, tag, status=Status.COMPLETED_OK, retry_at=None):
+    """Claim every claimable task of tag and complete them with status."""
+    tasks = executor.get_next_batch(tag, [Status.NEW, Status.RE_PROCESS], batch_size=100)
+    executor.complete_tasks([ Completion(task.id, status, {}, retry_at=retry_at) for task in tasks ])
+    return [ task.id for task in tasks ]
+
+def test_tag_dependency_waits_for_every_task_of_the_tag(executor):
+    executor.insert_tasks("list", [ { "command": ["true"] } ] * 2)
+    executor.insert_tasks("fetch", [ { "command": ["true"], "depends_on": "list" } ] * 3)
+    aggregate = executor.add_task("aggregate", { "command": ["true"], "depends_on": ["fetch"] })
+    assert statuses(executor, "fetch") == [Status.WAITING] * 3
+    assert executor.get_next_batch("fetch", Status.NEW, batch_size=10) == []
+
+    first = executor.get_next_batch("list", Status.NEW)
+    executor.complete_tasks([ Completion(first[0].id, Status.COMPLETED_OK, {}) ])
+    assert statuses(executor, "fetch") == [Status.WAITING] * 3
+    run(executor, "list")
+    assert statuses(executor, "fetch") == [Status.NEW] * 3
+    run(executor, "fetch")
+    assert executor.get_task_by_id(aggregate).status == Status.NEW
+
+def test_failure_goes_down_the_graph(executor):
+    parent = executor.add_task("a", { "command": ["false"] })
+    child = executor.add_task("b", { "command": ["true"], "depends_on": [parent] })
+    grandchild = executor.add_task("c", { "command": ["true"], "depends_on": "b" })
+    other = executor.add_task("d", { "command": ["true"] })
+    run(executor, "a", retry_at=0)
+    assert executor.get_task_by_id(child).status == Status.WAITING
+    run(executor, "a", status=Status.COMPLETED_ERROR)
+    assert executor.get_task_by_id(child).status == Status.UPSTREAM_FAILED
+    assert executor.get_task_by_id(grandchild).status == Status.UPSTREAM_FAILED
+    assert executor.get_task_by_id(other).status == Status.NEW
+    log = next(executor.iter_tasks(tag="c")).latest_log
+    assert log.status == Status.UPSTREAM_FAILED
+    assert json.loads(log.message) == { "error": "tag b failed", "upstream": "tag b" }
+
+def test_completed_parents_release_at_once(executor):
+    parent = executor.add_task("a", { "command": ["true"] })
+    run(executor, "a")
+    assert executor.get_task_by_id(executor.add_task("b", { "command": ["true"], "depends_on": [parent, "a"] })).status == Status.NEW
+    # A tag without tasks is not complete yet
+    assert executor.get_task_by_id(executor.add_task("b", { "command": ["true"], "depends_on": "later" })).status == Status.WAITING
+
+def test_invalid_dependencies(executor):
+    task = executor.add_task("a", { "command": ["true"] })
+    for depends_on in ([task + 1], "a", [1.5]):
+        with raises(TaskError):
+            executor.add_task("a", { "command": ["true"], "depends_on": depends_on })
+    with raises(TaskError):
+        executor.insert_tasks("b", [ { "command": ["true"] }, { "command": ["true"], "depends_on": [task + 1] } ])
+    assert statuses(executor, "a") == [Status.NEW]
+    assert statuses(executor, "b") == []
@@ -169,6 +169,21 @@ def test_get_next_batch_with_status_re_process_found(get_executor):
     assert len(tasks) == 1
     assert tasks[0].status == Status.IN_PROGRESS
 
+def test_get_next_batch_respects_batch_size(create_executor, new_task):
+    executor: Executor = create_executor
+    executor.add_multi_task(tag=TAG, content_list=[new_task[1]] * 5)
+    tasks = executor.get_next_batch(tag=TAG, status=Status.NEW, batch_size=2)
+    assert [task.id for task in tasks] == [1, 2]
+    assert len(executor.get_task_by_tag_and_status(tag=TAG, status=Status.NEW)) == 3
+
+def test_get_next_batch_concurrent_claims_do_not_overlap(create_executor, new_task):
+    executor: Executor = create_executor
+    executor.add_multi_task(tag=TAG, content_list=[new_task[1]] * 40)
+    with ThreadPoolExecutor(max_workers=4) as thread_executor:
+        futures = [ thread_executor.submit(executor.get_next_batch, TAG, Status.NEW, 3) for _ in range(20) ]
+    claimed = [ task.id for future in futures for task in future.result() ]
+    assert sorted(claimed) == list(range(1, 41))
+
 def test_integration_test(create_executor, integration_test_fixture):
     tag, commands, expect_cmd_output = integration_test_fixture
     executor: Executor = create_executor
@@ -219,4 +234,15 @@ def test_integration_test(create_executor, integration_test_fixture):
     tasks = executor.get_task_by_tag(tag=tag)
     for task in tasks:
         output.append(ast.literal_eval(task.task_logs[0].message)["returnCode"])
-    assert expect_cmd_output == output
\ No newline at end of file
+    assert expect_cmd_output == output
+
+def test_storage_profile_applies_pragmas(tmp_path):
+    executor: Executor = Executor(db_file_full_path=str(tmp_path / "profile.sqlite"), storage_profile="throughput")
+    assert executor.engine.pragma("journal_mode") == "wal"
+    assert executor.engine.pragma("synchronous") == 0
+    assert executor.engine.pragma("busy_timeout") == 30000
+    assert executor.engine.pragma("temp_store") == 2
+
+def test_storage_profile_unknown_name_throw_exception(tmp_path):
+    with pytest.raises(ValueError, match=r".*unknown storage profile.*"):
+        Executor(db_file_full_path=str(tmp_path / "profile.sqlite"), storage_profile="fastest")
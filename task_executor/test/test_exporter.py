@@ -0,0 +1,53 @@
+import csv
+import io
+import json
+from pytest import fixture, raises
+from task_executor.executor import Executor
+from task_executor.exporter import COLUMNS, TaskExporter
+from task_executor.model.orm import Status
+from task_executor.result_writer import Completion
+
+TAG = "task-exportTest"
+
+@fixture
+def executor(executor) -> Executor:
+    executor.add_multi_task(tag=TAG, content_list=[ f"{{ 'command': [ 'echo', '{i}' ] }}" for i in range(5) ])
+    executor.add_multi_task(tag="other", content_list=["{ 'command': [ 'echo', 'other' ] }"])
+    tasks = executor.get_next_batch(TAG, Status.NEW, batch_size=3)
+    executor.complete_tasks([ Completion(task.id, Status.COMPLETED_ERROR, { "output": "first" }, return_code=1,
+                                         retry_at=0 if task is tasks[0] else None) for task in tasks ])
+    retried = executor.get_next_batch(TAG, Status.RE_PROCESS)
+    executor.complete_tasks([ Completion(retried[0].id, Status.COMPLETED_OK, { "output": "retried" }, return_code=0) ])
+    return executor
+
+def test_iter_tasks_pages_with_latest_log(executor):
+    tasks = list(executor.iter_tasks(tag=TAG, batch_size=2))
+    assert [ task.id for task in tasks ] == [1, 2, 3, 4, 5]
+    assert json.loads(tasks[0].latest_log.message) == { "output": "retried" }
+    assert tasks[1].latest_log.return_code == 1
+    assert tasks[4].latest_log is None
+
+def test_iter_tasks_by_status(executor):
+    tasks = executor.iter_tasks(status=[Status.NEW], batch_size=1)
+    assert [ (task.id, task.tag) for task in tasks ] == [ (4, TAG), (5, TAG), (6, "other") ]
+
+def test_export_jsonl(executor):
+    output = io.StringIO()
+    assert TaskExporter(executor, tag=TAG, batch_size=2).export_to(output, "jsonl") == 5
+    rows = [ json.loads(line) for line in output.getvalue().splitlines() ]
+    assert rows[0]["content"] == { "command": [ "echo", "0" ] }
+    assert rows[0]["message"] == { "output": "retried" }
+    assert (rows[0]["log_status"], rows[1]["return_code"], rows[4]["log_status"]) == ("COMPLETED_OK", 1, None)
+
+def test_export_csv_file(executor, tmp_path):
+    output = str(tmp_path / "results.csv")
+    assert TaskExporter(executor).export_file(output) == 6
+    with open(output, newline="") as file:
+        rows = list(csv.DictReader(file))
+    assert list(rows[0]) == COLUMNS
+    assert json.loads(rows[0]["content"]) == { "command": [ "echo", "0" ] }
+    assert rows[5]["tag"] == "other" and rows[5]["message"] == ""
+
+def test_unknown_format():
+    with raises(ValueError):
+        TaskExporter.format_of("results.json", "xml")
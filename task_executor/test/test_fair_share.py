@@ -0,0 +1,50 @@
+from pytest import fixture
+from task_executor.executor import Executor
+from task_executor.fair_share import FairShareClaimer
+from task_executor.model.orm import Status
+
+@fixture
+def executor(executor) -> Executor:
+    executor.add_multi_task(tag="backfill", content_list=["{ 'command': [ 'echo', '0' ] }"] * 20)
+    executor.add_multi_task(tag="urgent", content_list=["{ 'command': [ 'echo', '1' ] }"] * 5)
+    return executor
+
+def tags_of(tasks):
+    return sorted(task.tag for task in tasks)
+
+def test_claim_highest_priority_first(executor):
+    executor.add_multi_task(tag="ranked", content_list=[
+        "{ 'command': [ 'echo', 'low' ], 'priority': -1 }",
+        "{ 'command': [ 'echo', 'default' ] }",
+        "{ 'command': [ 'echo', 'high' ], 'priority': 5 }"])
+    tasks = executor.get_next_batch("ranked", [Status.NEW, Status.RE_PROCESS], batch_size=3)
+    assert [ task.content["command"][1] for task in tasks ] == [ "high", "default", "low" ]
+
+def test_slots_are_shared_by_weight(executor):
+    executor.set_tag_setting("backfill", weight=3)
+    claimer = FairShareClaimer(executor, tags=["backfill", "urgent"])
+    assert tags_of(claimer.claim(8)).count("urgent") == 2
+    assert claimer.allocate(4, running={ "backfill": 6 }) == { "backfill": 2, "urgent": 2 }
+
+def test_equal_weights_do_not_starve_small_tags(executor):
+    claimer = FairShareClaimer(executor, tags=["backfill", "urgent"])
+    assert tags_of(claimer.claim(4)) == [ "backfill", "backfill", "urgent", "urgent" ]
+    # running tasks count, the next claim favours the tag with fewer running tasks
+    assert tags_of(claimer.claim(2)) == [ "backfill", "urgent" ]
+
+def test_drained_tag_leaves_its_slots_to_others(executor):
+    claimer = FairShareClaimer(executor, tags=["backfill", "urgent"])
+    assert tags_of(claimer.claim(20)).count("urgent") == 5
+    assert len(claimer.claim(20)) == 5
+
+def test_concurrency_cap_holds_across_claims(executor):
+    executor.set_tag_setting("backfill", max_concurrency=3)
+    claimer = FairShareClaimer(executor, tags=["backfill"])
+    assert len(claimer.claim(10)) == 3
+    assert claimer.claim(10) == []
+    assert claimer.throttled
+
+def test_all_tags(executor):
+    claimer = FairShareClaimer(executor)
+    assert tags_of(claimer.claim(2)) == [ "backfill", "urgent" ]
+    assert claimer.tags == [ "backfill", "urgent" ]
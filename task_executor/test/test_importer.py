@@ -0,0 +1,36 @@
+import io
+from task_executor.importer import TaskImporter
+from task_executor.model.orm import Status
+
+TAG = "task-importTest"
+
+class SpyExecutor:
+    def __init__(self, executor):
+        self.executor = executor
+        self.chunks = []
+
+    def insert_tasks(self, tag, contents):
+        self.chunks.append(len(contents))
+        return self.executor.insert_tasks(tag=tag, contents=contents)
+
+def test_import_lines_in_chunks(executor):
+    spy = SpyExecutor(executor)
+    lines = ( f'{{"command": ["echo", "{i}"]}}\n' for i in range(25) )
+    result = TaskImporter(spy, TAG, commit_size=10).import_lines(lines)
+    assert (result.lines, result.inserted, result.bad) == (25, 25, 0)
+    assert spy.chunks == [10, 10, 5]
+    tasks = executor.get_task_by_tag_and_status(TAG, Status.NEW)
+    assert tasks[24].content == { "command": ["echo", "24"] }
+
+def test_import_reports_bad_lines(executor):
+    lines = io.StringIO('{"command": ["echo", "0"]}\nnot a command\n\n["echo"]\n{ \'command\': [ \'echo\', \'1\' ] }\n')
+    result = TaskImporter(executor, TAG).import_lines(lines)
+    assert (result.lines, result.inserted, result.bad) == (5, 2, 2)
+    assert [ line_number for line_number, _ in result.bad_lines ] == [2, 4]
+
+def test_import_file(executor, tmp_path):
+    command_file = tmp_path / "commands.txt"
+    command_file.write_text('{"command": ["echo", "\\"sometext\\""]}\n')
+    result = TaskImporter(executor, TAG).import_file(str(command_file))
+    assert result.inserted == 1
+    assert executor.get_task_by_id(id=1).content["command"] == ["echo", '"sometext"']
@@ -0,0 +1,42 @@
+import json
+import urllib.request
+from task_executor.metrics import Histogram, Metrics, MetricsReporter
+from task_executor.model.orm import Status
+from task_executor.result_writer import Completion
+
+TAG = "task-metricsTest"
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value)
+    assert dict(histogram.samples()) == {
+        'latency_seconds_bucket{le="0.1"}': 1,
+        'latency_seconds_bucket{le="1"}': 3,
+        'latency_seconds_bucket{le="+Inf"}': 4,
+        "latency_seconds_sum": 6.05,
+        "latency_seconds_count": 4 }
+
+def test_task_metrics():
+    metrics = Metrics()
+    claim = metrics.timed_claim(lambda size: [object()] * size)
+    assert len(claim(3)) == 3
+    metrics.command_started()
+    metrics.command_finished(0.5)
+    metrics.task_completed(Completion(1, Status.COMPLETED_OK, {}, duration=0.5, spawn_duration=0.01))
+    text = metrics.render()
+    assert "task_executor_claimed_total 3" in text
+    assert "task_executor_claim_seconds_count 1" in text
+    assert 'task_executor_tasks_total{status="COMPLETED_OK"} 1' in text
+    assert "task_executor_busy_workers 0" in text
+    assert "task_executor_spawn_seconds_count 1" in text
+
+def test_reporter_serves_prometheus_text_and_writes_snapshot(executor, tmp_path):
+    executor.add_multi_task(tag=TAG, content_list=["{ 'command': [ 'echo', '0' ] }"] * 2)
+    snapshot_file = str(tmp_path / "metrics.json")
+    with MetricsReporter(Metrics(), executor, port=0, snapshot_file=snapshot_file, interval=60) as reporter:
+        text = urllib.request.urlopen(f"http://127.0.0.1:{reporter.port}/metrics").read().decode()
+    assert f'task_executor_queue_depth{{tag="{TAG}",status="NEW"}} 2' in text
+    with open(snapshot_file) as f:
+        snapshot = json.load(f)
+    assert snapshot["metrics"]["task_executor_queue_depth"] == [ { "tag": TAG, "status": "NEW", "value": 2 } ]
@@ -0,0 +1,98 @@
+import json
+import sqlite3
+from pytest import fixture
+from task_executor.model import migration
+from task_executor.model.orm import Status
+from task_executor.executor import Executor
+
+TAG = "task-migrationTest"
+
+@fixture
+def legacy_db_file(tmp_path):
+    # Layout written by create_db before schema versioning existed
+    db_file = str(tmp_path / "legacy.sqlite")
+    connection = sqlite3.connect(db_file)
+    connection.executescript("""
+        CREATE TABLE tasks (
+            id INTEGER NOT NULL, tag VARCHAR NOT NULL, content JSON NOT NULL,
+            status VARCHAR(15) NOT NULL, created_at VARCHAR NOT NULL, updated_at VARCHAR NOT NULL,
+            PRIMARY KEY (id));
+        CREATE TABLE task_logs (
+            id INTEGER NOT NULL, message VARCHAR NOT NULL, status VARCHAR(15) NOT NULL,
+            created_at VARCHAR NOT NULL, updated_at VARCHAR NOT NULL, task_id INTEGER,
+            PRIMARY KEY (id), FOREIGN KEY(task_id) REFERENCES tasks (id));
+        INSERT INTO tasks VALUES (1, 'task-migrationTest', '{"command": ["echo", "0"]}', 'NEW', '2023-10-20 21:04:29', '2023-10-20 21:04:29');
+        INSERT INTO task_logs VALUES (1, '{''returnCode'': 0, ''stdout'': "it''s done", ''stderr'': None}', 'COMPLETED_OK', '2023-10-20 21:04:30', '2023-10-20 21:04:30', 1);
+        INSERT INTO task_logs VALUES (2, '{"returnCode": 1}', 'COMPLETED_ERROR', '2023-10-20 21:04:31', '2023-10-20 21:04:31', 1);
+    """)
+    connection.commit()
+    connection.close()
+    return db_file
+
+def index_names(db_file):
+    connection = sqlite3.connect(db_file)
+    names = [ row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'") ]
+    connection.close()
+    return names
+
+def test_create_db_is_stamped_with_latest_version(tmp_path):
+    executor = Executor(db_file_full_path=str(tmp_path / "new.sqlite"))
+    executor.create_db()
+    assert executor.engine.schema_version() == migration.SCHEMA_VERSION
+    assert executor.migrate_db() == []
+
+def test_migrate_legacy_db_keeps_tasks(legacy_db_file):
+    executor = Executor(db_file_full_path=legacy_db_file)
+    assert executor.engine.schema_version() == 0
+    applied = executor.migrate_db()
+    assert applied == [ version for version, _, _ in migration.MIGRATIONS ]
+    assert executor.engine.schema_version() == migration.SCHEMA_VERSION
+    assert {"ix_tasks_tag_status_priority_id", "ix_task_logs_task_id"} <= set(index_names(legacy_db_file))
+    assert "ix_tasks_tag_status_id" not in index_names(legacy_db_file)
+    tasks = executor.get_next_batch(TAG, Status.NEW, batch_size=10)
+    assert [ task.id for task in tasks ] == [1]
+
+def test_migrate_is_idempotent(legacy_db_file):
+    executor = Executor(db_file_full_path=legacy_db_file)
+    executor.migrate_db()
+    assert executor.migrate_db() == []
+
+def test_incremental_vacuum_is_an_explicit_step(legacy_db_file):
+    executor = Executor(db_file_full_path=legacy_db_file)
+    executor.migrate_db()
+    assert executor.engine.pragma("auto_vacuum") == 0
+    assert executor.engine.compact() == 0
+    assert executor.migrate_db(vacuum=True) == []
+    assert executor.engine.pragma("auto_vacuum") == 2
+    assert executor.get_task_by_id(1).status == Status.NEW
+
+def test_claim_query_uses_tag_status_priority_index(tmp_path):
+    db_file = str(tmp_path / "plan.sqlite")
+    Executor(db_file_full_path=db_file).create_db()
+    connection = sqlite3.connect(db_file)
+    plan = connection.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM tasks WHERE tag = ? AND status = ? ORDER BY priority DESC, id LIMIT 10",
+        (TAG, "NEW")).fetchall()
+    connection.close()
+    assert any("ix_tasks_tag_status_priority_id" in row[-1] for row in plan)
+    assert not any("TEMP B-TREE" in row[-1] for row in plan)
+
+def test_migrate_legacy_db_compacts_rows(legacy_db_file):
+    executor = Executor(db_file_full_path=legacy_db_file)
+    executor.migrate_db()
+    connection = sqlite3.connect(legacy_db_file)
+    row = connection.execute("SELECT typeof(status), status, typeof(created_at) FROM tasks").fetchone()
+    connection.close()
+    assert row == ("integer", 0, "integer")
+    task = executor.get_task_by_id(1)
+    assert task.status == Status.NEW
+    assert str(task.created_at) == "2023-10-20 21:04:29"
+    assert task.content == {"command": ["echo", "0"]}
+
+def test_migrate_legacy_db_rewrites_repr_messages_as_json(legacy_db_file):
+    Executor(db_file_full_path=legacy_db_file).migrate_db()
+    connection = sqlite3.connect(legacy_db_file)
+    messages = [ row[0] for row in connection.execute("SELECT message FROM task_logs ORDER BY id") ]
+    connection.close()
+    assert [ json.loads(message) for message in messages ] == \
+        [{ "returnCode": 0, "stdout": "it's done", "stderr": None }, { "returnCode": 1 }]
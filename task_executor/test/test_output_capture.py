@@ -0,0 +1,56 @@
+import datetime
+import gzip
+import json
+from task_executor.executor import Executor
+from task_executor.model.orm import Status
+from task_executor.output_capture import OutputPolicy, StreamCapture
+from task_executor.process_runner import run_process
+from task_executor.result_writer import Completion
+
+def test_stream_capture_keeps_head_and_tail():
+    capture = StreamCapture(max_bytes=10)
+    for chunk in [b"0123", b"4567", b"89ab", b"cdef"]:
+        capture.feed(chunk)
+    assert capture.total_bytes == 16
+    assert capture.truncated
+    assert capture.text() == "01234\n...[6 bytes truncated]...\nbcdef"
+
+def test_stream_capture_short_output_is_untouched():
+    capture = StreamCapture(max_bytes=10)
+    capture.feed(b"line\r\n")
+    assert not capture.truncated
+    assert capture.text() == "line\n"
+    assert capture.spilled_to is None
+
+def test_stream_capture_spills_full_output(tmp_path):
+    capture = OutputPolicy(max_bytes=8, spill_dir=str(tmp_path)).capture(7, "stdout")
+    for chunk in [b"abc", b"defgh", b"ijklmnop"]:
+        capture.feed(chunk)
+    capture.close()
+    assert capture.spilled_to == str(tmp_path / "task-7.stdout.gz")
+    with gzip.open(capture.spilled_to) as file:
+        assert file.read() == b"abcdefghijklmnop"
+
+def test_run_process_bounds_memory_of_chatty_command(tmp_path):
+    policy = OutputPolicy(max_bytes=1024, spill_dir=str(tmp_path))
+    result = run_process(["bash", "-c", "head -c 1000000 /dev/zero | tr '\\0' x; echo done >&2; exit 2"], policy, task_id=1)
+    assert result.return_code == 2
+    assert result.stdout_bytes == 1000000
+    assert len(result.stdout) < 1100
+    assert result.stderr == "done\n"
+    assert result.stderr_path is None
+    with gzip.open(result.stdout_path) as file:
+        assert len(file.read()) == 1000000
+
+def test_completion_columns_are_stored(tmp_path):
+    executor: Executor = Executor(db_file_full_path=str(tmp_path / "capture.sqlite"))
+    executor.create_db()
+    executor.add_task(tag="capture", content="{ 'command': [ 'echo', '0' ] }")
+    executor.get_next_batch("capture", Status.NEW)
+    result = run_process(["echo", "0"], task_id=1)
+    executor.complete_tasks([ Completion.from_result(1, result, created_at=datetime.datetime.now()) ])
+    task_log = executor.get_task_by_id(id=1).task_logs[0]
+    assert task_log.status == Status.COMPLETED_OK
+    assert (task_log.return_code, task_log.stdout_bytes, task_log.stderr_bytes) == (0, 2, 0)
+    assert task_log.duration > 0
+    assert json.loads(task_log.message) == { "stdout": "0\n", "stderr": "", "returnCode": 0 }
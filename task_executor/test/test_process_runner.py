@@ -0,0 +1,50 @@
+import asyncio
+import time
+from task_executor.model.orm import Status
+from task_executor.process_runner import TimeoutPolicy, run_process, run_process_async
+from task_executor.result_writer import Completion
+
+
+class FakeTask:
+    def __init__(self, tag, content):
+        self.tag = tag
+        self.content = content
+
+def test_run_process_without_timeout():
+    result = run_process(["echo", "0"], timeout=5)
+    assert (result.return_code, result.stdout, result.timed_out) == (0, "0\n", False)
+
+def test_run_process_timeout_kills_process_group():
+    start = time.monotonic()
+    # The background sleep keeps stdout open, it must be killed with its parent
+    result = run_process(["bash", "-c", "echo started; sleep 30 & sleep 30"], timeout=0.5)
+    assert time.monotonic() - start < 3
+    assert result.timed_out
+    assert result.stdout == "started\n"
+    assert result.return_code < 0
+
+def test_run_process_timeout_escalates_to_sigkill():
+    start = time.monotonic()
+    result = run_process(["bash", "-c", "trap '' TERM; sleep 30"], timeout=0.3, kill_grace=0.5)
+    assert time.monotonic() - start < 3
+    assert result.timed_out
+    assert result.duration >= 0.8
+
+def test_run_process_async_timeout():
+    result = asyncio.run(run_process_async(["bash", "-c", "sleep 30 & sleep 30"], timeout=0.5, kill_grace=0.5))
+    assert result.timed_out
+    assert result.duration < 3
+
+def test_timed_out_completion_status():
+    result = run_process(["sleep", "30"], timeout=0.2)
+    completion = Completion.from_result(1, result)
+    assert completion.status == Status.TIMED_OUT
+    assert completion.message["timedOut"]
+    assert completion.duration == result.duration
+
+def test_timeout_policy_precedence():
+    policy = TimeoutPolicy(timeout=300, tag_timeout={ "slow": 60 }.get)
+    assert policy.timeout_for(FakeTask("slow", { "command": ["true"], "timeout": 5 })) == 5
+    assert policy.timeout_for(FakeTask("slow", { "command": ["true"] })) == 60
+    assert policy.timeout_for(FakeTask("other", { "command": ["true"] })) == 300
+    assert TimeoutPolicy().timeout_for(FakeTask("other", { "command": ["true"] })) is None
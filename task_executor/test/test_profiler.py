@@ -0,0 +1,40 @@
+import time
+from pytest import approx, fixture
+from task_executor.executor import Executor
+from task_executor.model.orm import Status
+from task_executor.profiler import PHASES, TaskProfile
+from task_executor.result_writer import Completion
+
+TAG = "task-profileTest"
+
+@fixture
+def executor(executor) -> Executor:
+    executor.add_multi_task(tag=TAG, content_list=["{ 'command': [ 'echo', '0' ] }"] * 2)
+    return executor
+
+def test_claim_records_claim_time(executor):
+    task = executor.get_next_batch(TAG, Status.NEW, batch_size=1)[0]
+    assert task.claimed_at == approx(time.time(), abs=5)
+    assert task.claim_duration >= 0
+
+def test_completion_phases_are_written(executor):
+    task = executor.get_next_batch(TAG, Status.NEW, batch_size=1, worker_id="host:1")[0]
+    time.sleep(0.1)
+    completion = Completion(task.id, Status.COMPLETED_OK, "done", duration=0.05, spawn_duration=0.01).track(task)
+    completion.hostname = "host"
+    executor.complete_tasks([completion])
+    row = executor.get_task_phases(TAG)[0]
+    assert (row["task_id"], row["worker_id"], row["hostname"]) == (task.id, "host:1", "host")
+    assert row["spawn_duration"] == approx(0.01)
+    assert row["exec_duration"] == approx(0.04)
+    assert row["queue_wait"] >= 0 and row["pickup_wait"] >= 0 and row["write_wait"] >= 0
+    assert row["total"] >= row["queue_wait"]
+
+def test_profile_percentiles_and_slowest_tasks():
+    rows = [ dict({ phase: float(i) for phase in PHASES }, tag=TAG, task_id=i, status=Status.COMPLETED_OK, worker_id="w")
+             for i in range(1, 101) ]
+    profile = TaskProfile(rows, top=2).summary()[TAG]
+    assert profile["runs"] == 100
+    assert profile["phases"]["exec_duration"] == { "p50": 50.0, "p95": 95.0, "p99": 99.0, "max": 100.0 }
+    assert [ row["task_id"] for row in profile["slowest"] ] == [100, 99]
+    assert "slowest 2 tasks" in TaskProfile(rows, top=2).format()
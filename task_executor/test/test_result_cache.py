@@ -0,0 +1,84 @@
+import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pytest import fixture
+from task_executor.executor import Executor
+from task_executor.model.orm import Status
+from task_executor.result_cache import ResultCache
+from task_executor.result_writer import Completion
+
+TAG = "task-cacheTest"
+
+@fixture
+def executor(executor) -> Executor:
+    executor.add_multi_task(tag=TAG, content_list=["{ 'command': [ 'az', 'tag', 'list' ] }"] * 3)
+    return executor
+
+def completed_ok(task, runs):
+    runs.append(task.id)
+    return Completion(task.id, Status.COMPLETED_OK, { "stdout": "tags", "stderr": "", "returnCode": 0 }, return_code=0)
+
+def test_key_ignores_key_order_priority_and_timeout():
+    assert ResultCache.key({ "command": ["ls"], "env": "a" }) == ResultCache.key({ "env": "a", "command": ["ls"], "priority": 3, "timeout": 5 })
+    assert ResultCache.key({ "command": ["ls"] }) != ResultCache.key({ "command": ["ls", "-l"] })
+    assert ResultCache.key({ "command": ["ls"] }) == ResultCache.key({ "command": ["ls"], "depends_on": [1, "list"] })
+    assert ResultCache.key({ "command": ["ls"], "cache": False }) is None
+
+def test_completed_ok_result_is_reused(executor):
+    cache, runs = ResultCache(executor, ttl=60), []
+    first, second = executor.get_next_batch(TAG, Status.NEW, batch_size=2)
+    cache.run(first, datetime.datetime.now(), lambda: completed_ok(first, runs))
+    completion = cache.run(second, datetime.datetime.now(), lambda: completed_ok(second, runs))
+    assert runs == [first.id]
+    assert completion.message["cacheHit"] and completion.message["cachedTaskId"] == first.id
+    assert (completion.task_id, completion.status, completion.message["stdout"]) == (second.id, Status.COMPLETED_OK, "tags")
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+    assert executor.cache_summary() == { "entries": 1, "bytes": executor.get_cached_result(ResultCache.key(first.content)).size, "hits": 1 }
+
+def test_errors_and_expired_results_are_not_reused(executor):
+    cache, runs = ResultCache(executor, ttl=0.1), []
+    first, second, third = executor.get_next_batch(TAG, Status.NEW, batch_size=3)
+    failed = lambda task: runs.append(task.id) or Completion(task.id, Status.COMPLETED_ERROR, { "returnCode": 1 }, return_code=1)
+    cache.run(first, None, lambda: failed(first))
+    cache.run(second, None, lambda: completed_ok(second, runs))
+    time.sleep(0.2)
+    cache.run(third, None, lambda: completed_ok(third, runs))
+    assert runs == [first.id, second.id, third.id]
+
+def test_identical_commands_in_flight_run_once(executor):
+    cache, runs, release = ResultCache(executor, ttl=60), [], threading.Event()
+    tasks = executor.get_next_batch(TAG, Status.NEW, batch_size=3)
+    def slow(task):
+        release.wait(5)
+        return completed_ok(task, runs)
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [ pool.submit(cache.run, task, None, lambda task=task: slow(task)) for task in tasks ]
+        time.sleep(0.2)
+        release.set()
+        completions = [ future.result() for future in futures ]
+    assert len(runs) == 1
+    assert sorted(c.message.get("cacheHit", False) for c in completions) == [False, True, True]
+
+def test_followers_do_not_hang_on_a_leader_message_not_a_dict(executor):
+    cache, release = ResultCache(executor, ttl=60), threading.Event()
+    tasks = executor.get_next_batch(TAG, Status.NEW, batch_size=3)
+    def plain(task):
+        release.wait(5)
+        return Completion(task.id, Status.COMPLETED_OK, "tags", return_code=0)
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [ pool.submit(cache.run, task, None, lambda task=task: plain(task)) for task in tasks ]
+        time.sleep(0.2)
+        release.set()
+        completions = [ future.result(timeout=5) for future in futures ]
+    assert sorted(c.message["output"] for c in completions if isinstance(c.message, dict)) == ["tags", "tags"]
+
+def test_eviction_keeps_most_recently_used_within_max_bytes(executor):
+    for key in ("a", "b", "c"):
+        executor.put_cached_result(key, 1, "x" * 100)
+        time.sleep(0.01)
+    executor.record_cache_hits({ "a": 1 })
+    assert executor.evict_cached_results(max_bytes=250) == 1
+    assert executor.get_cached_result("b") is None
+    assert executor.get_cached_result("a").hits == 1
@@ -0,0 +1,62 @@
+import datetime
+import pytest
+from pytest import fixture
+from task_executor.exceptions import TaskLogError
+from task_executor.executor import Executor
+from task_executor.model.orm import Status
+from task_executor.result_writer import Completion, ResultWriter
+
+TAG = "task-resultWriterTest"
+
+@fixture
+def executor(executor) -> Executor:
+    executor.add_multi_task(tag=TAG, content_list=["{ 'command': [ 'echo', '0' ] }"] * 25)
+    return executor
+
+class SpyExecutor:
+    def __init__(self, executor):
+        self.executor = executor
+        self.batches = []
+
+    def complete_tasks(self, completions):
+        self.batches.append(len(completions))
+        self.executor.complete_tasks(completions)
+
+class BrokenExecutor:
+    def complete_tasks(self, completions):
+        raise RuntimeError("database is locked")
+
+def test_result_writer_commits_status_and_log(executor):
+    tasks = executor.get_next_batch(TAG, Status.NEW, batch_size=25)
+    with ResultWriter(executor) as writer:
+        for task in tasks:
+            writer.submit(Completion(task.id, Status.COMPLETED_OK, { "returnCode": 0 }, created_at=datetime.datetime.now()))
+    assert writer.written == 25
+    for task in executor.get_task_by_tag(TAG):
+        assert task.status == Status.COMPLETED_OK
+        assert len(task.task_logs) == 1
+        assert task.task_logs[0].status == Status.COMPLETED_OK
+
+def test_result_writer_groups_completions_per_transaction(executor):
+    executor.get_next_batch(TAG, Status.NEW, batch_size=25)
+    spy = SpyExecutor(executor)
+    writer = ResultWriter(spy, max_batch=10, max_delay=5)
+    for id in range(1, 26):
+        writer.submit(Completion(id, Status.COMPLETED_ERROR, { "returnCode": 1 }))
+    writer.start()
+    writer.close()
+    assert spy.batches == [10, 10, 5]
+
+def test_result_writer_flush_waits_for_commit(executor):
+    executor.get_next_batch(TAG, Status.NEW)
+    with ResultWriter(executor, max_delay=60) as writer:
+        writer.submit(Completion(1, Status.COMPLETED_OK, { "returnCode": 0 }))
+        writer.flush()
+        assert executor.get_task_by_id(id=1).status == Status.COMPLETED_OK
+
+def test_result_writer_close_reports_lost_completions():
+    writer = ResultWriter(BrokenExecutor(), max_retries=1)
+    writer.start()
+    writer.submit(Completion(1, Status.COMPLETED_OK, { "returnCode": 0 }))
+    with pytest.raises(TaskLogError, match=r".*could not be written.*"):
+        writer.close()
@@ -0,0 +1,65 @@
+import datetime
+import gzip
+import json
+import time
+from task_executor.executor import Executor
+from task_executor.model.orm import Status
+from task_executor.result_writer import Completion
+from task_executor.retention import Retention, open_archive
+
+def finish(executor, tag, count, status=Status.COMPLETED_OK, size=10):
+    executor.insert_tasks(tag, [ { "command": ["echo", "x" * size] } ] * count)
+    tasks = executor.get_next_batch(tag, Status.NEW, batch_size=count)
+    executor.complete_tasks([ Completion(task.id, status, { "stdout": "y" * size }) for task in tasks ])
+    time.sleep(0.01)
+    return [ task.id for task in tasks ]
+
+def test_finished_tasks_move_to_a_gzip_archive(executor, tmp_path):
+    done = finish(executor, "a", 5) + finish(executor, "b", 2, status=Status.TIMED_OUT)
+    executor.insert_tasks("a", [ { "command": ["true"] } ] * 2)
+    path = str(tmp_path / "archive.jsonl.gz")
+    archive = open_archive(path)
+    result = Retention(executor, older_than=0, archive=archive, batch_size=3, pause=0).run()
+    archive.close()
+    assert (result["archived"], result["deleted"]) == (7, 7)
+    with gzip.open(path, "rt") as file:
+        records = [ json.loads(line) for line in file ]
+    assert [ record["id"] for record in records ] == done
+    assert records[-1]["status"] == "TIMED_OUT"
+    assert records[0]["logs"][0]["message"] == { "stdout": "y" * 10 }
+    assert executor.count_tasks_by_tag_and_status() == [("a", Status.NEW, 2)]
+
+def test_policy_keeps_recent_tasks_other_statuses_and_tags(executor):
+    finish(executor, "a", 2)
+    finish(executor, "b", 2, status=Status.COMPLETED_ERROR)
+    assert Retention(executor, older_than=3600, pause=0).run()["deleted"] == 0
+    assert Retention(executor, older_than=0, statuses=[Status.COMPLETED_OK], tag="b", pause=0).run()["deleted"] == 0
+    assert Retention(executor, older_than=0, statuses=[Status.COMPLETED_ERROR], pause=0).run()["deleted"] == 2
+    assert executor.count_tasks_by_tag_and_status() == [("a", Status.COMPLETED_OK, 2)]
+
+def test_parents_of_waiting_tasks_stay(executor):
+    finish(executor, "list", 2)
+    executor.add_task("fetch", { "command": ["true"], "depends_on": ["list", "later"] })
+    assert Retention(executor, older_than=0, pause=0).run()["deleted"] == 0
+    assert executor.count_tasks_by_tag(Status.WAITING) == { "fetch": 1 }
+
+def test_sqlite_archive_keeps_ids_and_logs(executor, tmp_path):
+    done = finish(executor, "a", 3)
+    path = str(tmp_path / "archive.sqlite")
+    archive = open_archive(path)
+    tasks = executor.get_expired_tasks(datetime.datetime.now())
+    archive.write(tasks)
+    archive.write(tasks)
+    archive.close()
+    archived = Executor(db_file_full_path=path)
+    assert [ task.id for task in archived.iter_tasks() ] == done
+    assert json.loads(archived.get_task_by_id(done[0]).task_logs[0].message) == { "stdout": "y" * 10 }
+
+def test_incremental_vacuum_shrinks_the_file(executor):
+    finish(executor, "a", 500, size=4000)
+    file_size = lambda: executor.engine.pragma("page_count") * executor.engine.pragma("page_size")
+    before = file_size()
+    result = Retention(executor, older_than=0, batch_size=100, pause=0, vacuum_pages=200).run()
+    assert result["deleted"] == 500 and result["pages"] > 0
+    assert executor.engine.pragma("freelist_count") == 0
+    assert file_size() < before / 4
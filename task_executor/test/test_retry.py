@@ -0,0 +1,59 @@
+import time
+from pytest import fixture, raises
+from task_executor.executor import Executor
+from task_executor.model.orm import Status
+from task_executor.result_writer import Completion
+from task_executor.retry import RetryPolicy
+
+TAG = "task-retryTest"
+
+@fixture
+def executor(executor) -> Executor:
+    executor.add_multi_task(tag=TAG, content_list=["{ 'command': [ 'false' ] }"] * 2)
+    return executor
+
+def test_default_policy_never_retries():
+    assert RetryPolicy().retry_at(1, Status.COMPLETED_ERROR, 1) is None
+
+def test_retry_on_error_until_max_attempts():
+    policy = RetryPolicy(max_attempts=3, backoff=0, jitter="none")
+    assert policy.should_retry(1, Status.COMPLETED_ERROR, 1)
+    assert policy.should_retry(2, Status.COMPLETED_ERROR, 1)
+    assert not policy.should_retry(3, Status.COMPLETED_ERROR, 1)
+    assert not policy.should_retry(1, Status.COMPLETED_OK, 0)
+
+def test_retry_on_selected_return_codes_and_timeouts():
+    policy = RetryPolicy(max_attempts=3, retry_on=[255])
+    assert policy.should_retry(1, Status.COMPLETED_ERROR, 255)
+    assert not policy.should_retry(1, Status.COMPLETED_ERROR, 1)
+    assert not policy.should_retry(1, Status.TIMED_OUT, None)
+    assert RetryPolicy(max_attempts=3, retry_timeouts=True).should_retry(1, Status.TIMED_OUT, None)
+
+def test_backoff_doubles_up_to_max():
+    policy = RetryPolicy(max_attempts=10, backoff=1, backoff_max=5, jitter="none")
+    assert [ policy.delay(attempts) for attempts in range(1, 5) ] == [1, 2, 4, 5]
+    jittered = RetryPolicy(max_attempts=10, backoff=1, backoff_max=5)
+    assert all(0 <= jittered.delay(4) <= 5 for _ in range(100))
+
+def test_unknown_jitter_throw_exception():
+    with raises(ValueError):
+        RetryPolicy(jitter="half")
+
+def test_claim_counts_attempts(executor):
+    task = executor.get_next_batch(TAG, Status.NEW, batch_size=1)[0]
+    assert task.attempts == 1
+
+def test_retry_goes_back_to_re_process_not_before_retry_at(executor):
+    task = executor.get_next_batch(TAG, Status.NEW, batch_size=1)[0]
+    executor.complete_tasks([ Completion(task.id, Status.COMPLETED_ERROR, "failed", return_code=1,
+                                         retry_at=time.time() + 60) ])
+    assert executor.get_task_by_id(task.id).status == Status.RE_PROCESS
+    assert executor.get_next_batch(TAG, [Status.NEW, Status.RE_PROCESS], batch_size=2)[0].id != task.id
+    assert executor.next_retry_at(TAG) > time.time() + 50
+
+def test_due_retry_is_claimed_again(executor):
+    task = executor.get_next_batch(TAG, Status.NEW, batch_size=1)[0]
+    executor.complete_tasks([ Completion(task.id, Status.COMPLETED_ERROR, "failed", return_code=1,
+                                         retry_at=time.time() - 1) ])
+    retried = executor.get_next_batch(TAG, Status.RE_PROCESS, batch_size=1)[0]
+    assert (retried.id, retried.attempts) == (task.id, 2)
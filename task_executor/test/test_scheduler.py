@@ -0,0 +1,59 @@
+import threading
+import time
+from task_executor.scheduler import StreamingScheduler
+
+
+class FakeTask:
+    def __init__(self, id, duration):
+        self.id = id
+        self.duration = duration
+
+class FakeQueue:
+    def __init__(self, durations):
+        self.tasks = [ FakeTask(id, duration) for id, duration in enumerate(durations) ]
+        self.lock = threading.Lock()
+
+    def claim(self, batch_size):
+        with self.lock:
+            batch, self.tasks = self.tasks[:batch_size], self.tasks[batch_size:]
+            return batch
+
+class Progress:
+    def __init__(self):
+        self.n = 0
+
+    def update(self, n):
+        self.n += n
+
+def test_streaming_scheduler_runs_every_task():
+    queue = FakeQueue([0] * 25)
+    done = []
+    progress = Progress()
+    finished = StreamingScheduler(claim=queue.claim, run_task=lambda task: done.append(task.id),
+                                  batch_size=4, max_workers=3, progress=progress).run()
+    assert finished == 25
+    assert progress.n == 25
+    assert sorted(done) == list(range(25))
+
+def test_streaming_scheduler_refills_slot_without_waiting_for_slow_task():
+    # One slow task must not hold back the rest of its batch
+    queue = FakeQueue([1.0] + [0.01] * 20)
+    done = []
+
+    def run_task(task):
+        time.sleep(task.duration)
+        done.append(task.id)
+
+    start = time.monotonic()
+    StreamingScheduler(claim=queue.claim, run_task=run_task, batch_size=2, max_workers=2).run()
+    assert done[-1] == 0
+    assert time.monotonic() - start < 1.5
+
+def test_streaming_scheduler_survives_failing_task():
+    queue = FakeQueue([0] * 5)
+
+    def run_task(task):
+        if task.id == 2:
+            raise RuntimeError("boom")
+
+    assert StreamingScheduler(claim=queue.claim, run_task=run_task, batch_size=2, max_workers=2).run() == 5
@@ -0,0 +1,48 @@
+from pytest import approx, fixture
+from task_executor.executor import Executor
+from task_executor.model.orm import Status
+from task_executor.result_writer import Completion
+from task_executor.stats import TaskStats, parse_windows, percentile
+
+TAG = "task-statsTest"
+OTHER_TAG = "task-statsTest-other"
+
+@fixture
+def executor(executor) -> Executor:
+    executor.add_multi_task(tag=TAG, content_list=["{ 'command': [ 'echo', '0' ] }"] * 5)
+    executor.add_multi_task(tag=OTHER_TAG, content_list=["{ 'command': [ 'echo', '1' ] }"] * 2)
+    return executor
+
+def test_counts_per_tag_and_status(executor):
+    tasks = executor.get_next_batch(TAG, Status.NEW, batch_size=3)
+    executor.complete_tasks([ Completion(task.id, Status.COMPLETED_OK, "done") for task in tasks[:2] ])
+    stats = executor.stats(windows=(60, 300))
+    assert stats[TAG]["statuses"] == { "NEW": 2, "IN_PROGRESS": 1, "COMPLETED_OK": 2 }
+    assert (stats[TAG]["total"], stats[TAG]["done"], stats[TAG]["remaining"]) == (5, 2, 3)
+    assert stats[TAG]["throughput"] == { "60s": approx(2 / 60), "300s": approx(2 / 300) }
+    assert stats[TAG]["eta_seconds"] == approx(3 / (2 / 60))
+    assert stats[OTHER_TAG]["eta_seconds"] is None
+    assert stats["*"]["total"] == 7 and stats["*"]["remaining"] == 5
+    assert executor.count_tasks_by_tag([Status.NEW, Status.IN_PROGRESS]) == { TAG: 3, OTHER_TAG: 2 }
+
+def test_stats_of_one_tag(executor):
+    stats = executor.stats(tag=OTHER_TAG)
+    assert list(stats) == [OTHER_TAG]
+    assert stats[OTHER_TAG]["statuses"] == { "NEW": 2 }
+
+def test_finished_tag_has_no_eta_left():
+    stats = TaskStats([ (TAG, Status.COMPLETED_OK, 4), (TAG, Status.TIMED_OUT, 1) ], {}, windows="60")
+    summary = stats.summary()[TAG]
+    assert summary["eta_seconds"] == 0 and summary["done"] == 5
+    assert "100.0%" in stats.format()
+
+def test_parse_windows():
+    assert parse_windows("300,60") == [60.0, 300.0]
+    assert parse_windows((900, 60)) == [60.0, 900.0]
+    assert parse_windows(30) == [30.0]
+
+def test_percentile():
+    values = [ float(value) for value in range(1, 101) ]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 50) is None
@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import time
+from pytest import approx, raises
+from task_executor.model.orm import Status
+from task_executor.result_writer import Completion
+from task_executor.throttle import AimdController, RateLimiter, TokenBucket
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def completion(return_code=0, stderr="", duration=0.1, status=None):
+    status = status or (Status.COMPLETED_OK if return_code == 0 else Status.COMPLETED_ERROR)
+    return Completion(1, status, { "stdout": "", "stderr": stderr, "returnCode": return_code },
+                      return_code=return_code, duration=duration)
+
+def test_token_bucket_spaces_out_reservations():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=10, burst=2, clock=clock)
+    assert [ bucket.reserve() for _ in range(4) ] == approx([0, 0, 0.1, 0.2])
+    clock.now = 1.0
+    assert bucket.reserve() == 0
+    with raises(ValueError):
+        TokenBucket(rate=0)
+
+def test_rate_limiter_tag_rate_wins():
+    limiter = RateLimiter(rate=1000, tag_rate=lambda tag: 2 if tag == "slow" else None)
+    assert limiter.bucket("slow").rate == 2
+    assert limiter.bucket("fast").rate == 1000
+    assert RateLimiter().bucket("any") is None
+    started = time.monotonic()
+    for _ in range(3):
+        limiter.wait("slow")
+    assert time.monotonic() - started == approx(1.0, abs=0.2)
+
+def test_aimd_slow_start_then_additive_increase():
+    controller = AimdController(max_limit=16)
+    assert controller.limit == 1
+    for _ in range(3):
+        controller.release(controller.acquire(), completion())
+    assert controller.limit == 4
+    controller.release(controller.acquire(), completion(return_code=1))
+    assert (controller.limit, controller.slow_start) == (2, False)
+    for _ in range(2):
+        controller.release(controller.acquire(), completion())
+    assert controller.limit == approx(2 + 1 / 2 + 1 / 2.5)
+
+def test_aimd_backs_off_once_per_wave():
+    clock = FakeClock()
+    controller = AimdController(max_limit=8, initial=8, stderr_patterns=["TooManyRequests"], clock=clock)
+    slots = [ controller.acquire() for _ in range(8) ]
+    clock.now = 1.0
+    for slot in slots:
+        controller.release(slot, completion(return_code=1))
+    assert controller.limit == 4 and controller.decreases == 1
+    for _ in range(5):
+        controller.release(controller.acquire(), completion(stderr="ERROR: TooManyRequests"))
+        clock.now += 1
+    assert controller.limit == 1
+
+def test_aimd_signals():
+    controller = AimdController(max_limit=8, codes=[255], stderr_patterns=["429|TooManyRequests"], latency_target=5)
+    assert not controller.congested(completion(return_code=1))
+    assert controller.congested(completion(return_code=255))
+    assert controller.congested(completion(stderr="HTTP 429"))
+    assert controller.congested(completion(duration=6))
+    assert controller.congested(completion(return_code=-9, status=Status.TIMED_OUT))
+    assert not controller.congested(completion())
+
+def test_aimd_blocks_threads_at_the_limit():
+    controller = AimdController(max_limit=4, initial=2)
+    running, peak = [0], [0]
+    lock = threading.Lock()
+
+    def work():
+        slot = controller.acquire()
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        controller.release(slot, completion(return_code=1))
+
+    threads = [ threading.Thread(target=work) for _ in range(8) ]
+    [ thread.start() for thread in threads ]
+    [ thread.join() for thread in threads ]
+    assert peak[0] <= 2 and controller.in_flight == 0
+
+def test_aimd_async_waiters_are_woken():
+    controller = AimdController(max_limit=2, initial=1)
+    order = []
+
+    async def work(name):
+        slot = await controller.acquire_async()
+        order.append(name)
+        await asyncio.sleep(0.01)
+        controller.release(slot)
+
+    async def main():
+        await asyncio.gather(*(work(name) for name in range(4)))
+
+    asyncio.run(main())
+    assert sorted(order) == [0, 1, 2, 3] and controller.in_flight == 0
@@ -0,0 +1,55 @@
+import time
+from pytest import fixture
+from task_executor.executor import Executor
+from task_executor.model.orm import Status
+from task_executor.result_writer import Completion
+from task_executor.worker import TaskWorker
+
+TAG = "task-workerTest"
+
+@fixture
+def executor(executor) -> Executor:
+    executor.add_multi_task(tag=TAG, content_list=["{ 'command': [ 'echo', '0' ] }"] * 6)
+    return executor
+
+def test_worker_registers_and_deregisters(executor):
+    with TaskWorker(executor, lease_seconds=30) as worker:
+        workers = executor.get_workers()
+        assert [ (w.id, w.status) for w in workers ] == [ (worker.worker_id, "active") ]
+    assert executor.get_workers()[0].status == "stopped"
+
+def test_worker_claim_leases_tasks(executor):
+    with TaskWorker(executor, lease_seconds=30) as worker:
+        tasks = worker.claim(TAG, batch_size=2)
+        assert [ task.worker_id for task in tasks ] == [ worker.worker_id ] * 2
+        assert all(task.lease_expires_at > time.time() + 20 for task in tasks)
+
+def test_workers_never_claim_the_same_task(executor):
+    with TaskWorker(executor) as first, TaskWorker(executor) as second:
+        claimed = [ task.id for task in first.claim(TAG, 4) + second.claim(TAG, 4) + first.claim(TAG, 4) ]
+    assert sorted(claimed) == list(range(1, 7))
+
+def test_heartbeat_renews_leases(executor):
+    worker = TaskWorker(executor, lease_seconds=0.5)
+    worker.claim(TAG, batch_size=2)
+    time.sleep(0.3)
+    worker.heartbeat()
+    time.sleep(0.3)
+    assert executor.reclaim_expired_leases() == 0
+
+def test_expired_leases_are_reclaimed_as_re_process(executor):
+    crashed = TaskWorker(executor, lease_seconds=0.1)
+    crashed.claim(TAG, batch_size=2)
+    time.sleep(0.2)
+    assert executor.reclaim_expired_leases() == 2
+    assert len(executor.get_task_by_tag_and_status(TAG, Status.RE_PROCESS)) == 2
+    with TaskWorker(executor, lease_seconds=30) as worker:
+        assert [ task.id for task in worker.claim(TAG, batch_size=2) ] == [1, 2]
+
+def test_completed_task_keeps_no_lease(executor):
+    worker = TaskWorker(executor, lease_seconds=0.1)
+    task = worker.claim(TAG, batch_size=1)[0]
+    executor.complete_tasks([ Completion(task.id, Status.COMPLETED_OK, { "returnCode": 0 }).track(task) ])
+    time.sleep(0.2)
+    assert executor.reclaim_expired_leases() == 0
+    assert executor.get_task_by_id(id=task.id).status == Status.COMPLETED_OK
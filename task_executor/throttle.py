@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import re
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, Optional
+from .model.orm import Status
+
+
+class TokenBucket:
+    """
+    rate tokens per second, at most burst of them saved up (1 by default, i.e. evenly spaced).
+    reserve() takes a token at once and returns how long to wait before using it, so callers
+    waiting for a token are served in order whether they sleep on a thread or in asyncio.
+    """
+
+    def __init__(self, rate: float, burst: float = None, clock: Callable[[], float] = time.monotonic):
+        if float(rate) <= 0:
+            raise ValueError(f"rate must be positive: {rate}")
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst or 1))
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class RateLimiter:
+    """
+    Commands per second of each tag, one token bucket per tag.
+
+    The rate of a tag is tag_rate(tag) when set (e.g. the rate of its tag settings), else rate,
+    None or 0 means no limit. The buckets live in this process, with several workers sharing
+    a database each one gets the full rate.
+
+    limiter = RateLimiter(rate=5, tag_rate=lambda tag: settings[tag].rate)
+    limiter.wait(task.tag)
+    """
+
+    def __init__(self, rate: float = None, burst: float = None, tag_rate: Callable[[str], Optional[float]] = None):
+        self.rate = float(rate) if rate else None
+        self.burst = burst
+        self.tag_rate = tag_rate
+        self.buckets: Dict[str, Optional[TokenBucket]] = {}
+        self.lock = threading.Lock()
+        self.waited = 0.0
+
+    def bucket(self, tag) -> Optional[TokenBucket]:
+        with self.lock:
+            if tag not in self.buckets:
+                rate = self.tag_rate(tag) if self.tag_rate is not None else None
+                rate = rate if rate is not None else self.rate
+                self.buckets[tag] = TokenBucket(rate, self.burst) if rate else None
+            return self.buckets[tag]
+
+    def delay(self, tag) -> float:
+        bucket = self.bucket(tag)
+        delay = bucket.reserve() if bucket is not None else 0.0
+        if delay > 0:
+            with self.lock:
+                self.waited += delay
+        return delay
+
+    def wait(self, tag) -> None:
+        delay = self.delay(tag)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self, tag) -> None:
+        delay = self.delay(tag)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class AimdController:
+    """
+    Commands in flight, adapted to what the backend takes: additive increase, multiplicative decrease.
+
+    A finished command is a congestion signal when its return code is non zero (or one of codes),
+    its stderr matches one of stderr_patterns, it timed out, or it ran longer than latency_target
+    seconds. On a signal the limit is multiplied by decrease, at most once per wave of commands:
+    only commands started after the last decrease can lower it again. Otherwise the limit grows by
+    1 per command until the first signal (slow start), then by increase per limit commands, i.e.
+    by increase per round trip. The limit stays between min_limit and max_limit.
+
+    controller = AimdController(max_limit=32, stderr_patterns=["TooManyRequests", "429"])
+    started = controller.acquire()
+    ... run the command ...
+    controller.release(started, completion)
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1, initial: float = None, increase: float = 1.0,
+                 decrease: float = 0.5, codes: Iterable[int] = None, stderr_patterns: Iterable[str] = (),
+                 latency_target: float = None, clock: Callable[[], float] = time.monotonic):
+        if not 0 < float(decrease) < 1:
+            raise ValueError(f"decrease must be between 0 and 1: {decrease}")
+        self.max_limit = max(1, int(max_limit))
+        self.min_limit = max(1, min(int(min_limit), self.max_limit))
+        self.limit = float(initial) if initial else float(self.min_limit)
+        self.limit = min(float(self.max_limit), max(float(self.min_limit), self.limit))
+        self.increase = float(increase)
+        self.decrease = float(decrease)
+        self.codes = None if codes is None else { int(code) for code in codes }
+        self.stderr_patterns = [ re.compile(pattern) for pattern in stderr_patterns or () ]
+        self.latency_target = float(latency_target) if latency_target else None
+        self.clock = clock
+        self.in_flight = 0
+        self.slow_start = True
+        self.decreased_at = float("-inf")
+        self.decreases = 0
+        self.condition = threading.Condition()
+        self.async_waiters: Deque[asyncio.Future] = deque()
+        self.logger = logging.getLogger(__class__.__name__)
+
+    def acquire(self) -> float:
+        """Wait for a free slot on a thread, return the start time to hand back to release."""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            return self.__take()
+
+    async def acquire_async(self) -> float:
+        """acquire for asyncio, waiting without a thread."""
+        while True:
+            with self.condition:
+                if self.in_flight < int(self.limit):
+                    return self.__take()
+                future = asyncio.get_running_loop().create_future()
+                self.async_waiters.append(future)
+            await future
+
+    def release(self, started: float, completion=None) -> None:
+        """Free the slot taken at started and adapt the limit to completion, None only frees the slot."""
+        with self.condition:
+            self.in_flight -= 1
+            if completion is not None:
+                if self.congested(completion):
+                    self.__back_off(started)
+                elif self.slow_start:
+                    self.limit = min(float(self.max_limit), self.limit + 1)
+                else:
+                    self.limit = min(float(self.max_limit), self.limit + self.increase / self.limit)
+            self.__wake()
+
+    def congested(self, completion) -> bool:
+        if self.latency_target is not None and completion.duration is not None and completion.duration > self.latency_target:
+            return True
+        if completion.status == Status.TIMED_OUT:
+            return True
+        return_code = completion.return_code
+        if return_code not in (0, None) and (self.codes is None or return_code in self.codes):
+            return True
+        if self.stderr_patterns:
+            stderr = completion.message.get("stderr") if isinstance(completion.message, dict) else completion.message
+            if stderr and any(pattern.search(str(stderr)) for pattern in self.stderr_patterns):
+                return True
+        return False
+
+    def __take(self) -> float:
+        self.in_flight += 1
+        return self.clock()
+
+    def __back_off(self, started: float) -> None:
+        if started < self.decreased_at:
+            # Launched before the last decrease, that one already accounted for it
+            return
+        self.slow_start = False
+        self.limit = max(float(self.min_limit), self.limit * self.decrease)
+        self.decreased_at = self.clock()
+        self.decreases += 1
+        self.logger.info(f"Congestion, concurrency limit down to {int(self.limit)}")
+
+    def __wake(self) -> None:
+        free = int(self.limit) - self.in_flight
+        self.condition.notify(max(0, free))
+        while free > 0 and self.async_waiters:
+            future = self.async_waiters.popleft()
+            if not future.done():
+                future.get_loop().call_soon_threadsafe(self.__resolve, future)
+                free -= 1
+
+    @staticmethod
+    def __resolve(future: asyncio.Future) -> None:
+        if not future.done():
+            future.set_result(None)
+
+    def __repr__(self) -> str:
+        return (f"AimdController(limit={self.limit:.2f}, in_flight={self.in_flight!r}, min_limit={self.min_limit!r}, "
+                f"max_limit={self.max_limit!r}, decreases={self.decreases!r})")
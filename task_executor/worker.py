@@ -0,0 +1,70 @@
+import logging
+import os
+import socket
+import threading
+import uuid
+from typing import List
+from .model.orm import Status, Task
+
+
+class TaskWorker:
+    """
+    Identity and task leases of one worker process sharing the database with others.
+
+    Tasks are claimed with a lease of lease_seconds. While the worker runs, a heartbeat thread
+    renews the leases of its tasks every lease_seconds / 3 and gives tasks of crashed workers
+    (expired leases) back to the queue as RE_PROCESS, so N workers on several cores or hosts
+    can drain the same tags without losing tasks.
+
+    with TaskWorker(executor, lease_seconds=60) as worker:
+        tasks = worker.claim(tag='sandpit', batch_size=10)
+    """
+
+    CLAIM_STATUSES = [Status.NEW, Status.RE_PROCESS]
+
+    def __init__(self, executor, lease_seconds: float = 60, worker_id: str = None):
+        self.executor = executor
+        self.lease_seconds = float(lease_seconds)
+        self.hostname = socket.gethostname()
+        self.pid = os.getpid()
+        self.worker_id = worker_id or f"{self.hostname}:{self.pid}:{uuid.uuid4().hex[:8]}"
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.__heartbeat, name="Heartbeat", daemon=True)
+        self.logger = logging.getLogger(__class__.__name__)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self) -> None:
+        self.executor.register_worker(worker_id=self.worker_id, hostname=self.hostname, pid=self.pid)
+        self.executor.reclaim_expired_leases(worker_timeout=self.lease_seconds)
+        self.thread.start()
+        self.logger.info(f"Worker {self.worker_id} started, lease {self.lease_seconds}s")
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.executor.deregister_worker(worker_id=self.worker_id)
+        self.logger.info(f"Worker {self.worker_id} stopped")
+
+    def claim(self, tag, batch_size: int = 1) -> List[Task]:
+        return self.executor.get_next_batch(tag, self.CLAIM_STATUSES, batch_size=batch_size,
+                                            worker_id=self.worker_id, lease_seconds=self.lease_seconds)
+
+    def heartbeat(self) -> None:
+        renewed = self.executor.renew_leases(worker_id=self.worker_id, lease_seconds=self.lease_seconds)
+        reclaimed = self.executor.reclaim_expired_leases(worker_timeout=self.lease_seconds)
+        self.logger.debug(f"Worker {self.worker_id} renewed {renewed} leases, reclaimed {reclaimed} tasks")
+
+    def __heartbeat(self) -> None:
+        while not self.stopped.wait(self.lease_seconds / 3):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                # Keep beating, the lease is only lost after lease_seconds without a renewal
+                self.logger.error(e)